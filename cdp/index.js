@@ -22,6 +22,19 @@ const logger = winston.createLogger({
     ]
 });
 
+// Seconds the Python client is told to wait when the Coinbase API rate limits us and gives no hint
+const RATE_LIMIT_RETRY_AFTER = parseInt(process.env.RATE_LIMIT_RETRY_AFTER || '1', 10);
+
+// Pass Coinbase API rate limits through as 429s (with Retry-After) so the client backs off
+// instead of treating them as failures; everything else is a 500
+const sendError = (res, error) => {
+    if (error.httpCode === 429 || error.status === 429) {
+        res.set('Retry-After', String(error.retryAfter || RATE_LIMIT_RETRY_AFTER));
+        return res.status(429).json({ error: error.message });
+    }
+    res.status(500).json({ error: error.message });
+};
+
 // Initialize Coinbase SDK
 let coinbase;
 (async () => {
@@ -48,11 +61,123 @@ const rehydrateWallet = async (user, walletId) => {
     return wallet;
 };
 
+// The default user never changes, so fetch it once; a failed lookup is retried on the next call
+let defaultUserPromise;
+const getDefaultUser = () => {
+    if (!defaultUserPromise) {
+        defaultUserPromise = coinbase.getDefaultUser().catch((error) => {
+            defaultUserPromise = undefined;
+            throw error;
+        });
+    }
+    return defaultUserPromise;
+};
+
+// Bounded LRU of hydrated wallets. Rehydrating costs a getWallet call plus reading and
+// decrypting the seed file, which hot wallets (e.g. the DEFAULT_WALLET_ID treasury) would
+// otherwise pay on every request. Entries unused for `ttlMs` are dropped, and concurrent
+// misses for the same wallet share a single hydration.
+class WalletCache {
+    constructor({ maxSize, ttlMs }) {
+        this.maxSize = maxSize;
+        this.ttlMs = ttlMs;
+        this.entries = new Map(); // walletId -> { wallet, lastUsed }, least recently used first
+        this.pending = new Map(); // walletId -> hydration in flight
+        this.stats = { hits: 0, misses: 0, coalesced: 0, evictions: 0, expirations: 0, invalidations: 0 };
+    }
+
+    async get(walletId) {
+        const entry = this.entries.get(walletId);
+        if (entry) {
+            this.entries.delete(walletId);
+            if (Date.now() - entry.lastUsed <= this.ttlMs) {
+                entry.lastUsed = Date.now();
+                this.entries.set(walletId, entry);
+                this.stats.hits++;
+                return entry.wallet;
+            }
+            this.stats.expirations++;
+        }
+
+        const inFlight = this.pending.get(walletId);
+        if (inFlight) {
+            this.stats.coalesced++;
+            return inFlight;
+        }
+
+        this.stats.misses++;
+        const hydration = (async () => {
+            const user = await getDefaultUser();
+            return rehydrateWallet(user, walletId);
+        })();
+        this.pending.set(walletId, hydration);
+        try {
+            const wallet = await hydration;
+            // Skip the insert if the wallet was invalidated while it was being hydrated
+            if (this.pending.get(walletId) === hydration) {
+                this.set(walletId, wallet);
+            }
+            return wallet;
+        } finally {
+            if (this.pending.get(walletId) === hydration) {
+                this.pending.delete(walletId);
+            }
+        }
+    }
+
+    set(walletId, wallet) {
+        this.entries.delete(walletId);
+        this.entries.set(walletId, { wallet, lastUsed: Date.now() });
+        while (this.entries.size > this.maxSize) {
+            this.entries.delete(this.entries.keys().next().value);
+            this.stats.evictions++;
+        }
+    }
+
+    invalidate(walletId) {
+        const cached = this.entries.delete(walletId);
+        const inFlight = this.pending.delete(walletId);
+        if (cached || inFlight) {
+            this.stats.invalidations++;
+        }
+        return cached || inFlight;
+    }
+
+    clear() {
+        const count = this.entries.size;
+        this.entries.clear();
+        this.pending.clear();
+        this.stats.invalidations += count;
+        return count;
+    }
+
+    // Drop idle entries so their seeds don't linger in memory until the next lookup
+    sweep() {
+        const now = Date.now();
+        for (const [walletId, entry] of this.entries) {
+            if (now - entry.lastUsed > this.ttlMs) {
+                this.entries.delete(walletId);
+                this.stats.expirations++;
+            }
+        }
+    }
+
+    snapshot() {
+        return { ...this.stats, size: this.entries.size, maxSize: this.maxSize, ttlMs: this.ttlMs };
+    }
+}
+
+const walletCache = new WalletCache({
+    maxSize: parseInt(process.env.WALLET_CACHE_MAX_SIZE || '256', 10),
+    ttlMs: parseInt(process.env.WALLET_CACHE_TTL_MS || '600000', 10),
+});
+setInterval(() => walletCache.sweep(), 60000).unref();
+
 // Create a Wallet
 app.post('/create-wallet', async (req, res) => {
     logger.debug('POST /create-wallet called');
     try {
-        const user = await coinbase.getDefaultUser();
+        const user = await getDefaultUser();
         const wallet = await user.createWallet();
 
         // Save the wallet seed
@@ -71,7 +196,7 @@ app.post('/create-wallet', async (req, res) => {
         res.json({ message: 'Wallet created and seed saved successfully', walletId: wallet.getId() });
     } catch (error) {
         logger.error('Error creating wallet:', error);
-        res.status(500).json({ error: error.message });
+        sendError(res, error);
     }
 });
 
@@ -81,12 +206,8 @@ app.post('/fund-wallet', async (req, res) => {
     try {
         const { walletId } = req.body;
         logger.debug(`walletId: ${walletId}`);
-        let user = await coinbase.getDefaultUser();
-        logger.debug('User retrieved');
-
-        // Rehydrate the wallet
-        const wallet = await rehydrateWallet(user, walletId);
-        logger.debug('Wallet rehydrated');
+        // Rehydrate the wallet, or reuse the cached one
+        const wallet = await walletCache.get(walletId);
         logger.debug(`Wallet is hydrated: ${wallet.canSign()}`);
 
         const faucetTransaction = await wallet.faucet();
@@ -94,7 +215,7 @@ app.post('/fund-wallet', async (req, res) => {
         res.json({ message: 'Faucet transaction completed', transaction: faucetTransaction });
     } catch (error) {
         logger.error('Error funding wallet:', error);
-        res.status(500).json({ error: error.message });
+        sendError(res, error);
     }
 });
 
@@ -104,12 +225,8 @@ app.post('/transfer-funds', async (req, res) => {
     try {
         const { sourceWalletId, destinationWalletAddress, amount } = req.body;
         logger.debug(`sourceWalletId: ${sourceWalletId}, destinationWalletAddress: ${destinationWalletAddress}, amount: ${amount}`);
-        let user = await coinbase.getDefaultUser();
-        logger.debug('User retrieved');
-
-        // Rehydrate the wallet
-        const sourceWallet = await rehydrateWallet(user, sourceWalletId);
-        logger.debug('Wallet rehydrated');
+        // Rehydrate the wallet, or reuse the cached one
+        const sourceWallet = await walletCache.get(sourceWalletId);
         logger.debug(`Wallet is hydrated: ${sourceWallet.canSign()}`);
 
         const transfer = await sourceWallet.createTransfer({
@@ -121,7 +238,7 @@ app.post('/transfer-funds', async (req, res) => {
         res.json({ message: 'Transfer completed successfully', transfer });
     } catch (error) {
         logger.error('Error transferring funds:', error);
-        res.status(500).json({ error: error.message });
+        sendError(res, error);
     }
 });
 
@@ -131,14 +248,13 @@ app.post('/trade-assets', async (req, res) => {
     try {
         const { walletId, fromAssetId, toAssetId, amount } = req.body;
         logger.debug(`walletId: ${walletId}, fromAssetId: ${fromAssetId}, toAssetId: ${toAssetId}, amount: ${amount}`);
-        const user = await coinbase.getDefaultUser();
-        logger.debug('User retrieved');
-
-        // Rehydrate the wallet
-        const wallet = await rehydrateWallet(user, walletId);
-        logger.debug('Wallet rehydrated');
+        // Rehydrate the wallet, or reuse the cached one
+        const wallet = await walletCache.get(walletId);
         logger.debug(`Wallet is hydrated: ${wallet.canSign()}`);
 
+        // `amount` arrives as a decimal string in whole units of fromAssetId. It is passed through
+        // as-is: createTrade scales it to atomic units itself, and a JSON number would already
+        // have been rounded past 2^53
         const trade = await wallet.createTrade({ 
             amount, 
             fromAssetId, 
@@ -148,7 +264,7 @@ app.post('/trade-assets', async (req, res) => {
         res.json({ message: 'Trade completed successfully', trade });
     } catch (error) {
         logger.error('Error trading assets:', error);
-        res.status(500).json({ error: error.message });
+        sendError(res, error);
     }
 });
 
@@ -158,12 +274,8 @@ app.get('/wallet-balance/:walletId', async (req, res) => {
     try {
         const { walletId } = req.params;
         logger.debug(`walletId: ${walletId}`);
-        let user = await coinbase.getDefaultUser();
-        logger.debug('User retrieved');
-
-        // Rehydrate the wallet
-        const wallet = await rehydrateWallet(user, walletId);
-        logger.debug('Wallet rehydrated');
+        // Rehydrate the wallet, or reuse the cached one
+        const wallet = await walletCache.get(walletId);
 
         // Get the balance of ETH
         const balance = await wallet.getBalance(Coinbase.assets.Eth);
@@ -171,7 +283,7 @@ app.get('/wallet-balance/:walletId', async (req, res) => {
         res.json({ message: 'ETH balance retrieved successfully', balance });
     } catch (error) {
         logger.error('Error retrieving wallet balance:', error);
-        res.status(500).json({ error: error.message });
+        sendError(res, error);
     }
 });
 
@@ -181,7 +293,7 @@ app.get('/get-wallet/:walletId', async (req, res) => {
     try {
         const { walletId } = req.params;
         logger.debug(`walletId: ${walletId}`);
-        let user = await coinbase.getDefaultUser();
+        const user = await getDefaultUser();
         logger.debug('User retrieved');
 
         const wallet = await user.getWallet(walletId);
@@ -189,8 +301,26 @@ app.get('/get-wallet/:walletId', async (req, res) => {
         res.json({ message: 'Wallet retrieved successfully', wallet });
     } catch (error) {
         logger.error('Error retrieving wallet:', error);
-        res.status(500).json({ error: error.message });
+        sendError(res, error);
+    }
+});
+
+// Hydrated-wallet cache counters
+app.get('/wallet-cache/stats', (req, res) => {
+    res.json(walletCache.snapshot());
+});
+
+// Drop one wallet from the cache (e.g. after its seed file was replaced), or all of them
+app.post('/wallet-cache/invalidate', (req, res) => {
+    const { walletId } = req.body || {};
+    if (walletId) {
+        const invalidated = walletCache.invalidate(walletId);
+        logger.info(`Wallet cache invalidated for ${walletId}: ${invalidated}`);
+        return res.json({ message: 'Wallet cache entry invalidated', invalidated: invalidated ? 1 : 0 });
     }
+    const invalidated = walletCache.clear();
+    logger.info(`Wallet cache cleared: ${invalidated} entries`);
+    res.json({ message: 'Wallet cache cleared', invalidated });
 });
 
 // Function to start the server
@@ -206,4 +336,4 @@ if (require.main === module) {
     startServer();
 }
 
-module.exports = { app, startServer };
+module.exports = { app, startServer, WalletCache, walletCache };
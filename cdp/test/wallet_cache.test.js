@@ -0,0 +1,138 @@
+// Mock the Coinbase SDK; every wallet the cache hydrates comes from mockUser.getWallet
+const mockUser = { getWallet: jest.fn() };
+
+jest.mock('@coinbase/coinbase-sdk', () => ({
+  Coinbase: {
+    configureFromJson: jest.fn().mockResolvedValue({
+      getDefaultUser: jest.fn().mockResolvedValue(mockUser)
+    })
+  }
+}));
+
+const { WalletCache } = require('../index');
+
+const hydratedWallet = (walletId) => ({ id: walletId, loadSeed: jest.fn().mockResolvedValue() });
+
+// A getWallet call that only completes when the test says so
+const deferredWallet = (walletId) => {
+  let resolve;
+  const promise = new Promise((done) => {
+    resolve = () => done(hydratedWallet(walletId));
+  });
+  mockUser.getWallet.mockImplementationOnce(() => promise);
+  return resolve;
+};
+
+describe('WalletCache', () => {
+  let now;
+  let clock;
+
+  beforeAll(async () => {
+    // Let the SDK finish configuring before the first hydration
+    await new Promise(resolve => setImmediate(resolve));
+  });
+
+  beforeEach(() => {
+    mockUser.getWallet.mockReset();
+    mockUser.getWallet.mockImplementation(async (walletId) => hydratedWallet(walletId));
+    now = 1_000_000;
+    clock = jest.spyOn(Date, 'now').mockImplementation(() => now);
+  });
+
+  afterEach(() => {
+    clock.mockRestore();
+  });
+
+  it('counts a miss, then hits, and hydrates once', async () => {
+    const cache = new WalletCache({ maxSize: 4, ttlMs: 1000 });
+
+    const first = await cache.get('wallet1');
+    const second = await cache.get('wallet1');
+    const third = await cache.get('wallet1');
+
+    expect(second).toBe(first);
+    expect(third).toBe(first);
+    expect(mockUser.getWallet).toHaveBeenCalledTimes(1);
+    expect(first.loadSeed).toHaveBeenCalledTimes(1);
+    expect(cache.snapshot()).toMatchObject({ hits: 2, misses: 1, size: 1 });
+  });
+
+  it('evicts the least recently used wallet at maxSize', async () => {
+    const cache = new WalletCache({ maxSize: 2, ttlMs: 1000 });
+
+    await cache.get('wallet1');
+    await cache.get('wallet2');
+    // wallet1 is now the most recently used, so wallet2 goes first
+    await cache.get('wallet1');
+    await cache.get('wallet3');
+
+    expect([...cache.entries.keys()]).toEqual(['wallet1', 'wallet3']);
+    expect(cache.snapshot()).toMatchObject({ evictions: 1, size: 2 });
+
+    await cache.get('wallet2');
+    expect(mockUser.getWallet).toHaveBeenCalledTimes(4);
+    expect([...cache.entries.keys()]).toEqual(['wallet3', 'wallet2']);
+  });
+
+  it('rehydrates a wallet unused for longer than ttlMs', async () => {
+    const cache = new WalletCache({ maxSize: 4, ttlMs: 1000 });
+
+    const first = await cache.get('wallet1');
+    now += 1000;
+    expect(await cache.get('wallet1')).toBe(first);
+
+    // Each hit restarts the idle clock
+    now += 1001;
+    const second = await cache.get('wallet1');
+
+    expect(second).not.toBe(first);
+    expect(mockUser.getWallet).toHaveBeenCalledTimes(2);
+    expect(cache.snapshot()).toMatchObject({ hits: 1, misses: 2, expirations: 1 });
+  });
+
+  it('drops idle wallets on sweep', async () => {
+    const cache = new WalletCache({ maxSize: 4, ttlMs: 1000 });
+
+    await cache.get('wallet1');
+    now += 500;
+    await cache.get('wallet2');
+    now += 600;
+    cache.sweep();
+
+    expect([...cache.entries.keys()]).toEqual(['wallet2']);
+    expect(cache.snapshot()).toMatchObject({ expirations: 1, size: 1 });
+  });
+
+  it('shares one hydration between concurrent gets', async () => {
+    const cache = new WalletCache({ maxSize: 4, ttlMs: 1000 });
+    const resolve = deferredWallet('wallet1');
+
+    const first = cache.get('wallet1');
+    const second = cache.get('wallet1');
+    resolve();
+    const [a, b] = await Promise.all([first, second]);
+
+    expect(a).toBe(b);
+    expect(mockUser.getWallet).toHaveBeenCalledTimes(1);
+    expect(cache.snapshot()).toMatchObject({ misses: 1, coalesced: 1, size: 1 });
+    expect(cache.pending.size).toBe(0);
+  });
+
+  it('does not cache a hydration invalidated while in flight', async () => {
+    const cache = new WalletCache({ maxSize: 4, ttlMs: 1000 });
+    const resolve = deferredWallet('wallet1');
+
+    const pending = cache.get('wallet1');
+    expect(cache.invalidate('wallet1')).toBe(true);
+    resolve();
+    const stale = await pending;
+
+    expect(cache.entries.has('wallet1')).toBe(false);
+    expect(cache.snapshot()).toMatchObject({ invalidations: 1, size: 0 });
+
+    // The next get loads the seed again instead of reusing the stale wallet
+    const fresh = await cache.get('wallet1');
+    expect(fresh).not.toBe(stale);
+    expect(mockUser.getWallet).toHaveBeenCalledTimes(2);
+  });
+});
@@ -0,0 +1,28 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tools given to the agent, wherever it runs; GetTransferStatus is added when the registry has it
+AGENT_TOOLS = ["FundWallet", "CreateTransfer", "GetWalletBalance", "GetPortfolio", "GetQuote", "CreateWallet"]
+OPTIONAL_AGENT_TOOLS = ["GetTransferStatus"]
+
+
+def agent_tool_names(registry):
+    return AGENT_TOOLS + [name for name in OPTIONAL_AGENT_TOOLS if name in registry]
+
+
+def build_agent(llm, registry, checkpointer=None, history_policy=None):
+    """The ReAct agent the server, the streaming endpoint, benchmarks and main.py all run.
+
+    Importing this module has no side effects; langgraph and every tool module are only
+    imported when an agent is built. `history_policy` bounds what is sent to the LLM on every
+    call, exactly as it does in the server.
+    """
+    from langgraph.prebuilt import create_react_agent
+
+    return create_react_agent(
+        llm,
+        registry.tools(agent_tool_names(registry)),
+        checkpointer=checkpointer,
+        state_modifier=history_policy.state_modifier if history_policy is not None else None,
+    )
@@ -0,0 +1,185 @@
+import os
+import json
+import math
+import time
+import logging
+import asyncio
+import contextlib
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from a2wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from agent import build_agent
+from metrics import STREAM_OPEN, STREAM_TIME_TO_FIRST_TOKEN
+from rate_limit import RateLimited
+import server
+
+logger = logging.getLogger(__name__)
+
+# Async server entrypoint: `uvicorn asgi:app`. Streaming requests are served natively on the
+# event loop so a single worker can hold many open streams; every other route, including the
+# JSON /query-agent endpoint, is the unchanged Flask app mounted behind a WSGI adapter.
+
+STREAM_POOL_MAX_SIZE = int(os.getenv("STREAM_POOL_MAX_SIZE", str(server.CHECKPOINT_POOL_MAX_SIZE)))
+
+# Set in lifespan(); the async checkpointer must be created on the serving event loop
+stream_checkpointer = None
+# Compiled on the first stream, like server.get_agent(), so startup doesn't import every tool
+stream_agent = None
+_stream_agent_lock = asyncio.Lock()
+
+
+def sse(event, data):
+    """Format a single Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def build_stream_agent():
+    return build_agent(
+        server.get_llm(), server.tool_registry, checkpointer=stream_checkpointer, history_policy=server.get_history_policy()
+    )
+
+
+async def get_stream_agent():
+    global stream_agent
+    if stream_agent is None:
+        async with _stream_agent_lock:
+            if stream_agent is None:
+                # Tool imports are blocking work; keep them off the event loop
+                stream_agent = await run_in_threadpool(build_stream_agent)
+    return stream_agent
+
+
+def build_messages(user_id, user_message):
+    # Wallet lookup/creation goes through Flask-SQLAlchemy, which needs an app context
+    with server.app.app_context():
+        return server.build_messages(user_id, user_message)
+
+
+async def stream_events(user_id, user_message, started):
+    STREAM_OPEN.inc()
+    first_token = True
+    turn = None
+    try:
+        # Streams are never coalesced; they wait for exclusive use of the thread instead
+        turn = await run_in_threadpool(server.thread_queue.enter, user_id)
+        messages = await run_in_threadpool(build_messages, user_id, user_message)
+        config = server.agent_config(user_id)
+        server.current_user_id.set(user_id)
+        server.chat_history.record(user_id, "human", user_message)
+        await run_in_threadpool(server.compact_history, config)
+
+        fast_response = await run_in_threadpool(lambda: server.fast_path.respond(server.get_agent(), messages, config))
+        if fast_response is not None:
+            server.chat_history.record(user_id, "agent", fast_response)
+            yield sse("done", {"response": fast_response})
+            return
+
+        agent = await get_stream_agent()
+        async for event in agent.astream_events({"messages": messages}, config=config, version="v2"):
+            kind = event["event"]
+            if kind == "on_chat_model_stream":
+                content = event["data"]["chunk"].content
+                if content:
+                    if first_token:
+                        STREAM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started)
+                        first_token = False
+                    yield sse("token", {"content": content})
+            elif kind == "on_tool_start":
+                yield sse("tool_start", {"name": event["name"], "input": event["data"].get("input")})
+            elif kind == "on_tool_end":
+                yield sse("tool_end", {"name": event["name"], "output": event["data"].get("output")})
+
+        # Tools marked return_direct end the run on a tool message, so read the final state
+        # rather than relying on the last streamed chat model output
+        state = await agent.aget_state(config)
+        agent_response = state.values["messages"][-1].content
+        logger.info("Agent response for user_id=%s: %s", user_id, agent_response, extra={"payload": True})
+        server.chat_history.record(user_id, "agent", agent_response)
+        yield sse("done", {"response": agent_response})
+    except Exception as e:
+        rate_limited = server.as_rate_limited(e)
+        if rate_limited is not None:
+            logger.warning(f"Stream cut short: {str(rate_limited)}")
+            yield sse("error", {"error": str(rate_limited), "retry_after": math.ceil(rate_limited.retry_after)})
+        else:
+            logger.error(f"Error streaming request: {str(e)}")
+            yield sse("error", {"error": str(e)})
+    finally:
+        await run_in_threadpool(server.thread_queue.exit, user_id, turn)
+        STREAM_OPEN.dec()
+
+
+def cors_headers(request):
+    if request.headers.get("origin") == server.ALLOWED_ORIGIN:
+        return {
+            "Access-Control-Allow-Origin": server.ALLOWED_ORIGIN,
+            "Access-Control-Allow-Methods": "POST, OPTIONS",
+            "Access-Control-Allow-Headers": "Content-Type",
+        }
+    return {}
+
+
+async def query_agent_stream(request):
+    if request.method == "OPTIONS":
+        return Response(status_code=204, headers=cors_headers(request))
+
+    started = time.perf_counter()
+    try:
+        data = await request.json()
+    except ValueError:
+        return JSONResponse({"error": "Request body must be JSON"}, status_code=400, headers=cors_headers(request))
+    user_id = data.get("user_id")
+    user_message = data.get("message")
+    logger.info("Received streaming request: user_id=%s", user_id)
+    logger.info("Request message for user_id=%s: %s", user_id, user_message, extra={"payload": True})
+
+    try:
+        # Budget checks may read the shared buckets in Postgres
+        await run_in_threadpool(server.admit)
+    except RateLimited as e:
+        retry_after = math.ceil(e.retry_after)
+        return JSONResponse(
+            {"error": f"The agent is busy right now; please try again in {retry_after}s", "retry_after": retry_after},
+            status_code=503,
+            headers={"Retry-After": str(retry_after), **cors_headers(request)},
+        )
+
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Disable proxy buffering so tokens are flushed as they arrive
+        **cors_headers(request),
+    }
+    return StreamingResponse(stream_events(user_id, user_message, started), media_type="text/event-stream", headers=headers)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global stream_checkpointer
+    from checkpoint import AsyncPooledPostgresSaver
+    # Schema migrations run in server.init_checkpointer(), which every turn reaches through
+    # server.get_agent() before the stream agent is used; this pool only serves reads/writes
+    async with AsyncConnectionPool(
+        conninfo=server.app.config['SQLALCHEMY_DATABASE_URI'],
+        min_size=server.CHECKPOINT_POOL_MIN_SIZE,
+        max_size=STREAM_POOL_MAX_SIZE,
+        timeout=server.CHECKPOINT_POOL_TIMEOUT,
+        kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+    ) as pool:
+        await pool.wait(timeout=server.CHECKPOINT_POOL_TIMEOUT)
+        stream_checkpointer = AsyncPooledPostgresSaver(pool)
+        yield
+    # Write buffered turns before the worker exits; the atexit hook is then a no-op
+    await run_in_threadpool(server.chat_history.close)
+
+
+app = Starlette(
+    routes=[
+        Route("/query-agent/stream", query_agent_stream, methods=["POST", "OPTIONS"]),
+        Mount("/", app=WSGIMiddleware(server.app)),
+    ],
+    lifespan=lifespan,
+)
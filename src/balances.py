@@ -0,0 +1,80 @@
+import os
+import time
+import threading
+from cache import SingleFlight, TTLCache
+
+# How long a fetched block number is trusted before any lookup asks the node for a new head.
+# Balances are cached per block, so repeat lookups within this window cost no RPCs at all.
+BALANCE_HEAD_TTL = float(os.getenv("BALANCE_HEAD_TTL", "2"))
+BALANCE_CACHE_SIZE = int(os.getenv("BALANCE_CACHE_SIZE", "1024"))
+
+
+class BalanceCache:
+    """ETH balances in wei keyed on (address, block number), shared by every tool in the process.
+
+    All lookups share one head: `head` reads eth_blockNumber at most once per BALANCE_HEAD_TTL,
+    with concurrent reads collapsed into one (SingleFlight), and a new head drops every balance
+    cached at an older block.
+
+    Tools that move funds call `invalidate` once their transfer, trade or faucet request went
+    through. That drops the addresses involved and makes the next lookup read the head again,
+    so a balance checked right after a transfer is never the one cached before it.
+    """
+
+    def __init__(self, maxsize=BALANCE_CACHE_SIZE, head_ttl=BALANCE_HEAD_TTL):
+        self.head_ttl = head_ttl
+        self._balances = TTLCache(maxsize=maxsize, ttl=float("inf"))
+        self._flight = SingleFlight()
+        self._head = None
+        self._head_checked_at = 0.0
+        # Bumped by every invalidation, so a lookup that started before one can't cache its result
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def head(self, fetch):
+        """The current block number, calling `fetch` only when the shared head has gone stale."""
+        with self._lock:
+            if self._head is not None and time.monotonic() - self._head_checked_at < self.head_ttl:
+                return self._head
+        head, _ = self._flight.do("head", fetch)
+        with self._lock:
+            if head != self._head:
+                self._balances.clear()
+                self._head = head
+            self._head_checked_at = time.monotonic()
+        return head
+
+    def get(self, address, block):
+        return self._balances.get((address.lower(), block))
+
+    def set(self, address, block, balance_wei, generation):
+        """Cache a balance read at `block`, unless an invalidation happened since `generation`."""
+        with self._lock:
+            if generation == self._generation:
+                self._balances.set((address.lower(), block), balance_wei)
+
+    def invalidate(self, *addresses):
+        """Forget the balances of `addresses`, or of every address when none of them is known."""
+        known = {address.lower() for address in addresses if address}
+        with self._lock:
+            self._generation += 1
+            # The next lookup reads the head again rather than trusting one from before the change
+            self._head_checked_at = 0.0
+            if not known:
+                self._balances.clear()
+                return
+            for key in [key for key in self._balances.keys() if key[0] in known]:
+                self._balances.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._head = None
+            self._balances.clear()
+
+    def __len__(self):
+        return len(self._balances)
@@ -0,0 +1,35 @@
+import os
+from web3 import Web3, EthereumTesterProvider
+
+# Runtime bytecode of the canonical Multicall3 (0xcA11bde05977b3631167028862bE2a173976CA11), as
+# returned by eth_getCode on Base and every other chain it is deployed to
+MULTICALL3_RUNTIME = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "multicall3.hex")).read().strip()
+
+
+def eth_tester_web3():
+    """In-process chain with pre-funded test accounts; requires eth-tester[py-evm]."""
+    return Web3(EthereumTesterProvider())
+
+
+def attach_web3(tool, web3):
+    """Point a web3-backed tool at `web3` and keep it there on reconnects."""
+    tool.web3 = web3
+    object.__setattr__(tool, "_initialize_web3", lambda: None)
+    return tool
+
+
+def deploy_runtime(web3, runtime):
+    """Deploy contract code as-is and return its address.
+
+    The constructor only copies `runtime` (hex) into place and returns it, so contracts can be
+    deployed from their published runtime bytecode without a compiler.
+    """
+    runtime = bytes.fromhex(runtime.removeprefix("0x"))
+    # PUSH2 len DUP1 PUSH1 12 PUSH1 0 CODECOPY PUSH1 0 RETURN, then the runtime at offset 12
+    init = bytes.fromhex("61") + len(runtime).to_bytes(2, "big") + bytes.fromhex("80600c6000396000f3") + runtime
+    tx_hash = web3.eth.send_transaction({"from": web3.eth.accounts[0], "data": init})
+    return web3.eth.wait_for_transaction_receipt(tx_hash).contractAddress
+
+
+def deploy_multicall3(web3):
+    return deploy_runtime(web3, MULTICALL3_RUNTIME)
@@ -0,0 +1,96 @@
+import re
+import json
+import time
+import uuid
+from typing import Any, List, Optional
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+ADDRESS_RE = re.compile(r"0x[0-9a-fA-F]{40}")
+AMOUNT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*eth", re.IGNORECASE)
+DEFAULT_DESTINATION = "0xa7979BF6Ce644E4e36da2Ee65Db73c3f5A0dF895"
+
+
+def count_tokens(messages: List[BaseMessage]) -> int:
+    """Rough whitespace token count; good enough to compare prompt sizes across commits."""
+    return sum(len(str(message.content).split()) for message in messages)
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Deterministic stand-in for ChatOpenAI.
+
+    Picks a tool call from keywords in the latest human message, filling arguments from the
+    wallet system message the server injects, and answers with plain text once a tool result
+    comes back. `latency` simulates model time per call.
+    """
+
+    latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-chat-model"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ScriptedChatModel":
+        return self
+
+    def _wallet(self, messages: List[BaseMessage]) -> dict:
+        for message in reversed(messages):
+            if isinstance(message, SystemMessage) and "wallet_id" in message.content:
+                try:
+                    return json.loads(message.content)
+                except ValueError:
+                    continue
+        return {}
+
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"Here is what I found: {str(last.content)[:200]}")
+
+        text = next((str(m.content) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        lowered = text.lower()
+        wallet = self._wallet(messages)
+
+        def tool_call(name, args):
+            return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:24]}"}])
+
+        if "portfolio" in lowered or "all my wallets" in lowered:
+            return tool_call("GetPortfolio", {})
+        if "balance" in lowered:
+            address = ADDRESS_RE.search(text)
+            return tool_call("GetWalletBalance", {"wallet_address": address.group(0) if address else wallet.get("address")})
+        if "transfer" in lowered or "send" in lowered:
+            destination = ADDRESS_RE.search(text)
+            amount = AMOUNT_RE.search(text)
+            return tool_call("CreateTransfer", {
+                "source_wallet_id": wallet.get("wallet_id"),
+                "destination_wallet_address": destination.group(0) if destination else DEFAULT_DESTINATION,
+                "amount": amount.group(1) if amount else "0.0001",
+            })
+        if "fund" in lowered:
+            return tool_call("FundWallet", {"wallet_id": wallet.get("wallet_id")})
+        return AIMessage(content="Hi, I'm Alice. I can fund your wallet, check balances and transfer ETH.")
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        message = self._respond(messages)
+        input_tokens = count_tokens(messages)
+        output_tokens = len(str(message.content).split()) + 10 * len(message.tool_calls)
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"token_usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens}},
+        )
@@ -0,0 +1,161 @@
+"""Per-request logging overhead, before and after the queue-based logging setup.
+
+Replays the log calls one /query-agent request makes (request body, system prompt, every
+agent/tool message list, the cdp response and the final answer) with realistic payloads, and
+times them on the calling thread. `before` is the old setup: DEBUG-level basicConfig writing
+f-strings synchronously. `after` is log_config.setup_logging() with the call sites as they
+are now. Results are printed as JSON like bench.run:
+
+    cd src
+    python -m bench.log_overhead --iterations 2000 --concurrency 8
+    python -m bench.log_overhead --sink-latency 0.0005   # a slow stderr pipe, e.g. a busy log shipper
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from bench.run import measure
+from log_config import setup_logging, shutdown_logging
+
+PROMPT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts", "agent_prompt.txt")
+WALLET_ID = "674069f0-3de9-40bf-a06b-22a9573c7861"
+DESTINATION = "0xa7979BF6Ce644E4e36da2Ee65Db73c3f5A0dF895"
+
+
+class SlowSink:
+    """A file that takes `latency` seconds per write, like stderr piped to a backed-up collector."""
+
+    def __init__(self, file, latency):
+        self.file = file
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+
+def request_payloads():
+    with open(PROMPT_FILE) as file:
+        prompt = file.read()
+    transfer = {
+        "message": "Transfer completed successfully",
+        "transfer": {"model": {
+            "network_id": "base-sepolia",
+            "wallet_id": WALLET_ID,
+            "destination": DESTINATION,
+            "amount": "100000000000000",
+            "unsigned_payload": "02f8" + "ab" * 400,
+            "transaction": {"signed_payload": "02f8" + "cd" * 420, "transaction_hash": "0x" + "12" * 32, "status": "complete"},
+        }},
+    }
+    wallet = json.dumps({"wallet_id": WALLET_ID, "address": "0xE9B0f8a530736313fdD388B0660163e93b298c77"})
+    call = {"name": "CreateTransfer", "args": {"source_wallet_id": WALLET_ID, "destination_wallet_address": DESTINATION, "amount": "0.0001"}, "id": "call_1"}
+    steps = [
+        {"agent": {"messages": [AIMessage(content="", tool_calls=[call])]}},
+        {"tools": {"messages": [ToolMessage(content=json.dumps(transfer), tool_call_id="call_1")]}},
+        {"agent": {"messages": [AIMessage(content="Your transfer of 0.0001 ETH is complete. " * 4)]}},
+    ]
+    message = f"Send 0.0001 ETH to {DESTINATION}"
+    messages = [SystemMessage(content=prompt), SystemMessage(content=wallet), HumanMessage(content=message)]
+    return prompt, message, messages, steps, transfer
+
+
+def before(server, tools, payloads, user_id):
+    """The log calls of one request as server.py and the tools made them before."""
+    prompt, message, messages, steps, transfer = payloads
+    data = {"user_id": user_id, "message": message}
+    server.info(f"Received request data: {data}")
+    server.info(f"Received request: user_id={user_id}, message={message}")
+    server.debug("Loaded system message.")
+    server.info(f"Loaded system message: {prompt}")
+    server.info(f"Starting new conversation for user_id={user_id}")
+    for step in steps:
+        if "agent" in step:
+            server.info(f"Agent message: {step['agent']['messages']}")
+        else:
+            tools.info(f"Initiating transfer of 0.0001 ETH from wallet {WALLET_ID} to address {DESTINATION}")
+            tools.info(f"Transfer result: {transfer}")
+            server.info(f"Tool message: {step['tools']['messages']}")
+    server.info(f"Agent response for user_id={user_id}: {steps[-1]['agent']['messages'][-1].content}")
+
+
+def after(server, tools, payloads, user_id):
+    """The same request's log calls as they are made now."""
+    prompt, message, messages, steps, transfer = payloads
+    server.info("Received request: user_id=%s", user_id)
+    server.info("Request message for user_id=%s: %s", user_id, message, extra={"payload": True})
+    server.debug("Loaded system message (%d chars)", len(prompt))
+    server.debug("Starting new conversation for user_id=%s", user_id)
+    for step in steps:
+        if "agent" in step:
+            server.debug("Agent message: %s", step['agent']['messages'], extra={"payload": True})
+        else:
+            tools.info("Initiating transfer of %s ETH from wallet %s to address %s", "0.0001", WALLET_ID, DESTINATION)
+            tools.debug("Transfer result: %s", transfer, extra={"payload": True})
+            server.debug("Tool message: %s", step['tools']['messages'], extra={"payload": True})
+    response = steps[-1]['agent']['messages'][-1].content
+    server.info("Agent response for user_id=%s: %s", user_id, response, extra={"payload": True})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=1000, help="Simulated requests per setup")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--alloc-iterations", type=int, default=50, help="Iterations of the traced allocation pass")
+    parser.add_argument("--sink-latency", type=float, default=0.0, help="Seconds each write to the log stream takes")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    payloads = request_payloads()
+    server = logging.getLogger("server")
+    tools = logging.getLogger("tools.transfer_funds")
+    results = []
+    with tempfile.TemporaryFile("w") as file:
+        sink = SlowSink(file, args.sink_latency)
+
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format='%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]',
+            handlers=[logging.StreamHandler(sink)],
+            force=True,
+        )
+        results.append(measure(
+            "before_sync_debug", lambda i: before(server, tools, payloads, f"user-{i}"),
+            args.iterations, args.concurrency, args.alloc_iterations,
+        ))
+        before_bytes = file.tell()
+
+        setup_logging(stream=sink)
+        result = measure(
+            "after_queue_json", lambda i: after(server, tools, payloads, f"user-{i}"),
+            args.iterations, args.concurrency, args.alloc_iterations,
+        )
+        # The writer thread catches up after the timed section; that time is off the request path
+        drain_started = time.perf_counter()
+        shutdown_logging()
+        result["drain_ms"] = round((time.perf_counter() - drain_started) * 1000, 3)
+        results.append(result)
+        after_bytes = file.tell() - before_bytes
+
+    for result, written in zip(results, (before_bytes, after_bytes)):
+        runs = result["iterations"] + args.alloc_iterations
+        result["log_bytes_per_request"] = written // runs
+    report = {"sink_latency": args.sink_latency, "results": results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""Offline benchmark suite.
+
+Runs every tool's `_run` and the /query-agent endpoint against a stub cdp bridge, a scripted
+fake chat model, an in-process eth-tester chain and two stub JSON-RPC nodes (one with latency
+spikes, for the hedged RPC pool), and prints latency percentiles, throughput
+and allocation numbers as JSON so results can be diffed across commits:
+
+    cd src
+    python -m bench.run --iterations 200 --concurrency 4 --output bench.json
+
+The /query-agent scenario imports server.py, so it needs the Postgres database from
+docker-compose (DB_* variables); it is reported as skipped when the database is unreachable.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from bench.stub_cdp import StubCdpServer
+from bench.stub_rpc import StubRpcServer
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def measure(name, op, iterations, concurrency, alloc_iterations):
+    """Time `op(i)` for `iterations` calls, then trace allocations over a shorter separate pass."""
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            op(i)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, range(iterations)))
+    else:
+        results = [timed(i) for i in range(iterations)]
+    wall = time.perf_counter() - started
+
+    for latency, error in results:
+        latencies.append(latency)
+        if error is not None:
+            errors += 1
+    latencies.sort()
+
+    # Allocations are traced separately; tracemalloc would otherwise distort the latencies
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for i in range(alloc_iterations):
+        try:
+            op(iterations + i)
+        except Exception:
+            pass
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        "name": name,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "throughput_rps": round(iterations / wall, 2) if wall else None,
+        "alloc_peak_bytes": peak - baseline,
+        "alloc_retained_bytes_per_op": (current - baseline) // alloc_iterations if alloc_iterations else None,
+    }
+
+
+def tool_scenarios(web3, rpc_urls):
+    from bench.fake_chain import attach_web3
+    from tools.create_wallet import CreateWalletTool
+    from tools.fund_wallet import FundWalletTool
+    from tools.transfer_funds import TransferFundsTool
+    from tools.trade_assets import TradeAssetsTool
+    from tools.get_balance import GetWalletBalanceTool
+    from tools.get_portfolio import GetPortfolioTool
+    from spend_policy import SpendLedger, SpendPolicy
+
+    create_wallet = CreateWalletTool()
+    wallet_id = json.loads(create_wallet._run())["wallet_id"]
+    fund_wallet = FundWalletTool()
+    # Without caps, so every iteration reaches the cdp stub; the default policy is measured separately
+    transfer_funds = TransferFundsTool(spend_ledger=SpendLedger(SpendPolicy()))
+    trade_assets = TradeAssetsTool(spend_ledger=SpendLedger(SpendPolicy()))
+    capped_transfer_funds = TransferFundsTool()
+    get_balance = attach_web3(GetWalletBalanceTool(web3_provider_url="eth-tester"), web3)
+    get_portfolio = GetPortfolioTool(web3_provider_url="eth-tester", web3=web3, multicall_address=None)
+    spiky_balance = GetWalletBalanceTool(web3_provider_url=rpc_urls[0])
+    hedged_balance = GetWalletBalanceTool(web3_provider_urls=rpc_urls)
+    accounts = web3.eth.accounts
+
+    def uncached_balance(i):
+        get_balance.balances.clear()
+        return get_balance._run(wallet_address=accounts[i % len(accounts)])
+
+    def uncached(tool):
+        def op(i):
+            tool.balances.clear()
+            return tool._run(wallet_address=accounts[i % len(accounts)])
+        return op
+
+    return {
+        "create_wallet": lambda i: create_wallet._run(),
+        "fund_wallet": lambda i: fund_wallet._run(wallet_id=wallet_id),
+        "transfer_funds": lambda i: transfer_funds._run(
+            source_wallet_id=wallet_id, destination_wallet_address=accounts[1], amount="0.0001"
+        ),
+        "transfer_funds_rejected": lambda i: capped_transfer_funds._run(
+            source_wallet_id=wallet_id, destination_wallet_address=accounts[1], amount="1"
+        ),
+        "trade_assets": lambda i: trade_assets._run(amount="0.0001", asset_from="eth", asset_to="usdc"),
+        "get_balance": lambda i: get_balance._run(wallet_address=accounts[i % len(accounts)]),
+        "get_balance_uncached": uncached_balance,
+        "get_balances_batch": lambda i: get_balance._run(wallet_addresses=accounts),
+        "get_balance_spiky_rpc": uncached(spiky_balance),
+        "get_balance_hedged_rpc": uncached(hedged_balance),
+        "get_portfolio": lambda i: get_portfolio.get_portfolio([{"address": address} for address in accounts]),
+    }
+
+
+def endpoint_scenarios(web3, llm_latency, users):
+    from bench.fake_chain import attach_web3
+    from bench.fake_llm import ScriptedChatModel
+    from spend_policy import SpendPolicy
+    import server
+
+    # Swap the real model and RPC endpoint for the offline fakes and rebuild the shared graph
+    server.llm = ScriptedChatModel(latency=llm_latency)
+    attach_web3(server.tool_registry.get("GetWalletBalance"), web3)
+    # Keep the ledger write-through in the measurement but never hit the caps
+    server.spend_ledger.policy = SpendPolicy()
+    history_policy = server.get_history_policy()
+    if history_policy.summarizer is not None:
+        history_policy.summarizer = server.llm
+    server.agent = None
+    server.get_agent()
+    client = server.app.test_client()
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    prompts = [
+        "What's my balance?",
+        "Please fund my wallet",
+        f"Transfer 0.0001 ETH to {web3.eth.accounts[1]}",
+        "Hello, who are you?",
+    ]
+
+    def query(i):
+        response = client.post("/query-agent", json={
+            "user_id": f"bench-{run_id}-{i % users}",
+            "message": prompts[i % len(prompts)],
+        })
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json())
+
+    return {"query_agent": query}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--alloc-iterations", type=int, default=20, help="Iterations of the traced allocation pass")
+    parser.add_argument("--cdp-latency", type=float, default=0.0, help="Seconds added to every stub cdp response")
+    parser.add_argument("--cdp-jitter", type=float, default=0.0, help="Extra uniform random latency in seconds")
+    parser.add_argument("--cdp-error-rate", type=float, default=0.0, help="Fraction of stub cdp requests that fail")
+    parser.add_argument("--rpc-spike-rate", type=float, default=0.03, help="Fraction of spiky stub RPC requests that stall")
+    parser.add_argument("--rpc-spike-latency", type=float, default=0.5, help="Seconds a stalled stub RPC request takes")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds per fake LLM call")
+    parser.add_argument("--users", type=int, default=10, help="Distinct user_ids for the endpoint scenario")
+    parser.add_argument("--scenario", action="append", help="Only run the named scenario(s)")
+    parser.add_argument("--skip-endpoint", action="store_true", help="Don't benchmark /query-agent")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    with StubCdpServer(
+        latency=args.cdp_latency, jitter=args.cdp_jitter, error_rate=args.cdp_error_rate
+    ) as stub, StubRpcServer(
+        latency=0.002, spike_rate=args.rpc_spike_rate, spike_latency=args.rpc_spike_latency
+    ) as spiky_rpc, StubRpcServer(latency=0.01) as steady_rpc:
+        # Must be set before any tool module reads its configuration
+        os.environ["COINBASE_API_URL"] = stub.url
+        os.environ.setdefault("WALLET_POOL_ENABLED", "false")
+        # The endpoint scenario swaps in its own agent; a background build would race with it
+        os.environ.setdefault("AGENT_WARMUP", "false")
+        os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+
+        from bench.fake_chain import eth_tester_web3
+        web3 = eth_tester_web3()
+
+        scenarios = tool_scenarios(web3, [spiky_rpc.url, steady_rpc.url])
+        skipped = {}
+        if not args.skip_endpoint:
+            try:
+                scenarios.update(endpoint_scenarios(web3, args.llm_latency, args.users))
+            except Exception as e:
+                skipped["query_agent"] = f"{type(e).__name__}: {e}"
+
+        results = []
+        for name, op in scenarios.items():
+            if args.scenario and name not in args.scenario:
+                continue
+            print(f"Running {name}...", file=sys.stderr)
+            rpc_requests = spiky_rpc.requests + steady_rpc.requests
+            result = measure(name, op, args.iterations, args.concurrency, args.alloc_iterations)
+            # HTTP requests to the stub nodes (a JSON-RPC batch is one); hedged reads count twice
+            rpc_requests = spiky_rpc.requests + steady_rpc.requests - rpc_requests
+            if rpc_requests:
+                result["stub_rpc_requests_per_op"] = round(rpc_requests / (args.iterations + args.alloc_iterations), 3)
+            results.append(result)
+
+        report = {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "config": vars(args),
+            "stub_cdp_requests": stub.requests,
+            "results": results,
+            "skipped": skipped,
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
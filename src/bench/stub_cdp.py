@@ -0,0 +1,188 @@
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Long hex blobs the real cdp bridge returns inside transfer/trade models
+UNSIGNED_PAYLOAD = "02f8" + "ab" * 160
+SIGNED_PAYLOAD = "02f8" + "cd" * 180
+
+
+def address_for(wallet_id):
+    """Deterministic fake address for a wallet ID."""
+    return "0x" + hashlib.sha256(wallet_id.encode()).hexdigest()[:40]
+
+
+def tx_hash():
+    return "0x" + uuid.uuid4().hex + uuid.uuid4().hex
+
+
+class StubCdpServer:
+    """In-process stand-in for the cdp HTTP API with configurable latency and error rate.
+
+    Response bodies mirror the shapes returned by cdp/index.js closely enough for every tool in
+    src/tools to parse them, including the bulky transfer model fields.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.wallets = {}
+        self.requests = 0
+        # (path, JSON body) of every POST, in arrival order
+        self.posted = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-cdp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _delay_and_fail(self):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def create_wallet(self, body):
+        wallet_id = str(uuid.uuid4())
+        with self._lock:
+            self.wallets[wallet_id] = address_for(wallet_id)
+        return {"message": "Wallet created and seed saved successfully", "walletId": wallet_id}
+
+    def get_wallet(self, wallet_id):
+        address = self.wallets.get(wallet_id, address_for(wallet_id))
+        return {
+            "message": "Wallet retrieved successfully",
+            "wallet": {"id": wallet_id, "network_id": "base-sepolia", "addresses": [{"id": address}]},
+        }
+
+    def fund_wallet(self, body):
+        tx = tx_hash()
+        return {
+            "message": "Faucet transaction completed",
+            "transaction": {"model": {"transaction_hash": tx, "transaction_link": f"https://sepolia.basescan.org/tx/{tx}"}},
+        }
+
+    def transfer_funds(self, body):
+        tx = tx_hash()
+        return {
+            "message": "Transfer completed successfully",
+            "transfer": {
+                "model": {
+                    "network_id": "base-sepolia",
+                    "wallet_id": body.get("sourceWalletId"),
+                    "address_id": address_for(body.get("sourceWalletId", "")),
+                    "destination": body.get("destinationWalletAddress"),
+                    "amount": str(int(float(body.get("amount", 0)) * 10 ** 18)),
+                    "asset_id": "eth",
+                    "transfer_id": str(uuid.uuid4()),
+                    "unsigned_payload": UNSIGNED_PAYLOAD,
+                    "transaction": {
+                        "network_id": "base-sepolia",
+                        "from_address_id": address_for(body.get("sourceWalletId", "")),
+                        "unsigned_payload": UNSIGNED_PAYLOAD,
+                        "signed_payload": SIGNED_PAYLOAD,
+                        "transaction_hash": tx,
+                        "transaction_link": f"https://sepolia.basescan.org/tx/{tx}",
+                        "status": "complete",
+                    },
+                    "status": "complete",
+                }
+            },
+        }
+
+    def trade_assets(self, body):
+        tx = tx_hash()
+        return {
+            "message": "Trade completed successfully",
+            "trade": {
+                "model": {
+                    "network_id": "base-sepolia",
+                    "wallet_id": body.get("walletId"),
+                    "trade_id": str(uuid.uuid4()),
+                    "from_amount": str(body.get("amount")),
+                    "to_amount": str(body.get("amount")),
+                    "from_asset": {"asset_id": body.get("fromAssetId")},
+                    "to_asset": {"asset_id": body.get("toAssetId")},
+                    "transaction": {"unsigned_payload": UNSIGNED_PAYLOAD, "transaction_hash": tx, "status": "complete"},
+                }
+            },
+        }
+
+    def _handler(self):
+        stub = self
+        get_routes = [
+            (re.compile(r"^/get-wallet/([^/]+)$"), lambda match: stub.get_wallet(match.group(1))),
+        ]
+        post_routes = {
+            "/create-wallet": stub.create_wallet,
+            "/fund-wallet": stub.fund_wallet,
+            "/transfer-funds": stub.transfer_funds,
+            "/trade-assets": stub.trade_assets,
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real express server
+            disable_nagle_algorithm = True  # Headers and body are separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if stub._delay_and_fail():
+                    return self._send(500, {"error": "Injected stub failure"})
+                for pattern, handler in get_routes:
+                    match = pattern.match(self.path)
+                    if match:
+                        return self._send(200, handler(match))
+                self._send(404, {"error": "Not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.posted.append((self.path, body))
+                if stub._delay_and_fail():
+                    return self._send(500, {"error": "Injected stub failure"})
+                handler = post_routes.get(self.path)
+                if handler is None:
+                    return self._send(404, {"error": "Not found"})
+                self._send(200, handler(body))
+
+        return Handler
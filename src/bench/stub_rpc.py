@@ -0,0 +1,99 @@
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubRpcServer:
+    """In-process JSON-RPC node answering the read calls the balance tool makes.
+
+    Every request waits `latency` seconds, plus `spike_latency` for a `spike_rate` fraction of
+    them, and fails with a 500 for an `error_rate` fraction. Batches are answered in one response.
+    """
+
+    def __init__(self, latency=0.0, spike_rate=0.0, spike_latency=0.0, error_rate=0.0, seed=0, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.spike_rate = spike_rate
+        self.spike_latency = spike_latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.block_number = 1
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-rpc", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _delay_and_fail(self):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency
+            if self.random.random() < self.spike_rate:
+                delay += self.spike_latency
+            fail = self.random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        return fail
+
+    def answer(self, request):
+        method, params = request["method"], request.get("params", [])
+        if method == "eth_blockNumber":
+            result = hex(self.block_number)
+        elif method == "eth_chainId":
+            result = "0x1"
+        elif method == "eth_getBalance":
+            # Deterministic per address so every endpoint agrees
+            result = hex(int(params[0][-8:], 16) * 10**9)
+        else:
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32601, "message": "Method not found"}}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if stub._delay_and_fail():
+                    return self._send(500, {"error": "Injected stub failure"})
+                if isinstance(body, list):
+                    return self._send(200, [stub.answer(request) for request in body])
+                self._send(200, stub.answer(body))
+
+        return Handler
@@ -0,0 +1,114 @@
+import time
+import threading
+from typing import Any, Dict, Optional
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from metrics import LLM_LATENCY, LLM_TOKENS, TOOL_LATENCY
+
+# OpenTelemetry is optional: spans are only exported when the SDK is installed and configured
+# (e.g. via opentelemetry-instrument and the OTEL_* environment variables).
+try:
+    from opentelemetry import trace
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:
+    trace = None
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Records per-tool and per-LLM-call latency and token counts for every agent run.
+
+    Attach it through the run config so it reaches every tool and model call without any
+    per-tool code. One instance is shared across requests; state is keyed on run_id.
+    """
+
+    # Bookkeeping only, safe to run on the event loop in async runs
+    run_inline = True
+
+    def __init__(self):
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._tracer = trace.get_tracer(__name__) if trace else None
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], span_name: str, **fields):
+        span = None
+        if self._tracer:
+            with self._lock:
+                parent = self._runs.get(parent_run_id, {}).get("span") if parent_run_id else None
+            context = trace.set_span_in_context(parent) if parent else None
+            span = self._tracer.start_span(span_name, context=context)
+        with self._lock:
+            self._runs[run_id] = {"start": time.perf_counter(), "span": span, **fields}
+
+    def _finish(self, run_id: UUID, error: Optional[BaseException] = None):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        run["elapsed"] = time.perf_counter() - run["start"]
+        span = run["span"]
+        if span is not None:
+            if error is not None:
+                span.record_exception(error)
+                span.set_status(Status(StatusCode.ERROR, str(error)))
+            span.end()
+        return run
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        # Only tracked so tool and LLM spans nest under their graph node
+        if self._tracer:
+            self._start(run_id, parent_run_id, f"chain {kwargs.get('name') or 'graph'}")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        if self._tracer:
+            self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        if self._tracer:
+            self._finish(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self._start(run_id, parent_run_id, f"tool {name}", tool=name)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run:
+            TOOL_LATENCY.labels(tool=run["tool"], status="ok").observe(run["elapsed"])
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        run = self._finish(run_id, error)
+        if run:
+            TOOL_LATENCY.labels(tool=run["tool"], status="error").observe(run["elapsed"])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = (metadata or {}).get("ls_model_name") or params.get("model_name") or params.get("model") or "unknown"
+        self._start(run_id, parent_run_id, f"llm {model}", model=model)
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if not run:
+            return
+        LLM_LATENCY.labels(model=run["model"], status="ok").observe(run["elapsed"])
+        prompt_tokens, completion_tokens = _token_usage(response)
+        if prompt_tokens is not None:
+            LLM_TOKENS.labels(model=run["model"], kind="prompt").observe(prompt_tokens)
+        if completion_tokens is not None:
+            LLM_TOKENS.labels(model=run["model"], kind="completion").observe(completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._finish(run_id, error)
+        if run:
+            LLM_LATENCY.labels(model=run["model"], status="error").observe(run["elapsed"])
+
+
+def _token_usage(response: LLMResult):
+    """Extract (prompt, completion) token counts from either usage_metadata or llm_output."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import base64
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from sqlalchemy import and_, or_
+from models import db, ChatHistory
+from metrics import CHAT_HISTORY_BUFFER_DEPTH, CHAT_HISTORY_FLUSH_ROWS, CHAT_HISTORY_FLUSH_SECONDS, CHAT_HISTORY_WRITES
+
+logger = logging.getLogger(__name__)
+
+CHAT_HISTORY_ENABLED = os.getenv("CHAT_HISTORY_ENABLED", "true").lower() == "true"
+# A batch is written once this many turns are buffered, or after the interval, whichever is first
+CHAT_HISTORY_BATCH_SIZE = int(os.getenv("CHAT_HISTORY_BATCH_SIZE", "200"))
+CHAT_HISTORY_FLUSH_INTERVAL = float(os.getenv("CHAT_HISTORY_FLUSH_INTERVAL", "1"))
+# Turns held in memory while the database is unreachable; past this the oldest are dropped
+CHAT_HISTORY_MAX_BUFFER = int(os.getenv("CHAT_HISTORY_MAX_BUFFER", "50000"))
+# Time allowed for the final flush on shutdown
+CHAT_HISTORY_SHUTDOWN_TIMEOUT = float(os.getenv("CHAT_HISTORY_SHUTDOWN_TIMEOUT", "10"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([timestamp.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from e
+
+
+class ChatHistoryWriter:
+    """Persists every conversation turn to the `chat_history` table off the request path.
+
+    `record` only appends to an in-memory buffer. A daemon thread writes the buffer with one
+    multi-row INSERT whenever CHAT_HISTORY_BATCH_SIZE turns are waiting or
+    CHAT_HISTORY_FLUSH_INTERVAL has passed. A batch that fails to write goes back to the front of
+    the buffer and is retried on the next flush. `close` (registered with atexit by the server)
+    stops the thread and writes whatever is left, so a graceful shutdown loses nothing; a crash
+    loses at most the turns recorded since the last flush.
+
+    Each turn is timestamped when it is recorded, so the table orders turns by when they
+    happened rather than by when their batch was written.
+    """
+
+    def __init__(
+        self,
+        app,
+        enabled=CHAT_HISTORY_ENABLED,
+        batch_size=CHAT_HISTORY_BATCH_SIZE,
+        flush_interval=CHAT_HISTORY_FLUSH_INTERVAL,
+        max_buffer=CHAT_HISTORY_MAX_BUFFER,
+        shutdown_timeout=CHAT_HISTORY_SHUTDOWN_TIMEOUT,
+    ):
+        self.app = app
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.shutdown_timeout = shutdown_timeout
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        # Only one flush writes at a time, so retried batches keep their order
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.last_flush_seconds = None
+
+    def start(self):
+        """Create the history table and its index if needed and start the flush worker."""
+        with self.app.app_context():
+            ChatHistory.__table__.create(db.engine, checkfirst=True)
+            # The table may predate the index (scripts/create_tables.py used to create it without one)
+            for index in ChatHistory.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+        self._thread = threading.Thread(target=self._flush_loop, name="chat-history-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, user_id, role, message):
+        """Queue one turn for writing. Never blocks on the database."""
+        if not self.enabled:
+            return
+        row = {"user_id": user_id, "role": role, "message": str(message), "timestamp": datetime.now(timezone.utc)}
+        with self._lock:
+            self._buffer.append(row)
+            dropped = 0
+            while len(self._buffer) > self.max_buffer:
+                self._buffer.popleft()
+                dropped += 1
+            depth = len(self._buffer)
+        CHAT_HISTORY_BUFFER_DEPTH.set(depth)
+        if dropped:
+            CHAT_HISTORY_WRITES.labels(result="dropped").inc(dropped)
+            logger.error(f"Chat history buffer full ({self.max_buffer} turns); dropped the oldest turn")
+        if depth >= self.batch_size:
+            self._wakeup.set()
+
+    def depth(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "buffer_depth": self.depth(),
+            "last_flush_seconds": self.last_flush_seconds,
+        }
+
+    def flush(self):
+        """Write everything buffered so far, one batch at a time. Returns the number of turns written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    return written
+                try:
+                    self._write(batch)
+                except Exception:
+                    with self._lock:
+                        # Put the batch back in order, ahead of anything recorded meanwhile
+                        self._buffer.extendleft(reversed(batch))
+                        CHAT_HISTORY_BUFFER_DEPTH.set(len(self._buffer))
+                    CHAT_HISTORY_WRITES.labels(result="retried").inc(len(batch))
+                    raise
+                written += len(batch)
+                CHAT_HISTORY_BUFFER_DEPTH.set(self.depth())
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        with self.app.app_context(), db.engine.begin() as conn:
+            # A list of parameter sets is sent as multi-row INSERT ... VALUES statements
+            conn.execute(ChatHistory.__table__.insert(), batch)
+        elapsed = time.perf_counter() - start
+        self.last_flush_seconds = elapsed
+        CHAT_HISTORY_FLUSH_SECONDS.observe(elapsed)
+        CHAT_HISTORY_FLUSH_ROWS.observe(len(batch))
+        CHAT_HISTORY_WRITES.labels(result="written").inc(len(batch))
+
+    def _flush_loop(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write chat history ({self.depth()} turns buffered): {str(e)}")
+                # Back off instead of hammering a database that is down
+                self._stopping.wait(self.flush_interval)
+
+    def close(self):
+        """Stop the worker and write the remaining turns."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(self.shutdown_timeout)
+        self._thread = None
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.depth() and time.monotonic() < deadline:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write chat history on shutdown: {str(e)}")
+                time.sleep(min(self.flush_interval, 1))
+        if self.depth():
+            logger.error(f"Shut down with {self.depth()} chat history turns unwritten")
+            CHAT_HISTORY_WRITES.labels(result="dropped").inc(self.depth())
+
+
+def history_page(user_id, limit=HISTORY_PAGE_SIZE, cursor=None):
+    """One page of a user's turns, newest first. Requires an app context.
+
+    Pages are keyset-paginated on (timestamp, id), so every page is an index range scan no
+    matter how deep it is. Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    query = ChatHistory.query.filter(ChatHistory.user_id == user_id)
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(
+            or_(ChatHistory.timestamp < timestamp, and_(ChatHistory.timestamp == timestamp, ChatHistory.id < row_id))
+        )
+    # One extra row tells us whether there is another page
+    rows = query.order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return [
+        {"id": row.id, "role": row.role, "message": row.message, "timestamp": row.timestamp.isoformat()}
+        for row in rows
+    ], next_cursor
@@ -0,0 +1,85 @@
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
+from psycopg import AsyncCursor, Cursor
+from psycopg.rows import DictRow, dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from metrics import CHECKPOINT_IO
+
+# Run metadata copied onto every checkpoint a run writes, e.g. the prompt version a turn ran under
+CHECKPOINT_METADATA_KEYS = ("prompt", "prompt_version")
+
+
+def with_run_metadata(config, metadata):
+    """`metadata` plus the CHECKPOINT_METADATA_KEYS set in the run config's metadata."""
+    run = config.get("metadata") or {}
+    extra = {key: run[key] for key in CHECKPOINT_METADATA_KEYS if run.get(key) is not None}
+    return {**metadata, **extra} if extra else metadata
+
+
+class PooledPostgresSaver(PostgresSaver):
+    """PostgresSaver that lets concurrent requests use separate pool connections.
+
+    The stock saver serializes every cursor behind a single lock, which is needed when it owns
+    one connection but turns a ConnectionPool back into a single-lane bottleneck. Each pooled
+    cursor here runs on its own checked-out connection, so no process-wide lock is taken.
+    Checkpoints also record the run's prompt version (see CHECKPOINT_METADATA_KEYS).
+    """
+
+    def __init__(self, pool: ConnectionPool, **kwargs):
+        super().__init__(pool, **kwargs)
+
+    @contextmanager
+    def _cursor(self, *, pipeline: bool = False) -> Iterator[Cursor[DictRow]]:
+        with self.conn.connection() as conn:
+            if pipeline:
+                with conn.pipeline(), conn.cursor(binary=True, row_factory=dict_row) as cur:
+                    yield cur
+            else:
+                with conn.cursor(binary=True, row_factory=dict_row) as cur:
+                    yield cur
+
+    def get_tuple(self, config):
+        with CHECKPOINT_IO.labels(operation="get").time():
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with CHECKPOINT_IO.labels(operation="put").time():
+            return super().put(config, checkpoint, with_run_metadata(config, metadata), new_versions)
+
+    def put_writes(self, config, writes, task_id):
+        with CHECKPOINT_IO.labels(operation="put_writes").time():
+            return super().put_writes(config, writes, task_id)
+
+
+class AsyncPooledPostgresSaver(AsyncPostgresSaver):
+    """Asyncio counterpart of PooledPostgresSaver, used by the streaming endpoint.
+
+    Must be constructed inside the event loop that will use it.
+    """
+
+    def __init__(self, pool: AsyncConnectionPool, **kwargs):
+        super().__init__(pool, **kwargs)
+
+    @asynccontextmanager
+    async def _cursor(self, *, pipeline: bool = False) -> AsyncIterator[AsyncCursor[DictRow]]:
+        async with self.conn.connection() as conn:
+            if pipeline:
+                async with conn.pipeline(), conn.cursor(binary=True, row_factory=dict_row) as cur:
+                    yield cur
+            else:
+                async with conn.cursor(binary=True, row_factory=dict_row) as cur:
+                    yield cur
+
+    async def aget_tuple(self, config):
+        with CHECKPOINT_IO.labels(operation="get").time():
+            return await super().aget_tuple(config)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with CHECKPOINT_IO.labels(operation="put").time():
+            return await super().aput(config, checkpoint, with_run_metadata(config, metadata), new_versions)
+
+    async def aput_writes(self, config, writes, task_id):
+        with CHECKPOINT_IO.labels(operation="put_writes").time():
+            return await super().aput_writes(config, writes, task_id)
@@ -0,0 +1,170 @@
+import os
+import json
+import logging
+from typing import List, Optional
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage, SystemMessage
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Turns (a human message plus the agent/tool messages answering it) sent to the LLM verbatim
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "10"))
+# Extra turns allowed to pile up in the checkpoint before older ones are folded into the summary;
+# compacting in batches keeps summarization off most requests
+HISTORY_COMPACT_SLACK = int(os.getenv("HISTORY_COMPACT_SLACK", "10"))
+HISTORY_SUMMARIZE = os.getenv("HISTORY_SUMMARIZE", "true").lower() == "true"
+# Threads remembered as due for compaction until their next turn compacts them
+HISTORY_DUE_THREADS = int(os.getenv("HISTORY_DUE_THREADS", "10000"))
+
+SUMMARY_NAME = "conversation_summary"
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for an assistant that will continue it. Keep wallet IDs, "
+    "addresses, amounts, transaction hashes and any promises or refusals made. Reply with the "
+    "summary only."
+)
+
+
+def is_wallet_message(message: BaseMessage) -> bool:
+    """The server prefixes every request with a system message holding the user's wallet JSON."""
+    if not isinstance(message, SystemMessage):
+        return False
+    try:
+        return "wallet_id" in json.loads(message.content)
+    except (TypeError, ValueError):
+        return False
+
+
+def is_summary(message: BaseMessage) -> bool:
+    return isinstance(message, SystemMessage) and message.name == SUMMARY_NAME
+
+
+def partition(messages: List[BaseMessage]):
+    """Split a thread into (policy prompts, wallet messages, summary, turns)."""
+    policy, wallets, turns = [], [], []
+    summary = None
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            if is_summary(message):
+                summary = message
+            elif is_wallet_message(message):
+                wallets.append(message)
+            else:
+                policy.append(message)
+            continue
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return policy, wallets, summary, turns
+
+
+def unique_policy(policy: List[BaseMessage]) -> List[BaseMessage]:
+    seen = set()
+    unique = []
+    for message in policy:
+        if message.content not in seen:
+            seen.add(message.content)
+            unique.append(message)
+    return unique
+
+
+class HistoryPolicy:
+    """Bounds the conversation state sent to the LLM and stored in the checkpoint.
+
+    `state_modifier` builds the prompt for every LLM call: the policy system prompt(s), the
+    running summary, the latest wallet message and the last `max_turns` turns. `compact`
+    rewrites the checkpoint itself, folding turns older than that into the summary and dropping
+    repeated wallet messages, so stored threads stop growing with conversation length.
+
+    `state_modifier` sees the whole stored thread on every LLM call anyway, so it notes the
+    threads that have outgrown the slack; `compact_if_due` compacts only those, at the start of
+    their next turn, and costs nothing (not even a checkpoint read) on every other turn.
+
+    With a prompt registry, the policy prompt stored in the thread is replaced by the version
+    named in the run config's metadata (the live policy prompt if there is none), so an edited
+    prompt applies to existing conversations from their next turn.
+    """
+
+    def __init__(self, max_turns=HISTORY_MAX_TURNS, compact_slack=HISTORY_COMPACT_SLACK, summarizer=None, prompts=None):
+        self.max_turns = max_turns
+        self.compact_slack = compact_slack
+        self.summarizer = summarizer
+        self.prompts = prompts
+        # thread_id -> True for threads whose next turn should compact them
+        self._due = TTLCache(maxsize=HISTORY_DUE_THREADS, ttl=float("inf"))
+
+    def policy_messages(self, stored: List[BaseMessage], config=None) -> List[BaseMessage]:
+        if self.prompts is None:
+            return unique_policy(stored)
+        version = ((config or {}).get("metadata") or {}).get("prompt_version")
+        prompt = (self.prompts.version(version) if version else None) or self.prompts.policy()
+        return [SystemMessage(content=prompt.text)]
+
+    def is_due(self, policy, wallets, turns) -> bool:
+        # Every turn brings a wallet message, so repeated ones are pruned in the same batches as turns
+        bound = self.max_turns + self.compact_slack
+        return max(len(turns), len(wallets), len(policy)) > bound
+
+    def state_modifier(self, state, config=None) -> List[BaseMessage]:
+        policy, wallets, summary, turns = partition(state["messages"])
+        thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+        if thread_id is not None and self.is_due(policy, wallets, turns):
+            self._due.set(thread_id, True)
+        messages = self.policy_messages(policy, config)
+        if summary is not None:
+            messages.append(summary)
+        if wallets:
+            messages.append(wallets[-1])
+        for turn in turns[-self.max_turns:]:
+            messages.extend(turn)
+        return messages
+
+    def summarize(self, summary: Optional[SystemMessage], messages: List[BaseMessage]) -> str:
+        transcript = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        if summary is not None:
+            transcript = f"Summary so far: {summary.content}\n\n{transcript}"
+        return self.summarizer.invoke([("system", SUMMARY_PROMPT), ("human", transcript)]).content
+
+    def compact_if_due(self, agent, config) -> bool:
+        """Compact the thread if an earlier turn found it over the slack. Returns True if rewritten."""
+        if self._due.pop(config["configurable"]["thread_id"]) is None:
+            return False
+        return self.compact(agent, config)
+
+    def compact(self, agent, config) -> bool:
+        """Prune the thread's checkpoint in place. Returns True if anything was rewritten."""
+        state = agent.get_state(config)
+        messages = state.values.get("messages", [])
+        if not messages:
+            return False
+
+        # The update is applied as the agent node, whose routing reads the last message; only touch
+        # threads that ended on a finished reply, and keep that reply last
+        last = messages[-1]
+        if not isinstance(last, AIMessage) or last.tool_calls:
+            return False
+
+        policy, wallets, summary, turns = partition(messages)
+        kept_policy = {id(message) for message in unique_policy(policy)}
+        removed = [message for message in policy if id(message) not in kept_policy] + wallets[:-1]
+        updates = []
+
+        if len(turns) > self.max_turns + self.compact_slack:
+            old = [message for turn in turns[:-self.max_turns] for message in turn]
+            dropped = old
+            if self.summarizer is not None:
+                content = self.summarize(summary, old)
+                # A message with an existing id is replaced where it stands, while a new id would be
+                # appended after the last reply. The first summary takes the place of the oldest
+                # message it folds in; later ones replace the summary in place.
+                if summary is None:
+                    summary_id, dropped = old[0].id, old[1:]
+                else:
+                    summary_id = summary.id
+                updates.append(SystemMessage(content=content, name=SUMMARY_NAME, id=summary_id))
+            removed.extend(dropped)
+            logger.info(f"Compacted {len(old)} messages from thread {config['configurable']['thread_id']}")
+
+        if not removed and not updates:
+            return False
+        agent.update_state(config, {"messages": [RemoveMessage(id=message.id) for message in removed] + updates}, as_node="agent")
+        return True
@@ -9,4 +9,53 @@ CREATE TABLE IF NOT EXISTS user_wallet (
     wallet_id VARCHAR(255) NOT NULL,
     wallet_address VARCHAR(255) NOT NULL,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS pooled_wallet (
+    id SERIAL PRIMARY KEY,
+    wallet_id VARCHAR(255) NOT NULL UNIQUE,
+    wallet_address VARCHAR(255) NOT NULL,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS spend_ledger (
+    id SERIAL PRIMARY KEY,
+    user_id VARCHAR(255) NOT NULL,
+    tool VARCHAR(64) NOT NULL,
+    asset VARCHAR(32) NOT NULL,
+    amount NUMERIC(36, 18) NOT NULL,
+    destination VARCHAR(255),
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_spend_ledger_user_timestamp ON spend_ledger (user_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS transfer_job (
+    id VARCHAR(36) PRIMARY KEY,
+    idempotency_key VARCHAR(255) NOT NULL UNIQUE,
+    user_id VARCHAR(255),
+    kind VARCHAR(16) NOT NULL,
+    params JSON NOT NULL,
+    asset VARCHAR(32),
+    reservation_id INTEGER,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    result JSON,
+    error TEXT,
+    transaction_hash VARCHAR(66),
+    block_number BIGINT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_transfer_job_status ON transfer_job (status);
+
+CREATE TABLE IF NOT EXISTS chat_history (
+    id SERIAL PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    message TEXT NOT NULL,
+    timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_chat_history_user_timestamp ON chat_history (user_id, timestamp, id);
@@ -0,0 +1,175 @@
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from metrics import LOG_RECORDS_DROPPED
+
+# Root level, and per-logger overrides as `name=LEVEL` pairs, e.g. "tools=DEBUG,httpx=WARNING"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.getenv("LOG_LEVELS", "httpx=WARNING,httpcore=WARNING,urllib3=WARNING,openai=WARNING,web3=WARNING")
+# json for log shippers, text for reading locally
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_MAX_MESSAGE_LENGTH = int(os.getenv("LOG_MAX_MESSAGE_LENGTH", "2000"))
+# Records logged with extra={"payload": True} (request bodies, message lists, cdp responses) are
+# kept at this rate and cut to LOG_PAYLOAD_MAX_LENGTH characters
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_PAYLOAD_MAX_LENGTH = int(os.getenv("LOG_PAYLOAD_MAX_LENGTH", "1000"))
+# Records waiting for the writer thread; past this they are dropped rather than block a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Wallet seeds and keys; the cdp bridge's wallet objects can carry the seed when serialized
+SECRET_KEY = re.compile(r"seed|mnemonic|private_?key|secret|password|api_?key|^master", re.IGNORECASE)
+SECRET_TEXT = re.compile(
+    r"""(['"]?\w*(?:seed|mnemonic|private_?key|secret|password|api_?key)\w*['"]?\s*[:=]\s*)(?:'[^']*'|"[^"]*"|[^\s,}]+)""",
+    re.IGNORECASE,
+)
+REDACTED = "[redacted]"
+
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "payload"}
+
+_listener = None
+
+
+def redact(value):
+    """Copy of `value` with secret-looking dict keys and `key=value` pairs masked."""
+    if isinstance(value, dict):
+        return {k: REDACTED if isinstance(k, str) and SECRET_KEY.search(k) else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(v) for v in value)
+    if isinstance(value, str):
+        return SECRET_TEXT.sub(lambda m: m.group(1) + REDACTED, value)
+    return value
+
+
+def truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...[{len(text) - limit} more chars]"
+
+
+def render_message(record):
+    """The record's message with secrets masked and large payloads cut down."""
+    message = record.msg if isinstance(record.msg, str) else str(record.msg)
+    if record.args:
+        message = message % redact(record.args)
+    limit = LOG_PAYLOAD_MAX_LENGTH if getattr(record, "payload", False) else LOG_MAX_MESSAGE_LENGTH
+    return truncate(redact(message), limit)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": render_message(record),
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and key not in entry:
+                entry[key] = redact(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def formatMessage(self, record):
+        record.message = render_message(record)
+        return super().formatMessage(record)
+
+
+class PayloadSampler(logging.Filter):
+    """Keeps a `rate` fraction of payload records; runs on the calling thread, before anything is formatted."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return not getattr(record, "payload", False) or random.random() < self.rate
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Hands records to the listener thread unformatted and never blocks on a full queue.
+
+    The stock QueueHandler formats each record on the calling thread so it can be pickled;
+    records here stay in-process, so formatting, redaction and the write all happen on the
+    listener thread instead. The catch is that logged objects are rendered a moment later, so
+    don't log an object and then mutate it.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def parse_levels(spec):
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(
+    level=LOG_LEVEL,
+    levels=LOG_LEVELS,
+    fmt=LOG_FORMAT,
+    sample_rate=LOG_PAYLOAD_SAMPLE_RATE,
+    queue_size=LOG_QUEUE_SIZE,
+    stream=None,
+):
+    """Route all logging through a queue to one writer thread. Safe to call more than once.
+
+    Request threads only build the LogRecord and put it on the queue; the QueueListener thread
+    formats it (as JSON unless LOG_FORMAT=text) and writes it to stderr.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+
+    records = queue.Queue(maxsize=queue_size)
+    handler = DeferredQueueHandler(records)
+    handler.addFilter(PayloadSampler(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, logger_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.unregister(shutdown_logging)
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """Write out whatever is still queued and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,96 +1,318 @@
+"""Run the agent outside the web server.
+
+With no arguments this runs the transfer demo below against the real services. With --input it
+runs a batch of scripted conversations for regression and red-team testing:
+
+    python main.py --input conversations.jsonl --output results.jsonl --concurrency 16
+    python main.py --input conversations.jsonl --output results.jsonl --offline
+
+Each input line is a conversation:
+
+    {"id": "transfer-over-limit", "turns": ["Hi", "Send 1 ETH to 0x..."],
+     "prompt": "prompts/agent_prompt.txt", "wallet": {"wallet_id": "...", "address": "0x..."}}
+
+`prompt` (default --prompt) and `wallet` are optional and become the same system messages the
+server sends. Each result line holds the replies, per-turn latency, token usage and every tool
+call with its arguments and output. Results are appended as conversations finish, and ids that
+already have a successful result in --output are skipped, so an interrupted run picks up where
+it stopped. --offline swaps in the benchmark fakes (scripted chat model, stub cdp bridge and an
+eth-tester chain), so no API keys or network are needed.
+"""
 import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langgraph.prebuilt import create_react_agent
-from tools.create_wallet import CreateWalletTool
-from tools.fund_wallet import FundWalletTool
-from tools.transfer_funds import TransferFundsTool
-from tools.get_balance import GetWalletBalanceTool
 
 # Load environment variables from the .env file
 load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+
+def build_agent(registry, llm=None):
+    from langchain_openai import ChatOpenAI
+    from agent import build_agent as build_server_agent
+    from history import HistoryPolicy
 
-# Initialize the LLM with the OpenAI API key from the environment
-llm = ChatOpenAI(model="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY"))
-
-# Initialize the tools from the provided files
-create_wallet_tool = CreateWalletTool()
-fund_wallet_tool = FundWalletTool()
-transfer_funds_tool = TransferFundsTool()
-get_balance_tool = GetWalletBalanceTool(web3_provider_url=os.getenv("WEB3_PROVIDER_URL"))
-
-# List of tools to be used by the agent
-tools = [fund_wallet_tool, transfer_funds_tool, get_balance_tool, create_wallet_tool]
-
-# Create the ReAct agent using the LangGraph create_react_agent method
-agent = create_react_agent(llm, tools)
-
-# # Example 1: Fund a wallet
-# user_message = "I want to fund my wallet with testnet ETH."
-# response = agent.invoke(
-#     {
-#         "messages": [
-#             ("system", "Create wallet with ID: 674069f0-3de9-40bf-a06b-22a9573c7861"), 
-#             ("human", user_message)
-#         ]
-#     }
-# )
-# print("# Demo 1: The agent funds a wallet by its")
-# print("-"*50)
-# print("## User Message: \n", user_message)
-# print("## Agent Response: \n", response["messages"][-1].content)
-# print("-"*50)
-
-# Example 2: Transfer funds
-user_message = "I want to transfer 0.0001 ETH to wallet 0xa7979BF6Ce644E4e36da2Ee65Db73c3f5A0dF895."
-response = agent.invoke(
-    {
-        "messages": [
-            ("system", "{\"message\": \"Wallet retrieved successfully\", \"address\": \"0xE9B0f8a530736313fdD388B0660163e93b298c77\",\"wallet_id\": \"674069f0-3de9-40bf-a06b-22a9573c7861\"}"),
-            ("human", user_message)
-        ]
+    # Initialize the LLM with the OpenAI API key from the environment
+    if llm is None:
+        llm = ChatOpenAI(model="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY"))
+
+    # The server's tools and history bounds; without a prompt registry each conversation keeps its own prompt
+    return build_server_agent(llm, registry, history_policy=HistoryPolicy())
+
+
+def conversation_wallets(conversations):
+    """GetPortfolio's wallet lookup: each conversation id (its user id here) to its `wallet`, if it has one."""
+    wallets = {
+        conversation["id"]: (conversation["wallet"]["wallet_id"], conversation["wallet"]["address"])
+        for conversation in conversations
+        if conversation.get("wallet")
     }
-)
-print("# Demo 2: The agent transfers funds between wallets.")
-print("-"*50)
-print("## User Message: \n", user_message)
-print("## Agent Response: \n", response["messages"][-1].content)
-print("-"*50) 
-
-
-# # Example 3: Get wallet balance
-# user_message = "What is the balance of my wallet with address 0xa7979BF6Ce644E4e36da2Ee65Db73c3f5A0dF895?"
-# response = agent.invoke({"messages": [("human", user_message)]})
-# print("# Demo 3: The agent retrieves the balance of a wallet.")
-# print("-"*50)
-# print("## User Message: \n", user_message)
-# print("## Agent Response: \n", response["messages"][-1].content)
-# print("-"*50)
-
-# # Example 4: Create a wallet
-# user_message = "I want to create a new wallet."
-# response = agent.invoke({"messages": [("human", user_message)]})
-# print("# Demo 4: The agent creates a new wallet.")
-# print("-"*50)
-# print("## User Message: \n", user_message)
-# print("## Agent Response: \n", response["messages"][-1].content)
-# print("-"*50)
-
-
-
-
-# Start a new conversation with the agent, set the system messages to be the response from the last tool calls
-# Load the file in prompts/malice_prompt.txt
-# with open("prompts/malice_prompt.txt", "r") as file:
-#     system_prompt = file.read()
-# response = agent.invoke(
-#     {
-#         "messages": [
-#             ("system", system_prompt),
-#             ("system", wallet_creation_response),
-#             ("system", fund_wallet_response),
-#             ("human", "Hi")
-#         ]
-#     }
-# )
-# print("Agent response:", response["messages"][-1].content)
+    return wallets.get
+
+
+def demo():
+    from tools.registry import default_registry
+
+    # Initialize the tools from the provided files; they share one cdp API wrapper
+    agent = build_agent(default_registry())
+
+    # # Example 1: Fund a wallet
+    # user_message = "I want to fund my wallet with testnet ETH."
+    # response = agent.invoke(
+    #     {
+    #         "messages": [
+    #             ("system", "Create wallet with ID: 674069f0-3de9-40bf-a06b-22a9573c7861"), 
+    #             ("human", user_message)
+    #         ]
+    #     }
+    # )
+    # print("# Demo 1: The agent funds a wallet by its")
+    # print("-"*50)
+    # print("## User Message: \n", user_message)
+    # print("## Agent Response: \n", response["messages"][-1].content)
+    # print("-"*50)
+
+    # Example 2: Transfer funds
+    user_message = "I want to transfer 0.0001 ETH to wallet 0xa7979BF6Ce644E4e36da2Ee65Db73c3f5A0dF895."
+    response = agent.invoke(
+        {
+            "messages": [
+                ("system", "{\"message\": \"Wallet retrieved successfully\", \"address\": \"0xE9B0f8a530736313fdD388B0660163e93b298c77\",\"wallet_id\": \"674069f0-3de9-40bf-a06b-22a9573c7861\"}"),
+                ("human", user_message)
+            ]
+        }
+    )
+    print("# Demo 2: The agent transfers funds between wallets.")
+    print("-"*50)
+    print("## User Message: \n", user_message)
+    print("## Agent Response: \n", response["messages"][-1].content)
+    print("-"*50) 
+
+
+    # # Example 3: Get wallet balance
+    # user_message = "What is the balance of my wallet with address 0xa7979BF6Ce644E4e36da2Ee65Db73c3f5A0dF895?"
+    # response = agent.invoke({"messages": [("human", user_message)]})
+    # print("# Demo 3: The agent retrieves the balance of a wallet.")
+    # print("-"*50)
+    # print("## User Message: \n", user_message)
+    # print("## Agent Response: \n", response["messages"][-1].content)
+    # print("-"*50)
+
+    # # Example 4: Create a wallet
+    # user_message = "I want to create a new wallet."
+    # response = agent.invoke({"messages": [("human", user_message)]})
+    # print("# Demo 4: The agent creates a new wallet.")
+    # print("-"*50)
+    # print("## User Message: \n", user_message)
+    # print("## Agent Response: \n", response["messages"][-1].content)
+    # print("-"*50)
+
+
+
+
+    # Start a new conversation with the agent, set the system messages to be the response from the last tool calls
+    # Load the file in prompts/malice_prompt.txt
+    # with open("prompts/malice_prompt.txt", "r") as file:
+    #     system_prompt = file.read()
+    # response = agent.invoke(
+    #     {
+    #         "messages": [
+    #             ("system", system_prompt),
+    #             ("system", wallet_creation_response),
+    #             ("system", fund_wallet_response),
+    #             ("human", "Hi")
+    #         ]
+    #     }
+    # )
+    # print("Agent response:", response["messages"][-1].content)
+
+
+def load_conversations(path):
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            if line.strip():
+                conversation = json.loads(line)
+                conversation.setdefault("id", f"line-{number}")
+                yield conversation
+
+
+def completed_ids(path):
+    """Ids with a successful result in an earlier (possibly interrupted) run."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by the interruption
+            if result.get("error") is None:
+                done.add(result["id"])
+    return done
+
+
+def read_prompt(path, cache={}):
+    if path not in cache:
+        with open(path) as file:
+            cache[path] = file.read().strip()
+    return cache[path]
+
+
+def tool_output(content, limit=500):
+    text = content if isinstance(content, str) else json.dumps(content, default=str)
+    return text if len(text) <= limit else f"{text[:limit]}...[{len(text) - limit} more chars]"
+
+
+def summarize_turn(new_messages):
+    """Reply, token usage and tool calls from the messages one turn added."""
+    from langchain_core.messages import AIMessage, ToolMessage
+
+    usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    calls = {}
+    for message in new_messages:
+        if isinstance(message, AIMessage):
+            for key in usage:
+                usage[key] += (message.usage_metadata or {}).get(key, 0)
+            for call in message.tool_calls:
+                calls[call["id"]] = {"name": call["name"], "args": call["args"]}
+        elif isinstance(message, ToolMessage) and message.tool_call_id in calls:
+            calls[message.tool_call_id]["output"] = tool_output(message.content)
+            calls[message.tool_call_id]["status"] = getattr(message, "status", "success")
+    reply = new_messages[-1].content if new_messages else None
+    return reply, usage, list(calls.values())
+
+
+async def run_conversation(agent, conversation, default_prompt, recursion_limit):
+    from tools.context import current_user_id
+
+    # Each conversation runs in its own task, so this only attributes spend to this conversation
+    current_user_id.set(conversation["id"])
+    messages = []
+    prompt = conversation.get("prompt", default_prompt)
+    if prompt:
+        messages.append(("system", read_prompt(prompt)))
+    if conversation.get("wallet"):
+        messages.append(("system", json.dumps(conversation["wallet"])))
+
+    result = {"id": conversation["id"], "turns": [], "usage": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}}
+    started = time.perf_counter()
+    try:
+        for text in conversation["turns"]:
+            messages.append(("human", text))
+            seen = len(messages)
+            turn_started = time.perf_counter()
+            state = None
+            async for state in agent.astream(
+                {"messages": messages}, config={"recursion_limit": recursion_limit}, stream_mode="values"
+            ):
+                pass
+            messages = state["messages"]
+            reply, usage, tool_calls = summarize_turn(messages[seen:])
+            result["turns"].append({
+                "input": text,
+                "reply": reply,
+                "latency_seconds": round(time.perf_counter() - turn_started, 4),
+                "usage": usage,
+                "tool_calls": tool_calls,
+            })
+            for key in usage:
+                result["usage"][key] += usage[key]
+        result["error"] = None
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency_seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+async def run_batch(agent, registry, conversations, output_path, concurrency, default_prompt, recursion_limit):
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"ok": 0, "error": 0}
+
+    with open(output_path, "a") as output:
+        async def run_one(conversation):
+            async with semaphore:
+                result = await run_conversation(agent, conversation, default_prompt, recursion_limit)
+            # Written as soon as it finishes so an interrupted run loses at most the ones in flight
+            output.write(json.dumps(result, default=str) + "\n")
+            output.flush()
+            counts["error" if result["error"] else "ok"] += 1
+            done = counts["ok"] + counts["error"]
+            if done % 100 == 0:
+                print(f"{done}/{len(conversations)} conversations done", file=sys.stderr)
+
+        try:
+            await asyncio.gather(*(run_one(conversation) for conversation in conversations))
+        finally:
+            # The async cdp client belongs to this event loop
+            await registry.async_api.aclose()
+    return counts
+
+
+def offline_registry(args, stack, wallet_lookup=None):
+    """Tools wired to the stub cdp bridge and an eth-tester chain, and the scripted model in place of OpenAI."""
+    from bench.stub_cdp import StubCdpServer
+
+    stub = stack.enter_context(StubCdpServer(latency=args.cdp_latency))
+    # Must be set before any tool module reads its configuration
+    os.environ["COINBASE_API_URL"] = stub.url
+    os.environ.setdefault("WEB3_PROVIDER_URL", "eth-tester")
+
+    from bench.fake_chain import attach_web3, eth_tester_web3
+    from bench.fake_llm import ScriptedChatModel
+    from tools.registry import default_registry
+
+    registry = default_registry(wallet_lookup=wallet_lookup)
+    attach_web3(registry.get("GetWalletBalance"), eth_tester_web3())
+    return registry, ScriptedChatModel(latency=args.llm_latency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--input", help="JSONL file of conversations; without it the demo runs")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL results, appended to and used to resume")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversations in flight at once")
+    parser.add_argument("--prompt", default="prompts/agent_prompt.txt", help="Policy prompt for conversations without one; '' for none")
+    parser.add_argument("--recursion-limit", type=int, default=25, help="Agent steps allowed per turn")
+    parser.add_argument("--limit", type=int, help="Only run the first N pending conversations")
+    parser.add_argument("--offline", action="store_true", help="Use the scripted model, stub cdp bridge and eth-tester chain")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds per scripted model call (--offline)")
+    parser.add_argument("--cdp-latency", type=float, default=0.0, help="Seconds per stub cdp request (--offline)")
+    args = parser.parse_args()
+
+    if not args.input:
+        demo()
+        return
+
+    done = completed_ids(args.output)
+    pending = [c for c in load_conversations(args.input) if c["id"] not in done]
+    if args.limit is not None:
+        pending = pending[:args.limit]
+    print(f"{len(pending)} conversations to run, {len(done)} already done", file=sys.stderr)
+
+    from contextlib import ExitStack
+    with ExitStack() as stack:
+        wallet_lookup = conversation_wallets(pending)
+        if args.offline:
+            registry, llm = offline_registry(args, stack, wallet_lookup)
+        else:
+            from tools.registry import default_registry
+            registry, llm = default_registry(wallet_lookup=wallet_lookup), None
+        agent = build_agent(registry, llm)
+        started = time.perf_counter()
+        try:
+            counts = asyncio.run(run_batch(agent, registry, pending, args.output, args.concurrency, args.prompt, args.recursion_limit))
+        except KeyboardInterrupt:
+            print("Interrupted; run again with the same --output to resume", file=sys.stderr)
+            sys.exit(130)
+    elapsed = time.perf_counter() - started
+    print(f"Done in {elapsed:.1f}s: {counts['ok']} ok, {counts['error']} failed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import os
+import time
+import threading
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Requests
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["endpoint", "method", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+SETUP_WALLET_LATENCY = Histogram("setup_wallet_duration_seconds", "Time spent resolving or creating the user's wallet")
+
+# Agent internals, recorded by callbacks.MetricsCallbackHandler
+TOOL_LATENCY = Histogram(
+    "tool_run_duration_seconds",
+    "Latency of each tool invocation",
+    ["tool", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+LLM_LATENCY = Histogram(
+    "llm_call_duration_seconds",
+    "Latency of each chat model call",
+    ["model", "status"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60),
+)
+LLM_TOKENS = Histogram(
+    "llm_tokens",
+    "Prompt and completion tokens per chat model call",
+    ["model", "kind"],
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000),
+)
+TOOL_OUTPUT_BYTES = Histogram(
+    "tool_output_bytes",
+    "Size of the projected tool results added to the conversation",
+    ["tool"],
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+CHECKPOINT_IO = Histogram(
+    "checkpoint_io_duration_seconds",
+    "Time spent reading and writing LangGraph checkpoints",
+    ["operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+# Per-thread turn queue
+THREAD_QUEUE_DEPTH = Gauge("thread_queue_depth", "Requests waiting for an earlier turn on the same conversation thread")
+THREAD_QUEUE_WAIT = Histogram(
+    "thread_queue_wait_seconds",
+    "Time from a request arriving to its turn starting, including waiting on other workers",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+THREAD_QUEUE_COALESCED = Counter("thread_queue_coalesced_total", "Messages merged into a turn queued by an earlier request")
+THREAD_QUEUE_REJECTED = Counter("thread_queue_rejected_total", "Requests refused by the thread queue", ["reason"])
+
+# Background transfer/trade jobs
+TRANSFER_JOBS = Counter("transfer_jobs_total", "Transfer and trade jobs by outcome", ["kind", "status"])
+TRANSFER_JOB_SECONDS = Histogram(
+    "transfer_job_duration_seconds",
+    "Time spent in the cdp call for each background job",
+    ["kind"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+TRANSFER_JOBS_PENDING_RECEIPTS = Gauge("transfer_jobs_pending_receipts", "Submitted transactions still waiting for a receipt")
+
+# Web3 RPC endpoint pool
+RPC_LATENCY = Histogram(
+    "rpc_request_duration_seconds",
+    "Latency of JSON-RPC requests per pooled endpoint, including hedged duplicates",
+    ["endpoint", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+RPC_HEDGES = Counter("rpc_hedged_requests_total", "Requests duplicated to a second endpoint, by which copy answered first", ["winner"])
+RPC_EJECTIONS = Counter("rpc_endpoint_ejections_total", "Times an endpoint was taken out of rotation for failing", ["endpoint"])
+
+# Fast-path router
+ROUTER_DECISIONS = Counter("query_router_decisions_total", "Requests answered by the fast path, by intent, or passed to the agent", ["route"])
+
+# Spend policy
+SPEND_POLICY_DECISIONS = Counter("spend_policy_decisions_total", "Transfers and trades allowed or rejected by the spend policy", ["tool", "result"])
+
+# Checkpoint connection pool. Every worker has its own pool, so under PROMETHEUS_MULTIPROC_DIR
+# the counts are summed over live workers and saturation is the most saturated worker's.
+CHECKPOINT_POOL_SAMPLE_INTERVAL = float(os.getenv("CHECKPOINT_POOL_SAMPLE_INTERVAL", "5"))
+CHECKPOINT_POOL_SIZE = Gauge("checkpoint_pool_size", "Connections currently open in the checkpoint pool", multiprocess_mode="livesum")
+CHECKPOINT_POOL_IN_USE = Gauge("checkpoint_pool_in_use", "Checkpoint pool connections checked out by requests", multiprocess_mode="livesum")
+CHECKPOINT_POOL_WAITING = Gauge(
+    "checkpoint_pool_requests_waiting", "Requests queued waiting for a checkpoint pool connection", multiprocess_mode="livesum"
+)
+CHECKPOINT_POOL_SATURATION = Gauge(
+    "checkpoint_pool_saturation", "Fraction of the checkpoint pool's max_size checked out (1.0 = exhausted)", multiprocess_mode="livemax"
+)
+
+# Streaming endpoint
+STREAM_TIME_TO_FIRST_TOKEN = Histogram(
+    "query_agent_stream_time_to_first_token_seconds",
+    "Time from receiving a streaming request to sending the first LLM token",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30),
+)
+STREAM_OPEN = Gauge("query_agent_streams_open", "Streaming responses currently in flight")
+
+# Warm wallet pool
+WALLET_POOL_DEPTH = Gauge("wallet_pool_depth", "Unclaimed pre-created wallets in the warm pool")
+WALLET_POOL_CLAIM_SECONDS = Histogram(
+    "wallet_pool_claim_seconds",
+    "Time taken to claim a wallet from the warm pool",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+WALLET_POOL_CLAIMS = Counter("wallet_pool_claims_total", "Warm pool claim attempts", ["result"])
+WALLET_POOL_CREATED = Counter("wallet_pool_wallets_created_total", "Wallets created by the warm pool refill worker")
+
+# Chat history writer
+CHAT_HISTORY_BUFFER_DEPTH = Gauge("chat_history_buffer_depth", "Conversation turns recorded but not yet written to chat_history")
+CHAT_HISTORY_FLUSH_SECONDS = Histogram(
+    "chat_history_flush_duration_seconds",
+    "Time taken to write one batch of turns to chat_history",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CHAT_HISTORY_FLUSH_ROWS = Histogram(
+    "chat_history_flush_rows",
+    "Turns written per chat_history batch",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+CHAT_HISTORY_WRITES = Counter("chat_history_writes_total", "Turns handled by the chat history writer, by outcome", ["result"])
+
+# Client-side rate limits for upstream APIs
+RATE_LIMIT_WAIT = Histogram(
+    "rate_limit_wait_seconds",
+    "Time spent waiting for an upstream rate limit token, by whether one was granted",
+    ["upstream", "result"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+RATE_LIMIT_UPSTREAM_THROTTLED = Counter("rate_limit_upstream_throttled_total", "429 responses that paused calls to an upstream", ["upstream"])
+RATE_LIMIT_ADMISSION_REJECTED = Counter("rate_limit_admission_rejected_total", "Requests turned away with a 503 because an upstream budget was exhausted")
+
+# Price quote cache
+PRICE_QUOTE_REQUESTS = Counter("price_quote_requests_total", "Quote lookups by whether the cache answered them", ["result"])
+PRICE_QUOTE_FETCH_SECONDS = Histogram(
+    "price_quote_fetch_duration_seconds",
+    "Time taken to fetch one price from the price source",
+    ["source", "status"],
+    buckets=(0.001, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+PRICE_QUOTE_REFRESHES = Counter("price_quote_refreshes_total", "Background refetches of quotes nearing expiry", ["result"])
+
+# Prompt registry
+PROMPT_RELOADS = Counter("prompt_reloads_total", "Prompt directory reloads after a file changed, by outcome", ["result"])
+
+# Logging
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records discarded because the logging queue was full")
+
+
+def pool_stats(pool):
+    """Return a snapshot of a psycopg ConnectionPool's sizing and saturation."""
+    stats = pool.get_stats()
+    size = stats.get("pool_size", 0)
+    in_use = size - stats.get("pool_available", 0)
+    return {
+        "pool_size": size,
+        "pool_max": pool.max_size,
+        "in_use": in_use,
+        "requests_waiting": stats.get("requests_waiting", 0),
+        "saturation": in_use / pool.max_size if pool.max_size else 0.0,
+    }
+
+
+_checkpoint_pool = None
+
+
+def sample_checkpoint_pool():
+    """Set the checkpoint pool gauges from the observed pool, if there is one."""
+    if _checkpoint_pool is None:
+        return
+    try:
+        stats = pool_stats(_checkpoint_pool)
+    except Exception:
+        return  # The pool is closing at shutdown; the gauges keep the last sample
+    CHECKPOINT_POOL_SIZE.set(stats["pool_size"])
+    CHECKPOINT_POOL_IN_USE.set(stats["in_use"])
+    CHECKPOINT_POOL_WAITING.set(stats["requests_waiting"])
+    CHECKPOINT_POOL_SATURATION.set(stats["saturation"])
+
+
+def _sample_checkpoint_pool_forever(interval):
+    while True:
+        sample_checkpoint_pool()
+        time.sleep(interval)
+
+
+def observe_checkpoint_pool(pool, interval=CHECKPOINT_POOL_SAMPLE_INTERVAL):
+    """Report `pool` through the checkpoint pool gauges.
+
+    The gauges are set every `interval` seconds by a daemon thread, and again by any scrape this
+    process serves. set_function() would be simpler, but its values never reach the files that
+    PROMETHEUS_MULTIPROC_DIR aggregates, and a scrape only reaches one worker anyway.
+    """
+    global _checkpoint_pool
+    _checkpoint_pool = pool
+    sample_checkpoint_pool()
+    threading.Thread(target=_sample_checkpoint_pool_forever, args=(interval,), name="checkpoint-pool-metrics", daemon=True).start()
+
+
+def render_metrics():
+    """Return (body, content_type) for the /metrics endpoint.
+
+    When PROMETHEUS_MULTIPROC_DIR is set (several server processes), samples from every
+    process are aggregated; otherwise the default in-process registry is rendered.
+    """
+    sample_checkpoint_pool()
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,65 @@
+from flask_sqlalchemy import SQLAlchemy
+
+# Bound to the Flask app in server.py with db.init_app(app)
+db = SQLAlchemy()
+
+# Model definition for user wallet information
+class UserWallet(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(255), nullable=False, unique=True)
+    wallet_id = db.Column(db.String(255), nullable=False)
+    wallet_address = db.Column(db.String(255), nullable=False)
+    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+
+# Pre-provisioned wallets waiting to be claimed by a first-time user
+class PooledWallet(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    wallet_id = db.Column(db.String(255), nullable=False, unique=True)
+    wallet_address = db.Column(db.String(255), nullable=False)
+    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+
+# Transfers and trades counted against the spend policy's rolling caps (see spend_policy.py)
+class SpendLedgerEntry(db.Model):
+    __tablename__ = "spend_ledger"
+    __table_args__ = (db.Index("ix_spend_ledger_user_timestamp", "user_id", "timestamp"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(255), nullable=False)
+    tool = db.Column(db.String(64), nullable=False)
+    asset = db.Column(db.String(32), nullable=False)
+    amount = db.Column(db.Numeric(36, 18), nullable=False)
+    destination = db.Column(db.String(255))
+    # pending until the cdp call returns; then confirmed, failed (still counted) or released
+    status = db.Column(db.String(16), nullable=False, default="pending", server_default="pending")
+    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+
+# Transfers and trades run in the background by transfer_jobs.TransferJobQueue
+class TransferJob(db.Model):
+    __tablename__ = "transfer_job"
+    id = db.Column(db.String(36), primary_key=True)
+    idempotency_key = db.Column(db.String(255), nullable=False, unique=True)
+    user_id = db.Column(db.String(255))
+    kind = db.Column(db.String(16), nullable=False)
+    params = db.Column(db.JSON, nullable=False)
+    # Spend ledger reservation settled when the job finishes
+    asset = db.Column(db.String(32))
+    reservation_id = db.Column(db.Integer)
+    # queued -> running -> submitted -> confirmed/reverted, or completed/failed
+    status = db.Column(db.String(16), nullable=False, default="queued", server_default="queued", index=True)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    transaction_hash = db.Column(db.String(66))
+    block_number = db.Column(db.BigInteger)
+    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+# Every conversation turn, kept for compliance; written in batches by chat_history.ChatHistoryWriter
+class ChatHistory(db.Model):
+    __tablename__ = "chat_history"
+    # Serves GET /history/<user_id>, which pages through one user's turns by (timestamp, id)
+    __table_args__ = (db.Index("ix_chat_history_user_timestamp", "user_id", "timestamp", "id"),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Text, nullable=False)
+    role = db.Column(db.Text, nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    # Set when the turn is recorded, not when its batch is flushed
+    timestamp = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
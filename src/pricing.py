@@ -0,0 +1,311 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from decimal import Decimal, InvalidOperation, localcontext
+import requests
+from cache import SingleFlight, TTLCache
+from metrics import PRICE_QUOTE_FETCH_SECONDS, PRICE_QUOTE_REFRESHES, PRICE_QUOTE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Where prices come from: coinbase (public spot prices) or static (PRICE_STATIC_QUOTES, for local runs)
+PRICE_SOURCE = os.getenv("PRICE_SOURCE", "coinbase")
+PRICE_SOURCE_URL = os.getenv("PRICE_SOURCE_URL", "https://api.coinbase.com/v2/prices")
+PRICE_SOURCE_TIMEOUT = float(os.getenv("PRICE_SOURCE_TIMEOUT", "3"))
+# Comma-separated BASE-QUOTE=price entries used by the static source, e.g. "ETH-USD=2500,USDC-USD=1"
+PRICE_STATIC_QUOTES = os.getenv("PRICE_STATIC_QUOTES", "ETH-USD=2500,USDC-USD=1")
+# A quote is never served once it is this old
+PRICE_QUOTE_TTL = float(os.getenv("PRICE_QUOTE_TTL", "30"))
+# Pairs read recently are refetched in the background once they are within this many seconds of expiring
+PRICE_QUOTE_REFRESH_AHEAD = float(os.getenv("PRICE_QUOTE_REFRESH_AHEAD", "10"))
+# Pairs nobody has read for this long stop being refreshed and are left to expire
+PRICE_QUOTE_IDLE_TIMEOUT = float(os.getenv("PRICE_QUOTE_IDLE_TIMEOUT", "300"))
+PRICE_QUOTE_CACHE_SIZE = int(os.getenv("PRICE_QUOTE_CACHE_SIZE", "256"))
+
+# Decimal places of each tradeable asset, as SYMBOL=decimals; amounts of unlisted assets are rejected
+ASSET_DECIMALS = os.getenv("ASSET_DECIMALS", "ETH=18,WETH=18,USDC=6,CBBTC=8")
+
+ETH_DECIMALS = 18
+
+Quote = namedtuple("Quote", ["base", "quote", "price", "source", "as_of"])
+
+
+class PriceUnavailable(Exception):
+    pass
+
+
+def to_base_units(amount, decimals=ETH_DECIMALS) -> int:
+    """Convert a decimal amount string ("0.1") to integer base units (wei for 18 decimals).
+
+    Exact: the amount is parsed as a Decimal, so "1.1" is 1100000000000000000 wei rather than
+    whatever float(amount) * 1e18 rounds to. Raises ValueError for anything that isn't a positive
+    amount or that has more decimal places than the asset can represent.
+    """
+    try:
+        value = Decimal(str(amount).strip())
+    except InvalidOperation as e:
+        raise ValueError(f"Invalid amount: {amount!r}") from e
+    if not value.is_finite() or value <= 0:
+        raise ValueError(f"Amount must be positive, got {amount!r}")
+    with localcontext() as ctx:
+        # Enough digits that scaling never rounds
+        ctx.prec = max(ctx.prec, len(value.as_tuple().digits) + decimals + 1)
+        units = value.scaleb(decimals)
+    if units != units.to_integral_value():
+        raise ValueError(f"Amount {amount} has more than {decimals} decimal places")
+    return int(units)
+
+
+def to_trade_amount(amount, decimals=ETH_DECIMALS) -> str:
+    """Validate `amount` like to_base_units and return it as a plain decimal string in whole units.
+
+    This is what the cdp bridge passes to createTrade, which takes whole units and scales them
+    itself. A string keeps it exact end to end; a JSON number would be rounded past 2^53 by Node.
+    """
+    text = format(from_base_units(to_base_units(amount, decimals), decimals), "f")
+    return text.rstrip("0").rstrip(".") if "." in text else text
+
+
+def parse_asset_decimals(spec=ASSET_DECIMALS):
+    decimals = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        symbol, places = entry.split("=")
+        decimals[symbol.strip().upper()] = int(places)
+    return decimals
+
+
+_asset_decimals = parse_asset_decimals()
+
+
+def asset_decimals(asset) -> int:
+    """Decimal places of `asset` (6 for USDC, 18 for ETH). Raises ValueError for an asset not in ASSET_DECIMALS."""
+    try:
+        return _asset_decimals[asset.strip().upper()]
+    except KeyError:
+        raise ValueError(f"Unsupported asset {asset!r}; expected one of {', '.join(_asset_decimals)}") from None
+
+
+def from_base_units(units, decimals=ETH_DECIMALS) -> Decimal:
+    with localcontext() as ctx:
+        ctx.prec = max(ctx.prec, len(str(abs(int(units)))) + decimals + 1)
+        return Decimal(int(units)).scaleb(-decimals)
+
+
+def pair_key(base, quote):
+    return base.strip().upper(), quote.strip().upper()
+
+
+class PriceSource:
+    """Where QuoteCache gets prices. `price` returns how many `quote` one `base` is worth."""
+
+    name = "source"
+
+    def price(self, base: str, quote: str) -> Decimal:
+        raise NotImplementedError
+
+
+class CoinbasePriceSource(PriceSource):
+    """Coinbase's public spot price endpoint; no API key needed."""
+
+    name = "coinbase"
+
+    def __init__(self, url=PRICE_SOURCE_URL, timeout=PRICE_SOURCE_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def price(self, base, quote):
+        try:
+            response = self.session.get(f"{self.url}/{base}-{quote}/spot", timeout=self.timeout)
+            response.raise_for_status()
+            return Decimal(response.json()["data"]["amount"])
+        except (requests.exceptions.RequestException, KeyError, TypeError, ValueError, InvalidOperation) as e:
+            raise PriceUnavailable(f"No {base}-{quote} price from {self.url}: {str(e)}") from e
+
+
+class StaticPriceSource(PriceSource):
+    """Fixed prices for local runs and benchmarks. Inverse pairs, X-X and crosses through a shared quote are derived."""
+
+    name = "static"
+
+    def __init__(self, prices):
+        self.prices = {pair_key(*pair): Decimal(str(price)) for pair, price in prices.items()}
+
+    @classmethod
+    def parse(cls, spec=PRICE_STATIC_QUOTES):
+        prices = {}
+        for entry in filter(None, (part.strip() for part in spec.split(","))):
+            pair, price = entry.split("=")
+            base, quote = pair.split("-")
+            prices[(base, quote)] = price
+        return cls(prices)
+
+    def _direct(self, base, quote):
+        if base == quote:
+            return Decimal(1)
+        if (base, quote) in self.prices:
+            return self.prices[(base, quote)]
+        if (quote, base) in self.prices:
+            return 1 / self.prices[(quote, base)]
+        return None
+
+    def price(self, base, quote):
+        base, quote = pair_key(base, quote)
+        price = self._direct(base, quote)
+        if price is not None:
+            return price
+        # e.g. USDC-ETH from USDC-USD and ETH-USD
+        for via in {currency for pair in self.prices for currency in pair}:
+            base_price, quote_price = self._direct(base, via), self._direct(quote, via)
+            if base_price is not None and quote_price is not None:
+                return base_price / quote_price
+        raise PriceUnavailable(f"No static price for {base}-{quote}")
+
+
+class QuoteCache:
+    """Prices per asset pair, shared by every conversation in the process.
+
+    A quote is cached for PRICE_QUOTE_TTL seconds and never served past that. Concurrent misses
+    for the same pair are collapsed into one call to the source (SingleFlight). Once `start`ed, a
+    daemon thread refetches pairs that were read within PRICE_QUOTE_IDLE_TIMEOUT before they
+    expire, so pairs in steady use are almost always a hit.
+
+    `get` fetches on a miss; `cached` never waits on the source and returns None on a miss,
+    asking the refresh thread to fetch the pair instead. Balances use `cached`, so pricing can
+    never slow a balance lookup down.
+    """
+
+    def __init__(
+        self,
+        source,
+        ttl=PRICE_QUOTE_TTL,
+        refresh_ahead=PRICE_QUOTE_REFRESH_AHEAD,
+        idle_timeout=PRICE_QUOTE_IDLE_TIMEOUT,
+        maxsize=PRICE_QUOTE_CACHE_SIZE,
+    ):
+        self.source = source
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.idle_timeout = idle_timeout
+        self.maxsize = maxsize
+        # pair -> (Quote, monotonic time it was fetched)
+        self._quotes = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+        # pair -> monotonic time it was last read, least recently read first; these are the pairs kept warm
+        self._reads = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, source=PRICE_SOURCE):
+        if source == "static":
+            return cls(StaticPriceSource.parse())
+        if source == "coinbase":
+            return cls(CoinbasePriceSource())
+        raise ValueError(f"Unknown PRICE_SOURCE {source!r}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._refresh_loop, name="quote-refresh", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(PRICE_SOURCE_TIMEOUT)
+        self._thread = None
+
+    def get(self, base, quote="USD") -> Quote:
+        """The pair's quote, from the cache or the source. Raises PriceUnavailable."""
+        pair = pair_key(base, quote)
+        entry = self._read(pair, refresh_missing=False)
+        if entry is not None:
+            PRICE_QUOTE_REQUESTS.labels(result="hit").inc()
+            return entry[0]
+        result, shared = self._flight.do(pair, lambda: self._fetch(pair))
+        PRICE_QUOTE_REQUESTS.labels(result="coalesced" if shared else "miss").inc()
+        return result
+
+    async def aget(self, base, quote="USD") -> Quote:
+        return await asyncio.to_thread(self.get, base, quote)
+
+    def cached(self, base, quote="USD"):
+        """The pair's quote if one is cached, else None. Never calls the source."""
+        entry = self._read(pair_key(base, quote))
+        PRICE_QUOTE_REQUESTS.labels(result="hit" if entry is not None else "cold").inc()
+        return entry[0] if entry is not None else None
+
+    def stats(self):
+        with self._lock:
+            warm = len(self._reads)
+        return {"source": self.source.name, "cached_pairs": len(self._quotes), "warm_pairs": warm}
+
+    def _read(self, pair, refresh_missing=True):
+        now = time.monotonic()
+        with self._lock:
+            self._reads[pair] = now
+            self._reads.move_to_end(pair)
+            while len(self._reads) > self.maxsize:
+                self._reads.popitem(last=False)
+        entry = self._quotes.get(pair)
+        if entry is None:
+            if refresh_missing:
+                self._wakeup.set()
+        elif now - entry[1] >= self.ttl - self.refresh_ahead:
+            self._wakeup.set()
+        return entry
+
+    def _fetch(self, pair):
+        start = time.perf_counter()
+        try:
+            price = self.source.price(*pair)
+        except Exception:
+            PRICE_QUOTE_FETCH_SECONDS.labels(source=self.source.name, status="error").observe(time.perf_counter() - start)
+            raise
+        PRICE_QUOTE_FETCH_SECONDS.labels(source=self.source.name, status="ok").observe(time.perf_counter() - start)
+        quote = Quote(pair[0], pair[1], price, self.source.name, time.time())
+        self._quotes.set(pair, (quote, time.monotonic()))
+        return quote
+
+    def _due(self, now):
+        """Pairs read recently whose quote is missing or about to expire; forgets idle pairs."""
+        with self._lock:
+            for pair in [pair for pair, read_at in self._reads.items() if now - read_at > self.idle_timeout]:
+                del self._reads[pair]
+            pairs = list(self._reads)
+        due = []
+        for pair in pairs:
+            entry = self._quotes.get(pair)
+            if entry is None or now - entry[1] >= self.ttl - self.refresh_ahead:
+                due.append(pair)
+        return due
+
+    def _refresh_loop(self):
+        # Check often enough that a pair entering its refresh window is fetched well before expiry
+        interval = max(self.refresh_ahead / 2, 0.05)
+        while not self._stopping.is_set():
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            for pair in self._due(time.monotonic()):
+                if self._stopping.is_set():
+                    return
+                try:
+                    self._flight.do(pair, lambda: self._fetch(pair))
+                    PRICE_QUOTE_REFRESHES.labels(result="ok").inc()
+                except Exception as e:
+                    PRICE_QUOTE_REFRESHES.labels(result="failed").inc()
+                    # Stop retrying until someone asks again, so a bad pair isn't fetched every interval
+                    with self._lock:
+                        self._reads.pop(pair, None)
+                    logger.warning(f"Failed to refresh {pair[0]}-{pair[1]} price: {str(e)}")
+
+
+def quote_value(amount: Decimal, quote: Quote) -> str:
+    """`amount` of the quote's base asset in the quote currency, to the cent."""
+    return format((amount * quote.price).quantize(Decimal("0.01")), "f")
@@ -0,0 +1,157 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from metrics import PROMPT_RELOADS
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = os.getenv("PROMPTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts"))
+# The system prompt every conversation runs under, by file name without .txt; startup fails without it
+POLICY_PROMPT = os.getenv("POLICY_PROMPT", "agent_prompt")
+# Seconds between checks of the prompt files for changes; 0 disables hot reload
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "2"))
+# Superseded versions kept so a turn that started before a reload finishes on the prompt it began with
+PROMPT_VERSIONS_KEPT = int(os.getenv("PROMPT_VERSIONS_KEPT", "32"))
+# Reads tried by the first load while files keep changing under it, PROMPT_LOAD_RETRY_DELAY seconds apart
+PROMPT_LOAD_ATTEMPTS = int(os.getenv("PROMPT_LOAD_ATTEMPTS", "5"))
+PROMPT_LOAD_RETRY_DELAY = 0.1
+
+Prompt = namedtuple("Prompt", ["name", "text", "version"])
+
+
+class PromptMissing(RuntimeError):
+    pass
+
+
+def prompt_version(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+class PromptRegistry:
+    """Every prompt in PROMPTS_DIR, read once and served from memory.
+
+    Prompts are keyed by file name without `.txt` and versioned by a hash of their text, so
+    the version changes exactly when the wording does. `load` reads the whole directory into a
+    new snapshot and swaps it in with a single assignment; readers never see a half-loaded set.
+    Once `start`ed, a daemon thread stats the files every PROMPT_RELOAD_INTERVAL seconds and
+    reloads when any mtime or size changes, or a file appears or disappears.
+
+    The `required` prompts must exist and be non-empty: `load` raises PromptMissing at startup,
+    and a reload that would lose one is refused, keeping the prompts already loaded. A file
+    written during a reload is picked up on the next check; the first load, with nothing to fall
+    back on, re-reads up to PROMPT_LOAD_ATTEMPTS times and then raises PromptMissing.
+    """
+
+    def __init__(self, directory=PROMPTS_DIR, required=(POLICY_PROMPT,), reload_interval=PROMPT_RELOAD_INTERVAL):
+        self.directory = directory
+        self.required = tuple(required)
+        self.reload_interval = reload_interval
+        self._prompts = {}
+        self._signature = None
+        # version -> Prompt, including versions no longer on disk
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _stat(self):
+        """(name, mtime, size) for every prompt file; changes whenever a prompt file does."""
+        entries = []
+        for file_name in sorted(os.listdir(self.directory)):
+            if file_name.endswith(".txt"):
+                stat = os.stat(os.path.join(self.directory, file_name))
+                entries.append((file_name, stat.st_mtime_ns, stat.st_size))
+        return tuple(entries)
+
+    def _read(self):
+        """(signature, prompts) for the directory, or None if a file changed while it was read."""
+        signature = self._stat()
+        prompts = {}
+        for file_name, _, _ in signature:
+            with open(os.path.join(self.directory, file_name), "r") as file:
+                text = file.read().strip()
+            name = file_name[:-len(".txt")]
+            prompts[name] = Prompt(name, text, prompt_version(text))
+        missing = [name for name in self.required if not prompts.get(name) or not prompts[name].text]
+        if missing:
+            raise PromptMissing(f"Required prompt(s) {', '.join(missing)} missing or empty in {self.directory}")
+        if self._stat() != signature:
+            return None
+        return signature, prompts
+
+    def load(self):
+        """Read every prompt and swap them in. Returns True if anything changed."""
+        with self._lock:
+            attempts = 1 if self._prompts else PROMPT_LOAD_ATTEMPTS
+            for attempt in range(attempts):
+                if attempt:
+                    time.sleep(PROMPT_LOAD_RETRY_DELAY)
+                read = self._read()
+                if read is not None:
+                    break
+            else:
+                if self._prompts:
+                    # Keep serving the loaded prompts; the next check tries again
+                    return False
+                raise PromptMissing(f"Prompts in {self.directory} kept changing while being read")
+            signature, prompts = read
+            changed = {name: prompt.version for name, prompt in prompts.items()} != self.versions()
+            for prompt in prompts.values():
+                self._versions[prompt.version] = prompt
+                self._versions.move_to_end(prompt.version)
+            while len(self._versions) > max(PROMPT_VERSIONS_KEPT, len(prompts)):
+                self._versions.popitem(last=False)
+            self._prompts = prompts
+            self._signature = signature
+        if changed:
+            logger.info(f"Loaded prompts: {self.versions()}")
+        return changed
+
+    def start(self):
+        if self.reload_interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._reload_loop, name="prompt-reload", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(self.reload_interval)
+        self._thread = None
+
+    def get(self, name):
+        prompt = self._prompts.get(name)
+        if prompt is None:
+            raise PromptMissing(f"No prompt named {name} in {self.directory}")
+        return prompt
+
+    def policy(self):
+        return self.get(self.required[0])
+
+    def version(self, version):
+        """The prompt with this version, if it is still held; None otherwise."""
+        return self._versions.get(version)
+
+    def versions(self):
+        return {name: prompt.version for name, prompt in self._prompts.items()}
+
+    def _reload_loop(self):
+        # Files as they were when a reload last failed, so a broken state is reported once
+        failed = None
+        while not self._stopping.wait(self.reload_interval):
+            signature = None
+            try:
+                signature = self._stat()
+                if signature == self._signature or signature == failed:
+                    continue
+                if self.load():
+                    PROMPT_RELOADS.labels(result="reloaded").inc()
+                failed = None
+            except Exception as e:
+                failed = signature
+                PROMPT_RELOADS.labels(result="failed").inc()
+                logger.error(f"Failed to reload prompts, keeping versions {self.versions()}: {str(e)}")
@@ -0,0 +1,352 @@
+import os
+import json
+import math
+import time
+import asyncio
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+import psycopg
+from langchain_core.rate_limiters import BaseRateLimiter
+from metrics import RATE_LIMIT_ADMISSION_REJECTED, RATE_LIMIT_UPSTREAM_THROTTLED, RATE_LIMIT_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Where the buckets live: postgres (shared by every worker), file (every worker on one host),
+# memory (this process only) or off
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "postgres")
+RATE_LIMIT_DIR = os.getenv("RATE_LIMIT_DIR", "/tmp/rate-limits")
+# Sustained requests per second and burst size for each upstream; a rate of 0 means unlimited
+CDP_RATE_LIMIT = float(os.getenv("CDP_RATE_LIMIT", "10"))
+CDP_RATE_BURST = float(os.getenv("CDP_RATE_BURST", "20"))
+OPENAI_RATE_LIMIT = float(os.getenv("OPENAI_RATE_LIMIT", "8"))
+OPENAI_RATE_BURST = float(os.getenv("OPENAI_RATE_BURST", "16"))
+# Longest a call waits for a token before giving up with RateLimited
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "5"))
+# How long an admission decision is reused before the buckets are read again
+RATE_LIMIT_ADMISSION_CACHE = float(os.getenv("RATE_LIMIT_ADMISSION_CACHE", "0.25"))
+
+
+class RateLimited(Exception):
+    """An upstream's request budget is used up; nothing was sent."""
+
+    def __init__(self, upstream, retry_after):
+        self.upstream = upstream
+        self.retry_after = retry_after
+        super().__init__(
+            f"The {upstream} API is rate limited; retry in {math.ceil(retry_after)}s rather than right away"
+        )
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _take(tokens, updated_at, now, rate, capacity, n):
+    """Token bucket step shared by every store: returns (wait, tokens, updated_at).
+
+    A wait of 0 means the tokens were taken. A blocked bucket (after a 429) has updated_at in
+    the future, so it refills nothing until the block ends.
+    """
+    available = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+    if now >= updated_at and available >= n:
+        return 0.0, available - n, now
+    return max(0.0, updated_at - now) + max(0.0, n - available) / rate, tokens, updated_at
+
+
+class MemoryBucketStore:
+    """Buckets for this process only; for the CLI, tests and single-worker deployments."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, name, rate, capacity, n=1):
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.get(name, (capacity, now))
+            wait, tokens, updated_at = _take(tokens, updated_at, now, rate, capacity, n)
+            self._buckets[name] = (tokens, updated_at)
+            return wait
+
+    def block(self, name, seconds):
+        with self._lock:
+            now = time.monotonic()
+            _, updated_at = self._buckets.get(name, (0.0, now))
+            self._buckets[name] = (0.0, max(updated_at, now + seconds))
+
+
+class _SharedBucketStore:
+    """A store that keeps (tokens, updated_at) per bucket somewhere other workers can see it.
+
+    Subclasses implement `_update(name, step)`: lock the bucket, call `step(state, now)` with
+    its stored state (None if new) and the store's clock, save the new state and return the
+    result.
+    """
+
+    def take(self, name, rate, capacity, n=1):
+        def step(state, now):
+            tokens, updated_at = state or (capacity, now)
+            wait, tokens, updated_at = _take(tokens, updated_at, now, rate, capacity, n)
+            return wait, (tokens, updated_at)
+        return self._update(name, step)
+
+    def block(self, name, seconds):
+        def step(state, now):
+            updated_at = state[1] if state else now
+            return None, (0.0, max(updated_at, now + seconds))
+        self._update(name, step)
+
+
+class FileBucketStore(_SharedBucketStore):
+    """Buckets in small files under `directory`, shared by every worker on the host via flock."""
+
+    def __init__(self, directory=RATE_LIMIT_DIR):
+        import fcntl
+        self._flock = fcntl.flock
+        self._exclusive = fcntl.LOCK_EX
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _update(self, name, step):
+        with open(os.path.join(self.directory, f"{name}.bucket"), "a+") as file:
+            self._flock(file, self._exclusive)  # Released when the file is closed
+            file.seek(0)
+            state = json.loads(file.read() or "null")
+            result, state = step(state, time.time())
+            file.seek(0)
+            file.truncate()
+            file.write(json.dumps(state))
+            return result
+
+class PostgresBucketStore(_SharedBucketStore):
+    """Buckets in the `rate_limit_bucket` table, shared by every worker on every host.
+
+    Each take is one short transaction holding the bucket's row lock, on a dedicated connection
+    per process (like thread_queue.ThreadQueue), timed by the database clock so workers with
+    skewed clocks still agree.
+    """
+
+    def __init__(self, conninfo):
+        self.conninfo = conninfo
+        self._conn = None
+        self._conn_lock = threading.Lock()
+
+    def _connection(self):
+        # Caller holds self._conn_lock
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg.connect(self.conninfo, autocommit=True)
+        return self._conn
+
+    def setup(self):
+        with self._conn_lock:
+            self._connection().execute("""
+                CREATE TABLE IF NOT EXISTS rate_limit_bucket (
+                    name TEXT PRIMARY KEY,
+                    tokens DOUBLE PRECISION NOT NULL,
+                    updated_at DOUBLE PRECISION NOT NULL
+                )
+            """)
+
+    def _update(self, name, step):
+        select = (
+            "SELECT tokens, updated_at, extract(epoch FROM clock_timestamp())::float8 "
+            "FROM rate_limit_bucket WHERE name = %s FOR UPDATE"
+        )
+        with self._conn_lock:
+            try:
+                conn = self._connection()
+                with conn.transaction():
+                    row = conn.execute(select, (name,)).fetchone()
+                    if row is None:
+                        # First use of the bucket; the step below fills it
+                        conn.execute(
+                            "INSERT INTO rate_limit_bucket (name, tokens, updated_at) VALUES (%s, 'NaN', 0) ON CONFLICT DO NOTHING",
+                            (name,),
+                        )
+                        row = conn.execute(select, (name,)).fetchone()
+                    tokens, updated_at, now = row
+                    result, (tokens, updated_at) = step(None if math.isnan(tokens) else (tokens, updated_at), now)
+                    conn.execute(
+                        "UPDATE rate_limit_bucket SET tokens = %s, updated_at = %s WHERE name = %s",
+                        (tokens, updated_at, name),
+                    )
+                    return result
+            except psycopg.OperationalError:
+                self._conn = None
+                raise
+
+class RateLimiter:
+    """Client-side token buckets, one per upstream (`cdp`, `openai`).
+
+    `acquire` takes a token before each upstream call, waiting up to RATE_LIMIT_MAX_WAIT for
+    one and raising RateLimited past that. When an upstream answers 429, `block` empties its
+    bucket until the Retry-After time for every worker sharing the store, so nobody hammers an
+    upstream that already said no. `admit` is the admission check: it raises when new work
+    would only queue behind an exhausted budget, so the server can turn it away early.
+
+    If the store itself fails (say Postgres is briefly unreachable) calls are let through; the
+    limiter must never be the thing that takes the agent down.
+    """
+
+    def __init__(self, store, buckets, max_wait=RATE_LIMIT_MAX_WAIT, admission_cache=RATE_LIMIT_ADMISSION_CACHE):
+        self.store = store
+        # name -> (rate per second, capacity); a zero rate means unlimited
+        self.buckets = {name: spec for name, spec in buckets.items() if spec[0] > 0}
+        self.max_wait = max_wait
+        self.admission_cache = admission_cache
+        self._admission = {}  # name -> (checked at, seconds until a token is free)
+
+    @classmethod
+    def from_env(cls, conninfo=None, backend=RATE_LIMIT_BACKEND):
+        """The limiter configured by RATE_LIMIT_BACKEND and the *_RATE_LIMIT settings, or None if off."""
+        if backend == "off":
+            return None
+        if backend == "postgres" and conninfo:
+            store = PostgresBucketStore(conninfo)
+            store.setup()
+        elif backend == "file":
+            store = FileBucketStore()
+        else:
+            store = MemoryBucketStore()
+        return cls(store, {"cdp": (CDP_RATE_LIMIT, CDP_RATE_BURST), "openai": (OPENAI_RATE_LIMIT, OPENAI_RATE_BURST)})
+
+    def _try(self, name):
+        rate, capacity = self.buckets[name]
+        try:
+            return self.store.take(name, rate, capacity)
+        except Exception as e:
+            logger.error(f"Rate limit store unavailable, letting {name} through: {str(e)}")
+            return 0.0
+
+    def _check(self, name, wait, waited):
+        if wait > self.max_wait - waited:
+            self._admission[name] = (time.monotonic(), wait)
+            RATE_LIMIT_WAIT.labels(upstream=name, result="rejected").observe(waited)
+            raise RateLimited(name, wait)
+
+    def acquire(self, name):
+        """Take one token for `name`, waiting up to max_wait. Raises RateLimited."""
+        if name not in self.buckets:
+            return
+        started = time.monotonic()
+        while True:
+            waited = time.monotonic() - started
+            wait = self._try(name)
+            if wait == 0:
+                RATE_LIMIT_WAIT.labels(upstream=name, result="acquired").observe(waited)
+                return
+            self._check(name, wait, waited)
+            time.sleep(wait)
+
+    async def aacquire(self, name):
+        if name not in self.buckets:
+            return
+        started = time.monotonic()
+        while True:
+            waited = time.monotonic() - started
+            wait = self._try(name) if isinstance(self.store, MemoryBucketStore) else await asyncio.to_thread(self._try, name)
+            if wait == 0:
+                RATE_LIMIT_WAIT.labels(upstream=name, result="acquired").observe(waited)
+                return
+            self._check(name, wait, waited)
+            await asyncio.sleep(wait)
+
+    def block(self, name, seconds):
+        """Stop every worker from calling `name` for `seconds`, e.g. after a 429 with Retry-After."""
+        RATE_LIMIT_UPSTREAM_THROTTLED.labels(upstream=name).inc()
+        self._admission[name] = (time.monotonic(), seconds)
+        if name not in self.buckets:
+            return
+        logger.warning(f"{name} is rate limiting us; holding calls for {seconds:.1f}s")
+        try:
+            self.store.block(name, seconds)
+        except Exception as e:
+            logger.error(f"Failed to record the {name} rate limit: {str(e)}")
+
+    def admit(self, names):
+        """Raise RateLimited if any of `names` has a budget so exhausted that new work would only time out.
+
+        Reads the buckets without taking a token, through a short-lived per-process cache so
+        the check stays off the database for most requests.
+        """
+        now = time.monotonic()
+        worst = None
+        for name in names:
+            checked_at, wait = self._admission.get(name, (None, 0.0))
+            if checked_at is None or now - checked_at > self.admission_cache:
+                checked_at, wait = now, self._peek(name)
+                self._admission[name] = (checked_at, wait)
+            remaining = wait - (now - checked_at)
+            if remaining > self.max_wait and (worst is None or remaining > worst[1]):
+                worst = (name, remaining)
+        if worst is not None:
+            RATE_LIMIT_ADMISSION_REJECTED.inc()
+            raise RateLimited(*worst)
+
+    def _peek(self, name):
+        if name not in self.buckets:
+            return 0.0
+        rate, capacity = self.buckets[name]
+        try:
+            # Asking for more than the bucket can hold never takes anything; the answer is the wait
+            # for capacity + 1 tokens, which is capacity / rate longer than the wait for one
+            return max(0.0, self.store.take(name, rate, capacity, capacity + 1) - capacity / rate)
+        except Exception as e:
+            logger.error(f"Rate limit store unavailable, admitting {name} work: {str(e)}")
+            return 0.0
+
+    def chat_model_limiter(self, name="openai"):
+        """This limiter's `name` bucket as a LangChain rate limiter, for ChatOpenAI(rate_limiter=...)."""
+        return _ChatModelRateLimiter(self, name)
+
+    def throttled(self, error, name="openai"):
+        """The RateLimited equivalent of an upstream 429 raised by a client library, or None.
+
+        Blocks the bucket for the upstream's Retry-After so other workers back off too.
+        """
+        if isinstance(error, RateLimited):
+            return error
+        response = getattr(error, "response", None)
+        if getattr(response, "status_code", None) != 429:
+            return None
+        retry_after = parse_retry_after(response.headers.get("retry-after")) or 1.0
+        self.block(name, retry_after)
+        return RateLimited(name, retry_after)
+
+
+class _ChatModelRateLimiter(BaseRateLimiter):
+    def __init__(self, limiter, name):
+        self.limiter = limiter
+        self.name = name
+
+    def acquire(self, *, blocking=True):
+        self.limiter.acquire(self.name)
+        return True
+
+    async def aacquire(self, *, blocking=True):
+        await self.limiter.aacquire(self.name)
+        return True
+
+
+# Process-wide limiter used by the cdp API wrappers; set by the server, None (unlimited) elsewhere
+_rate_limiter = None
+
+
+def set_rate_limiter(limiter):
+    global _rate_limiter
+    _rate_limiter = limiter
+
+
+def get_rate_limiter():
+    return _rate_limiter
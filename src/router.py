@@ -0,0 +1,114 @@
+import os
+import re
+import json
+import uuid
+import logging
+from typing import Optional
+from langchain_core.messages import AIMessage, ToolMessage
+from metrics import ROUTER_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "false").lower() == "true"
+
+# Whole-message patterns only: anything with extra content (an amount, another address, a
+# follow-up question) doesn't match and goes to the agent
+_FILLER = r"(?:(?:hey|hi|hello|ok|okay)[,!]?\s+)?(?:(?:please|pls|can you|could you|would you)\s+)?"
+_TAIL = r"(?:\s+(?:please|pls|for me|now))?(?:\s*(?:,\s*)?(?:thanks|thank you))?"
+INTENT_PATTERNS = {
+    "balance": [
+        r"(?:what(?:'s| is)\s+)?(?:my\s+)?(?:wallet\s+|eth\s+|current\s+)*balance",
+        r"(?:check|show|get|tell me)\s+(?:me\s+)?my\s+(?:wallet\s+|eth\s+)*balance",
+        r"how much (?:eth|money|funds?)?\s*(?:do i have|is in my wallet|have i got)",
+    ],
+    "fund": [
+        r"(?:fund|top up|refill)\s+(?:my wallet|me|my account)(?:\s+with (?:some )?(?:testnet |test )?eth)?",
+        r"(?:send|give) me (?:some )?(?:testnet |test )?(?:eth|funds)(?: from the faucet)?",
+        r"(?:use the )?faucet",
+    ],
+    "address": [
+        r"(?:what(?:'s| is)\s+)?my\s+(?:wallet\s+)?address",
+        r"(?:show|give|tell)\s+me\s+my\s+(?:wallet\s+)?address",
+    ],
+}
+INTENTS = {
+    intent: [re.compile(rf"^{_FILLER}{pattern}{_TAIL}[\s?.!]*$") for pattern in patterns]
+    for intent, patterns in INTENT_PATTERNS.items()
+}
+
+
+def match_intent(text: str) -> Optional[str]:
+    normalized = " ".join(text.lower().replace("’", "'").split())
+    for intent, patterns in INTENTS.items():
+        if any(pattern.match(normalized) for pattern in patterns):
+            return intent
+    return None
+
+
+class FastPathRouter:
+    """Answers the most common, unambiguous requests without the ReAct loop.
+
+    When a message is clearly a balance, funding or address request the router calls the tool
+    directly (or answers from the wallet record) and renders a templated reply, saving the LLM
+    call that would otherwise pick the tool. The exchange is written to the user's checkpoint
+    thread as the same tool call / tool result / reply messages the agent produces, so later
+    turns see a consistent history. Everything else returns None and goes to the agent.
+    """
+
+    def __init__(self, tools, enabled=FAST_PATH_ENABLED):
+        # A tools.registry.ToolRegistry, so the tools are only built once a request needs them
+        self.tools = tools
+        self.enabled = enabled
+
+    def respond(self, agent, messages, config) -> Optional[str]:
+        # New wallets carry the policy prompt and get the agent's introduction
+        if not self.enabled or len(messages) != 2:
+            return None
+        (_, wallet_message), (_, user_message) = messages
+        intent = match_intent(user_message or "")
+        if intent is None:
+            ROUTER_DECISIONS.labels(route="agent").inc()
+            return None
+        wallet = json.loads(wallet_message)
+
+        try:
+            if intent == "balance":
+                reply, exchange = self._call(self.tools.get("GetWalletBalance"), {"wallet_address": wallet["address"]}, config, self._balance_reply)
+            elif intent == "fund":
+                reply, exchange = self._call(self.tools.get("FundWallet"), {"wallet_id": wallet["wallet_id"]}, config, self._fund_reply)
+            else:
+                reply, exchange = f"Your wallet address is {wallet['address']}.", []
+        except Exception as e:
+            logger.warning(f"Fast path {intent} failed, falling back to the agent: {str(e)}")
+            ROUTER_DECISIONS.labels(route="agent").inc()
+            return None
+
+        agent.update_state(config, {"messages": list(messages) + exchange + [AIMessage(content=reply)]}, as_node="agent")
+        ROUTER_DECISIONS.labels(route=intent).inc()
+        logger.info(f"Fast path answered {intent} for thread {config['configurable']['thread_id']}")
+        return reply
+
+    def _call(self, tool, args, config, render):
+        # Invoked through the runnable interface so the metrics callbacks still see the tool run
+        output = tool.invoke(args, config={"callbacks": config.get("callbacks")})
+        call_id = f"call_{uuid.uuid4().hex[:24]}"
+        exchange = [
+            AIMessage(content="", tool_calls=[{"name": tool.name, "args": args, "id": call_id}]),
+            ToolMessage(content=output if isinstance(output, str) else json.dumps(output), name=tool.name, tool_call_id=call_id),
+        ]
+        return render(output), exchange
+
+    @staticmethod
+    def _balance_reply(result):
+        if result.get("balance_usd"):
+            return f"Your wallet {result['address']} holds {result['balance_eth']} ETH (about ${result['balance_usd']})."
+        return f"Your wallet {result['address']} holds {result['balance_eth']} ETH."
+
+    @staticmethod
+    def _fund_reply(result):
+        if result.startswith("Funding failed"):
+            return f"Sorry, I couldn't fund your wallet right now. {result}"
+        link = json.loads(result).get("transaction_link")
+        if link:
+            return f"Done! I've sent testnet ETH to your wallet: {link}"
+        return "Done! I've sent testnet ETH to your wallet."
@@ -0,0 +1,222 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+from web3 import Web3
+from web3.providers.base import JSONBaseProvider
+from metrics import RPC_EJECTIONS, RPC_HEDGES, RPC_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Per-endpoint request timeout; the pool fails over well before this for a slow endpoint
+RPC_REQUEST_TIMEOUT = float(os.getenv("RPC_REQUEST_TIMEOUT", "10"))
+# Outcomes remembered per endpoint for latency percentiles and the error rate
+RPC_HEALTH_WINDOW = int(os.getenv("RPC_HEALTH_WINDOW", "100"))
+# The hedge goes out once the primary is slower than its own p95, clamped to these bounds
+RPC_HEDGE_QUANTILE = float(os.getenv("RPC_HEDGE_QUANTILE", "0.95"))
+RPC_HEDGE_MIN_DELAY = float(os.getenv("RPC_HEDGE_MIN_DELAY", "0.05"))
+RPC_HEDGE_MAX_DELAY = float(os.getenv("RPC_HEDGE_MAX_DELAY", "1.0"))
+# An endpoint failing at least this fraction of its recent requests is taken out of rotation
+RPC_EJECT_ERROR_RATE = float(os.getenv("RPC_EJECT_ERROR_RATE", "0.5"))
+RPC_EJECT_MIN_SAMPLES = int(os.getenv("RPC_EJECT_MIN_SAMPLES", "5"))
+RPC_EJECT_SECONDS = float(os.getenv("RPC_EJECT_SECONDS", "30"))
+# An endpoint that hasn't been measured for this long gets one probe request, so a single slow
+# answer doesn't demote it for good
+RPC_RESAMPLE_INTERVAL = float(os.getenv("RPC_RESAMPLE_INTERVAL", "30"))
+RPC_POOL_WORKERS = int(os.getenv("RPC_POOL_WORKERS", "16"))
+
+
+class _Endpoint:
+    def __init__(self, url, timeout, window):
+        self.url = url
+        # Only the host goes into logs and metric labels; hosted providers put the API key in the path
+        self.label = urlparse(url).netloc or url
+        # No retries inside the provider: failing over to another endpoint is the pool's job
+        self.provider = Web3.HTTPProvider(url, request_kwargs={"timeout": timeout}, exception_retry_configuration=None)
+        self.latencies = deque(maxlen=window)  # Seconds, successful requests only
+        self.errors = deque(maxlen=window)  # True for each failed request
+        self.ejected_until = 0.0
+        self.sampled_at = float("-inf")
+        # Readmitted endpoints are ejected again on their first failure
+        self.probation = False
+
+    def healthy(self, now):
+        return now >= self.ejected_until
+
+    def quantile(self, q):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def error_rate(self):
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def stale(self, now, resample_interval):
+        return now - self.sampled_at > resample_interval
+
+    def score(self, now, resample_interval):
+        # Expected seconds per successful answer; endpoints due for a probe go first
+        if self.stale(now, resample_interval):
+            return 0.0
+        median = self.quantile(0.5)
+        if median is None:
+            return float("inf")
+        return median / max(1.0 - self.error_rate(), 0.01)
+
+
+class RPCPool(JSONBaseProvider):
+    """A web3 provider that spreads reads over several JSON-RPC endpoints.
+
+    Every request goes to the endpoint with the best score (rolling median latency, inflated by
+    its recent error rate). If that endpoint hasn't answered within its own p95 latency, the same
+    request is hedged to the next best endpoint and whichever answers first wins; a failure fails
+    over to the next endpoint immediately. Endpoints whose recent error rate crosses
+    RPC_EJECT_ERROR_RATE are ejected for RPC_EJECT_SECONDS, then readmitted on probation, and
+    one that hasn't been measured for RPC_RESAMPLE_INTERVAL is probed again.
+
+    Requests are sent more than once, so only use the pool for reads.
+    """
+
+    def __init__(
+        self,
+        urls,
+        timeout=RPC_REQUEST_TIMEOUT,
+        window=RPC_HEALTH_WINDOW,
+        hedge_quantile=RPC_HEDGE_QUANTILE,
+        hedge_min_delay=RPC_HEDGE_MIN_DELAY,
+        hedge_max_delay=RPC_HEDGE_MAX_DELAY,
+        eject_error_rate=RPC_EJECT_ERROR_RATE,
+        eject_min_samples=RPC_EJECT_MIN_SAMPLES,
+        eject_seconds=RPC_EJECT_SECONDS,
+        resample_interval=RPC_RESAMPLE_INTERVAL,
+        workers=RPC_POOL_WORKERS,
+    ):
+        super().__init__()
+        if not urls:
+            raise ValueError("RPCPool needs at least one endpoint")
+        self.endpoints = [_Endpoint(url, timeout, window) for url in urls]
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.eject_error_rate = eject_error_rate
+        self.eject_min_samples = eject_min_samples
+        self.eject_seconds = eject_seconds
+        self.resample_interval = resample_interval
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rpc-pool")
+
+    def make_request(self, method, params):
+        return self._hedged(lambda provider: provider.make_request(method, params))
+
+    def make_batch_request(self, requests):
+        return self._hedged(lambda provider: provider.make_batch_request(requests))
+
+    def is_connected(self, show_traceback=False):
+        return any(endpoint.provider.is_connected(show_traceback) for endpoint in self.endpoints)
+
+    def stats(self):
+        """Per-endpoint health, for debugging and the benchmark report."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "endpoint": endpoint.label,
+                    "healthy": endpoint.healthy(now),
+                    "p50": endpoint.quantile(0.5),
+                    "p95": endpoint.quantile(0.95),
+                    "error_rate": endpoint.error_rate(),
+                    "samples": len(endpoint.errors),
+                }
+                for endpoint in self.endpoints
+            ]
+
+    def _ranked(self):
+        """Endpoints in the order to try them, and whether the first one is only being probed."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = sorted(
+                (e for e in self.endpoints if e.healthy(now)), key=lambda e: e.score(now, self.resample_interval)
+            )
+            if not healthy:
+                # Everything is ejected: try the endpoints that are due back soonest rather than fail outright
+                return sorted(self.endpoints, key=lambda e: e.ejected_until), False
+            probe = healthy[0].stale(now, self.resample_interval)
+            if probe:
+                # One probe per interval, not every request until the answer comes back
+                healthy[0].sampled_at = now
+            return healthy, probe
+
+    def _hedge_delay(self, primary, backup, probe):
+        # A probed endpoint's stats are stale or missing, so hold it to the backup's p95 instead
+        with self._lock:
+            latency = None if probe else primary.quantile(self.hedge_quantile)
+            if latency is None and backup is not None:
+                latency = backup.quantile(self.hedge_quantile)
+        if latency is None:
+            return self.hedge_max_delay
+        return min(max(latency, self.hedge_min_delay), self.hedge_max_delay)
+
+    def _send(self, endpoint, send):
+        start = time.perf_counter()
+        try:
+            response = send(endpoint.provider)
+        except Exception:
+            self._record(endpoint, time.perf_counter() - start, failed=True)
+            raise
+        self._record(endpoint, time.perf_counter() - start, failed=False)
+        return response
+
+    def _record(self, endpoint, elapsed, failed):
+        RPC_LATENCY.labels(endpoint=endpoint.label, status="error" if failed else "ok").observe(elapsed)
+        with self._lock:
+            endpoint.sampled_at = time.monotonic()
+            endpoint.errors.append(failed)
+            if not failed:
+                endpoint.latencies.append(elapsed)
+                endpoint.probation = False
+                return
+            if endpoint.probation or (
+                len(endpoint.errors) >= self.eject_min_samples and endpoint.error_rate() >= self.eject_error_rate
+            ):
+                endpoint.ejected_until = time.monotonic() + self.eject_seconds
+                # Start over once readmitted, so old failures don't eject it again straight away
+                endpoint.errors.clear()
+                endpoint.latencies.clear()
+                endpoint.probation = True
+                RPC_EJECTIONS.labels(endpoint=endpoint.label).inc()
+                logger.warning(f"Ejected RPC endpoint {endpoint.label} for {self.eject_seconds}s")
+
+    def _hedged(self, send):
+        candidates, probe = self._ranked()
+        primary = candidates.pop(0)
+        pending = {self._executor.submit(self._send, primary, send)}
+        hedge = None
+        hedge_delay = self._hedge_delay(primary, candidates[0] if candidates else None, probe)
+        last_error = None
+
+        while pending:
+            timeout = hedge_delay if candidates and hedge is None else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # The primary is slower than usual; race a duplicate against it
+                hedge = self._executor.submit(self._send, candidates.pop(0), send)
+                pending.add(hedge)
+                continue
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if hedge is not None:
+                    RPC_HEDGES.labels(winner="hedge" if future is hedge else "primary").inc()
+                # Losers keep running in the background; their outcome still feeds the health stats
+                return response
+            if candidates:
+                pending.add(self._executor.submit(self._send, candidates.pop(0), send))
+        raise last_error
+
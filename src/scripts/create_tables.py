@@ -25,5 +25,9 @@ cursor.execute('''
         timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
     )
 ''')
+# Keyset pagination in GET /history/<user_id> walks this index
+cursor.execute('''
+    CREATE INDEX IF NOT EXISTS ix_chat_history_user_timestamp ON chat_history (user_id, timestamp, id)
+''')
 cursor.close()
 conn.close()
@@ -0,0 +1,143 @@
+"""Startup profiler for the agent workers.
+
+Imports the entrypoint in a fresh interpreter under `python -X importtime`, reports where the
+import time goes by top-level package, then measures what building each registered tool costs
+on top (the work the tool registry defers to first use). Exits non-zero when the entrypoint's
+import time exceeds the budget, so it can gate CI:
+
+    cd src
+    python scripts/profile_startup.py --budget "$STARTUP_IMPORT_BUDGET"
+    python scripts/profile_startup.py --module server --top 20 --json
+
+Without a reachable database the entrypoint fails once its imports are done (the checkpoint
+pool connects at import time); the import time up to that point is still reported, which is the
+part this budget covers. langchain_openai and langgraph's Postgres saver are only imported when
+the agent is first built, so they show up neither here nor in the tool costs.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+from collections import defaultdict
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+EXCEPTION_LINE = re.compile(r"^[\w.]+(Error|Exception|Timeout)\b")
+
+TOOL_PROBE = """
+import json, time
+from tools.registry import default_registry
+registry = default_registry()
+costs = {}
+for name in %r:
+    start = time.perf_counter()
+    registry.get(name)
+    costs[name] = time.perf_counter() - start
+print(json.dumps(costs))
+"""
+
+
+def run(code, extra_env):
+    env = {**os.environ, **extra_env, "PYTHONPATH": SRC}
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=SRC, env=env, capture_output=True, text=True
+    )
+
+
+def last_exception(stderr):
+    lines = stderr.strip().splitlines()
+    return next((line for line in reversed(lines) if EXCEPTION_LINE.match(line)), lines[-1] if lines else "")
+
+
+def parse_importtime(stderr):
+    """Return (total seconds, self seconds per top-level package, [(cumulative, module)])."""
+    total = 0
+    packages = defaultdict(int)
+    modules = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = int(match[1]), int(match[2]), match[3], match[4]
+        packages[module.split(".")[0]] += self_us
+        modules.append((cumulative_us, module))
+        # Only the outermost imports add up to the total; nested ones are inside their cumulative time
+        if len(indent) == 1:
+            total += cumulative_us
+    return total / 1e6, {name: us / 1e6 for name, us in packages.items()}, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default="asgi", help="Entrypoint to import (default: asgi, what uvicorn loads)")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_IMPORT_BUDGET", "0")),
+                        help="Fail if the entrypoint's import time exceeds this many seconds; 0 disables")
+    parser.add_argument("--top", type=int, default=15, help="Packages to list")
+    parser.add_argument("--tools", default="CreateWallet,FundWallet,CreateTransfer,GetWalletBalance,GetPortfolio",
+                        help="Comma-separated registry tools to time after startup; empty to skip")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    # No background agent build while measuring, and fail fast if the database isn't there
+    env = {"AGENT_WARMUP": "false", "WALLET_POOL_ENABLED": "false", "CHECKPOINT_POOL_TIMEOUT": "1"}
+    # Placeholders so configuration parsing doesn't stop the profile before the imports are done
+    for name, value in (("DB_HOST", "127.0.0.1"), ("DB_PORT", "5432"), ("WEB3_PROVIDER_URL", "http://127.0.0.1:8545"),
+                        ("OPENAI_API_KEY", "sk-startup-profile")):
+        if not os.getenv(name):
+            env[name] = value
+    result = run(f"import {args.module}", env)
+    total, packages, modules = parse_importtime(result.stderr)
+    error = None
+    if result.returncode != 0:
+        error = last_exception(result.stderr)
+
+    tool_costs = {}
+    tools = [name for name in args.tools.split(",") if name]
+    if tools:
+        probe = run(TOOL_PROBE % (tools,), env)
+        if probe.returncode == 0:
+            tool_costs = json.loads(probe.stdout.strip().splitlines()[-1])
+        else:
+            tool_costs = {"error": last_exception(probe.stderr)}
+
+    report = {
+        "module": args.module,
+        "import_seconds": round(total, 3),
+        "budget_seconds": args.budget or None,
+        "over_budget": bool(args.budget) and total > args.budget,
+        "entrypoint_error": error,
+        "packages": {
+            name: round(seconds, 3)
+            for name, seconds in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        },
+        "slowest_modules": [
+            {"module": module, "cumulative_seconds": round(us / 1e6, 3)}
+            for us, module in sorted(modules, reverse=True)[:args.top]
+        ],
+        "deferred_tool_seconds": {name: round(cost, 3) if isinstance(cost, float) else cost for name, cost in tool_costs.items()},
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import {args.module}: {report['import_seconds']:.3f}s" + (f" (budget {args.budget:.3f}s)" if args.budget else ""))
+        if error:
+            print(f"  stopped early: {error}")
+        print("\nSelf import time by package:")
+        for name, seconds in report["packages"].items():
+            print(f"  {seconds:8.3f}s  {name}")
+        if tool_costs:
+            print("\nBuilt on first use (tool registry), in order:")
+            for name, cost in report["deferred_tool_seconds"].items():
+                print(f"  {cost:8.3f}s  {name}" if isinstance(cost, float) else f"  {name}: {cost}")
+
+    if report["over_budget"]:
+        print(f"\nImport time {total:.3f}s is over the {args.budget:.3f}s budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Retention job for the LangGraph checkpoint tables.
+
+PostgresSaver keeps every intermediate checkpoint of every thread. This keeps the latest
+--keep checkpoints per thread, removes threads idle for longer than --ttl-days, and deletes in
+small autocommitted batches so live traffic never waits on a long lock:
+
+    python scripts/prune_checkpoints.py --keep 20 --ttl-days 90 --dry-run
+    python scripts/prune_checkpoints.py --keep 20 --ttl-days 90 --vacuum
+
+Only rows strictly older than what is kept are touched (checkpoint ids are time ordered and
+channel versions increase monotonically), so it is safe to run while the agent is serving.
+Deleted space is reused by Postgres; it is only returned to the OS by VACUUM FULL or pg_repack.
+"""
+import os
+import time
+import argparse
+import psycopg2
+from dotenv import load_dotenv
+
+TABLES = ("checkpoints", "checkpoint_writes", "checkpoint_blobs")
+
+# Rows of a thread older than the kept checkpoints, keyed on %(cutoff)s, the oldest kept checkpoint id.
+# Writes of the oldest kept checkpoint's parent are kept: they hold its pending sends.
+PRUNE_PREDICATES = {
+    "checkpoints": """
+        t.thread_id = %(thread_id)s AND t.checkpoint_ns = %(checkpoint_ns)s
+        AND t.checkpoint_id < %(cutoff)s
+    """,
+    "checkpoint_writes": """
+        t.thread_id = %(thread_id)s AND t.checkpoint_ns = %(checkpoint_ns)s
+        AND t.checkpoint_id < %(cutoff)s
+        AND t.checkpoint_id NOT IN (
+            SELECT c.parent_checkpoint_id FROM checkpoints c
+            WHERE c.thread_id = t.thread_id AND c.checkpoint_ns = t.checkpoint_ns
+                AND c.checkpoint_id >= %(cutoff)s AND c.parent_checkpoint_id IS NOT NULL
+        )
+    """,
+    # A blob is garbage once no kept checkpoint references it and a kept checkpoint references a
+    # newer version of the same channel; blobs written by an in-flight run are always newer
+    "checkpoint_blobs": """
+        t.thread_id = %(thread_id)s AND t.checkpoint_ns = %(checkpoint_ns)s
+        AND t.version < (
+            SELECT max(v.value) FROM checkpoints c, jsonb_each_text(c.checkpoint -> 'channel_versions') v
+            WHERE c.thread_id = t.thread_id AND c.checkpoint_ns = t.checkpoint_ns
+                AND c.checkpoint_id >= %(cutoff)s AND v.key = t.channel
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM checkpoints c, jsonb_each_text(c.checkpoint -> 'channel_versions') v
+            WHERE c.thread_id = t.thread_id AND c.checkpoint_ns = t.checkpoint_ns
+                AND c.checkpoint_id >= %(cutoff)s AND v.key = t.channel AND v.value = t.version
+        )
+    """,
+}
+
+# Every row of an abandoned thread. Checkpoints go last so an interrupted run leaves the thread
+# findable by the next one.
+EXPIRE_ORDER = ("checkpoint_writes", "checkpoint_blobs", "checkpoints")
+EXPIRE_PREDICATE = "t.thread_id = %(thread_id)s"
+
+# Threads expired in the same run are skipped: a dry run deletes nothing, so they'd be counted twice
+OVERSIZED_THREADS_SQL = """
+    SELECT thread_id, checkpoint_ns FROM checkpoints
+    WHERE NOT (thread_id = ANY(%(skip)s))
+    GROUP BY thread_id, checkpoint_ns
+    HAVING count(*) > %(keep)s
+    ORDER BY thread_id, checkpoint_ns
+"""
+
+CUTOFF_SQL = """
+    SELECT checkpoint_id FROM checkpoints
+    WHERE thread_id = %(thread_id)s AND checkpoint_ns = %(checkpoint_ns)s
+    ORDER BY checkpoint_id DESC
+    OFFSET %(offset)s LIMIT 1
+"""
+
+# The saver stores the checkpoint's creation time in the checkpoint document itself
+ABANDONED_THREADS_SQL = """
+    SELECT thread_id FROM checkpoints
+    GROUP BY thread_id
+    HAVING max((checkpoint ->> 'ts')::timestamptz) < now() - make_interval(days => %(ttl_days)s)
+    ORDER BY thread_id
+"""
+
+
+def connect():
+    load_dotenv()
+    conn = psycopg2.connect(
+        dbname=os.getenv("DB_NAME", "chatbot"),
+        user=os.getenv("DB_USER", "postgress"),
+        password=os.getenv("DB_PASSWORD", "postgress"),
+        host=os.getenv("DB_HOST", "db"),
+        port=os.getenv("DB_PORT", "5432")
+    )
+    conn.autocommit = True
+    return conn
+
+
+def table_sizes(cursor):
+    cursor.execute(
+        "SELECT relname, pg_total_relation_size(oid) FROM pg_class WHERE relname = ANY(%s) AND relkind = 'r'",
+        (list(TABLES),),
+    )
+    return dict(cursor.fetchall())
+
+
+class Pruner:
+    def __init__(self, conn, batch_size, pause, dry_run):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.pause = pause
+        self.dry_run = dry_run
+        self.rows = dict.fromkeys(TABLES, 0)
+        self.bytes = dict.fromkeys(TABLES, 0)
+
+    def delete(self, table, predicate, params):
+        """Delete matching rows LIMIT batch_size at a time, each batch in its own transaction."""
+        with self.conn.cursor() as cursor:
+            if self.dry_run:
+                cursor.execute(f"SELECT count(*), coalesce(sum(pg_column_size(t.*)), 0) FROM {table} t WHERE {predicate}", params)
+                rows, size = cursor.fetchone()
+                self.rows[table] += rows
+                self.bytes[table] += size
+                return
+
+            while True:
+                cursor.execute(f"""
+                    DELETE FROM {table} t
+                    WHERE t.ctid IN (SELECT t.ctid FROM {table} t WHERE {predicate} LIMIT %(limit)s)
+                    RETURNING pg_column_size(t.*)
+                """, {**params, "limit": self.batch_size})
+                sizes = cursor.fetchall()
+                self.rows[table] += len(sizes)
+                self.bytes[table] += sum(size for (size,) in sizes)
+                if len(sizes) < self.batch_size:
+                    return
+                time.sleep(self.pause)
+
+    def prune(self, keep, skip=()):
+        """Trim threads over `keep` checkpoints, other than the `skip` thread ids."""
+        with self.conn.cursor() as cursor:
+            cursor.execute(OVERSIZED_THREADS_SQL, {"keep": keep, "skip": list(skip)})
+            threads = cursor.fetchall()
+        for thread_id, checkpoint_ns in threads:
+            params = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns}
+            with self.conn.cursor() as cursor:
+                cursor.execute(CUTOFF_SQL, {**params, "offset": keep - 1})
+                row = cursor.fetchone()
+            if row is None:
+                continue
+            params["cutoff"] = row[0]
+            for table in TABLES:
+                self.delete(table, PRUNE_PREDICATES[table], params)
+        return len(threads)
+
+    def expire(self, ttl_days):
+        """Delete abandoned threads. Returns their thread ids."""
+        with self.conn.cursor() as cursor:
+            cursor.execute(ABANDONED_THREADS_SQL, {"ttl_days": ttl_days})
+            threads = [thread_id for (thread_id,) in cursor.fetchall()]
+        for thread_id in threads:
+            for table in EXPIRE_ORDER:
+                self.delete(table, EXPIRE_PREDICATE, {"thread_id": thread_id})
+        return threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--keep", type=int, default=int(os.getenv("CHECKPOINT_KEEP", "20")),
+                        help="Checkpoints to keep per thread (at least 1)")
+    parser.add_argument("--ttl-days", type=int, default=int(os.getenv("CHECKPOINT_TTL_DAYS", "0")),
+                        help="Delete threads with no checkpoint newer than this many days; 0 disables")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per DELETE")
+    parser.add_argument("--pause", type=float, default=0.05, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without deleting")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM ANALYZE the tables afterwards")
+    args = parser.parse_args()
+    if args.keep < 1:
+        parser.error("--keep must be at least 1; the latest checkpoint holds the conversation")
+
+    conn = connect()
+    pruner = Pruner(conn, args.batch_size, args.pause, args.dry_run)
+    with conn.cursor() as cursor:
+        before = table_sizes(cursor)
+
+    started = time.monotonic()
+    expired = pruner.expire(args.ttl_days) if args.ttl_days > 0 else []
+    pruned = pruner.prune(args.keep, skip=expired)
+
+    if args.vacuum and not args.dry_run:
+        with conn.cursor() as cursor:
+            for table in TABLES:
+                cursor.execute(f"VACUUM (ANALYZE) {table}")
+    with conn.cursor() as cursor:
+        after = table_sizes(cursor)
+    conn.close()
+
+    verb = "Would delete" if args.dry_run else "Deleted"
+    print(f"{'Dry run: ' if args.dry_run else ''}{len(expired)} abandoned threads, {pruned} threads over {args.keep} checkpoints "
+          f"({time.monotonic() - started:.1f}s)")
+    for table in TABLES:
+        print(f"  {table}: {verb.lower()} {pruner.rows[table]} rows, {pruner.bytes[table]} bytes of row data; "
+              f"table size {before.get(table, 0)} -> {after.get(table, 0)} bytes")
+    print(f"{verb} {sum(pruner.rows.values())} rows, {sum(pruner.bytes.values())} bytes total")
+
+
+if __name__ == "__main__":
+    main()
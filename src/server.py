@@ -1,164 +1,433 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 import logging
-from langchain_openai import ChatOpenAI
-from langgraph.prebuilt import create_react_agent
-from langchain_core.messages import AIMessage
-from langgraph.checkpoint.postgres import PostgresSaver
-from tools.create_wallet import CreateWalletTool
-from tools.fund_wallet import FundWalletTool
-from tools.transfer_funds import TransferFundsTool
-from tools.get_balance import GetWalletBalanceTool
+import atexit
+import hmac
+import math
+import time
+import threading
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 import json
-from sqlalchemy import text
+from agent import build_agent
+from balances import BalanceCache
+from cache import SingleFlight, TTLCache
+from chat_history import ChatHistoryWriter, InvalidCursor, HISTORY_PAGE_SIZE, history_page
+from callbacks import MetricsCallbackHandler
+from history import HISTORY_SUMMARIZE, HistoryPolicy
+from log_config import setup_logging
+from metrics import REQUEST_LATENCY, SETUP_WALLET_LATENCY, observe_checkpoint_pool, pool_stats, render_metrics
+from models import db, UserWallet
+from pricing import QuoteCache
+from prompt_registry import PromptRegistry
+from rate_limit import RateLimited, RateLimiter, set_rate_limiter
+from spend_policy import SpendLedger, SpendPolicy
+from transfer_jobs import TransferJobQueue
+from thread_queue import ThreadQueue, ThreadQueueFull, ThreadQueueTimeout
+from tools.context import current_user_id
+from tools.coinbase_api import CoinbaseAPIWrapper
+from tools.registry import default_registry
+from router import FastPathRouter
+from wallet_pool import WalletPool
 
 # Load environment variables from the .env file
 load_dotenv()
 
+# JSON logs written by a background thread; levels, sampling and truncation come from LOG_* settings
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # Initialize the Flask application
 app = Flask(__name__)
-CORS(app, resources={r"/query-agent": {"origins": "https://app.donottalktomalice.org"}})  # Enable CORS for specific origins
+ALLOWED_ORIGIN = "https://app.donottalktomalice.org"
+CORS(app, resources={r"/query-agent": {"origins": ALLOWED_ORIGIN}})  # Enable CORS for specific origins
 
 # Configure the SQLAlchemy part of the application
 app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Initialize the database
-db = SQLAlchemy(app)
+db.init_app(app)
 migrate = Migrate(app, db)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, 
-                    format='%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]',
-                    handlers=[logging.StreamHandler()])
+# Every prompt in ./prompts, read once and reloaded when a file changes. Raises here, stopping
+# the worker, if the policy prompt (POLICY_PROMPT) is missing rather than running without it.
+prompt_registry = PromptRegistry()
+prompt_registry.load()
+prompt_registry.start()
+atexit.register(prompt_registry.close)
+
+# Client-side request budgets for OpenAI and the cdp bridge, shared by every worker (RATE_LIMIT_BACKEND)
+rate_limiter = RateLimiter.from_env(app.config['SQLALCHEMY_DATABASE_URI'])
+set_rate_limiter(rate_limiter)
 
-# Model definition for user wallet information
-class UserWallet(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String(255), nullable=False, unique=True)
-    wallet_id = db.Column(db.String(255), nullable=False)
-    wallet_address = db.Column(db.String(255), nullable=False)
-    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+# Upstreams an agent turn calls; new work is turned away while either budget is exhausted
+ADMISSION_UPSTREAMS = ["openai", "cdp"]
+
+# The OpenAI chat model, the checkpointer and the history policy are built with the agent (see
+# get_agent), so importing langchain_openai and langgraph stays off the worker's import path
+llm = None
+checkpointer = None
+history_policy = None
+_agent_lock = threading.RLock()
 
 # Initialize the LLM with the OpenAI API key from the environment
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=1, api_key=os.getenv("OPENAI_API_KEY"))
-
-# Initialize the tools from the provided files
-create_wallet_tool = CreateWalletTool()
-fund_wallet_tool = FundWalletTool()
-transfer_funds_tool = TransferFundsTool()
-get_balance_tool = GetWalletBalanceTool(web3_provider_url=os.getenv("WEB3_PROVIDER_URL"))
-
-# List of tools to be used by the agent
-tools = [
-    fund_wallet_tool, 
-    transfer_funds_tool, 
-    get_balance_tool, 
-    create_wallet_tool
-]
-
-# Save wallet information to the database
-def save_wallet_info(user_id, wallet_id, wallet_address):
-    try:
-        new_wallet = UserWallet(user_id=user_id, wallet_id=wallet_id, wallet_address=wallet_address)
-        db.session.add(new_wallet)
-        db.session.commit()
-        logging.debug(f"Saved wallet info to database: user_id={user_id}, wallet_id={wallet_id}, wallet_address={wallet_address}")
-    except Exception as e:
-        logging.error(f"Failed to save wallet info: {str(e)}")
-        db.session.rollback()
+def get_llm():
+    global llm
+    if llm is None:
+        with _agent_lock:
+            if llm is None:
+                from langchain_openai import ChatOpenAI
+                llm = ChatOpenAI(
+                    model="gpt-4o-mini",
+                    temperature=1,
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    rate_limiter=rate_limiter.chat_model_limiter("openai") if rate_limiter else None,
+                )
+    return llm
+
+# Transfer limits and destination rules, enforced by the tools before any cdp call
+spend_ledger = SpendLedger(SpendPolicy.load(), app)
+spend_ledger.start()
+
+# One cdp API wrapper (and connection pool) for the tools, the job workers and the wallet pool
+coinbase_api = CoinbaseAPIWrapper()
+
+# ETH balances per block, shared by GetWalletBalance and everything that moves funds
+balance_cache = BalanceCache()
+
+# Optional background execution for transfers; the tool then returns a job id right away
+transfer_jobs = TransferJobQueue(
+    app, coinbase_api, os.getenv("WEB3_PROVIDER_URL"), spend_ledger=spend_ledger, balances=balance_cache
+)
+if transfer_jobs.enabled:
+    transfer_jobs.start()
+
+# Asset prices for GetQuote and USD balances; pairs in use are refreshed before they expire
+quote_cache = QuoteCache.from_env()
+quote_cache.start()
+atexit.register(quote_cache.close)
+
+# The wallet already assigned to a user, for tools that act on the caller's own wallet only.
+# setup_wallet runs before every turn, so this is nearly always a cache hit.
+def user_wallet(user_id):
+    wallet = wallet_cache.get(user_id)
+    if wallet is None:
+        with app.app_context():
+            existing_wallet = get_existing_wallet(user_id)
+        if existing_wallet is None:
+            return None
+        wallet = (existing_wallet.wallet_id, existing_wallet.wallet_address)
+    return wallet
+
+# Tools are imported and built on first use
+tool_registry = default_registry(
+    api=coinbase_api,
+    spend_ledger=spend_ledger,
+    transfer_jobs=transfer_jobs,
+    quotes=quote_cache,
+    wallet_lookup=user_wallet,
+    balances=balance_cache,
+)
+
+# Keep a warm pool of pre-created wallets so first-time users don't wait on wallet creation
+wallet_pool = WalletPool(app, coinbase_api)
+if wallet_pool.enabled:
+    wallet_pool.start()
+
+# Every turn is written to chat_history in batches, off the request path
+chat_history = ChatHistoryWriter(app)
+if chat_history.enabled:
+    chat_history.start()
+    atexit.register(chat_history.close)
+
+# Bearer token required by GET /history/<user_id>; the endpoint is disabled while it is unset
+HISTORY_API_TOKEN = os.getenv("HISTORY_API_TOKEN")
+
+# Sizing for the connection pool shared by the LangGraph checkpointer
+CHECKPOINT_POOL_MIN_SIZE = int(os.getenv("CHECKPOINT_POOL_MIN_SIZE", "1"))
+CHECKPOINT_POOL_MAX_SIZE = int(os.getenv("CHECKPOINT_POOL_MAX_SIZE", "10"))
+CHECKPOINT_POOL_TIMEOUT = float(os.getenv("CHECKPOINT_POOL_TIMEOUT", "30"))
+
+checkpoint_pool = ConnectionPool(
+    conninfo=app.config['SQLALCHEMY_DATABASE_URI'],
+    min_size=CHECKPOINT_POOL_MIN_SIZE,
+    max_size=CHECKPOINT_POOL_MAX_SIZE,
+    timeout=CHECKPOINT_POOL_TIMEOUT,
+    kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+    open=False,
+)
+
+# Open the pool and check the database once per process. Any failure here should stop the worker
+# from starting rather than surface on the first request.
+def init_checkpoint_pool():
+    checkpoint_pool.open(wait=True, timeout=CHECKPOINT_POOL_TIMEOUT)
+    checkpoint_pool.check()
+    observe_checkpoint_pool(checkpoint_pool)
+    atexit.register(checkpoint_pool.close)
+    logger.info(f"Checkpoint pool ready: {pool_stats(checkpoint_pool)}")
+
+init_checkpoint_pool()
+
+# Run the checkpoint migrations and build the saver; done with the agent, which needs langgraph anyway
+def init_checkpointer():
+    from checkpoint import PooledPostgresSaver
+    saver = PooledPostgresSaver(checkpoint_pool)
+    saver.setup()
+    logger.info("Checkpointer ready")
+    return saver
+
+# Bound the history sent to the LLM on every call and kept in each thread's checkpoint
+def get_history_policy():
+    global history_policy
+    if history_policy is None:
+        with _agent_lock:
+            if history_policy is None:
+                history_policy = HistoryPolicy(summarizer=get_llm() if HISTORY_SUMMARIZE else None, prompts=prompt_registry)
+    return history_policy
+
+# The ReAct agent is compiled once, on first use (or by the warm-up below), and the graph is safe
+# to share across requests. Building it imports every tool, which dominates worker startup.
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "true").lower() == "true"
+agent = None
+
+def get_agent():
+    global agent, checkpointer
+    if agent is None:
+        with _agent_lock:
+            if agent is None:
+                start = time.perf_counter()
+                if checkpointer is None:
+                    checkpointer = init_checkpointer()
+                agent = build_agent(get_llm(), tool_registry, checkpointer=checkpointer, history_policy=get_history_policy())
+                logger.info(f"Agent ready in {time.perf_counter() - start:.2f}s")
+    return agent
+
+# Answers plain balance/fund/address requests without an LLM call when FAST_PATH_ENABLED is set
+fast_path = FastPathRouter(tool_registry)
+
+# One turn at a time per conversation thread, across every worker
+thread_queue = ThreadQueue(app.config['SQLALCHEMY_DATABASE_URI'])
+
+# Records tool/LLM latency and token usage for every run it is attached to
+metrics_callback = MetricsCallbackHandler()
+
+# Run config for a user's conversation thread. The policy prompt version is pinned for the whole
+# turn and recorded on each checkpoint it writes.
+def agent_config(user_id):
+    prompt = prompt_registry.policy()
+    return {
+        "configurable": {"thread_id": user_id},
+        "callbacks": [metrics_callback],
+        "metadata": {"prompt": prompt.name, "prompt_version": prompt.version},
+    }
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    if hasattr(g, "request_start"):
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_LATENCY.labels(endpoint=endpoint, method=request.method, status=response.status_code).observe(
+            time.perf_counter() - g.request_start
+        )
+    return response
+
+# Cache of user_id -> (wallet_id, wallet_address) so steady-state messages skip the database
+WALLET_CACHE_SIZE = int(os.getenv("WALLET_CACHE_SIZE", "10000"))
+WALLET_CACHE_TTL = float(os.getenv("WALLET_CACHE_TTL", "3600"))
+wallet_cache = TTLCache(maxsize=WALLET_CACHE_SIZE, ttl=WALLET_CACHE_TTL)
 
-# Function to load the system message
+# Concurrent first requests for the same user share a single lookup/creation
+wallet_flight = SingleFlight()
+
+# The policy prompt, from memory; never empty (see prompt_registry)
 def load_system_message():
-    try:
-        with open('./prompts/malice_prompt.txt', 'r') as file:
-            system_message = file.read().strip()
-            logging.debug("Loaded system message.")
-            return system_message
-    except Exception as e:
-        logging.error(f"Failed to load system message: {str(e)}")
-        return ""
+    return prompt_registry.policy().text
 
 def get_existing_wallet(user_id):
     wallet = UserWallet.query.filter_by(user_id=user_id).first()
     return wallet
 
+# A new cdp wallet for a first-time user the warm pool couldn't serve. Returns (wallet_id, address).
+def create_wallet():
+    create_wallet_response = tool_registry.get("CreateWallet")._run()
+    if isinstance(create_wallet_response, dict):
+        raise RuntimeError(create_wallet_response["error"])
+    wallet_info = json.loads(create_wallet_response)
+    return wallet_info['wallet_id'], wallet_info['address']
+
+# Look up or create the user's wallet. Returns ((wallet_id, wallet_address), is_new).
+def resolve_wallet(user_id):
+    return wallet_pool.assign(user_id, create_wallet)
+
+@SETUP_WALLET_LATENCY.time()
 def setup_wallet(user_id):
     try:
-        existing_wallet = get_existing_wallet(user_id)
-        if existing_wallet:
-            return json.dumps({"wallet_id": existing_wallet.wallet_id, "address": existing_wallet.wallet_address}), False
-
-        # Create a new wallet if no existing wallet
-        create_wallet_response = create_wallet_tool._run()
-        wallet_info = json.loads(create_wallet_response)
-        wallet_id = wallet_info['wallet_id']
-        wallet_address = wallet_info['address']
-        
-        # Save wallet information to the database
-        save_wallet_info(user_id, wallet_id, wallet_address)
-        
-        logging.info(f"Created and saved new wallet for user_id: {user_id}, wallet_id: {wallet_id}, address: {wallet_address}")
-        return create_wallet_response, True
+        wallet = wallet_cache.get(user_id)
+        is_new_wallet = False
+        if wallet is None:
+            (wallet, is_new_wallet), shared = wallet_flight.do(user_id, lambda: resolve_wallet(user_id))
+            # Only the request that actually created the wallet starts the conversation
+            is_new_wallet = is_new_wallet and not shared
+            wallet_cache.set(user_id, wallet)
+
+        wallet_id, wallet_address = wallet
+        if not is_new_wallet:
+            return json.dumps({"wallet_id": wallet_id, "address": wallet_address}), False
+
+        # Only identifiers; nothing from the cdp response, which can carry the wallet seed
+        logger.info("Created and saved new wallet for user_id=%s, wallet_id=%s", user_id, wallet_id)
+        return json.dumps({"message": "Wallet created successfully", "address": wallet_address, "wallet_id": wallet_id}), True
     except Exception as e:
-        logging.error(f"Failed to create and save wallet: {str(e)}")
+        logger.error(f"Failed to create and save wallet: {str(e)}")
         return None
 
+# Always begin/continue a conversation with system message and wallet informations
+def build_messages(user_id, user_message):
+    wallet_message, is_new_wallet = setup_wallet(user_id)
+    system_message = load_system_message()
+    logger.debug("Loaded system message (%d chars)", len(system_message))
+    if is_new_wallet:
+        messages = [
+            ("system", system_message),
+            ("system", str(wallet_message)),
+            ("human", user_message)
+        ]
+    else:
+        messages = [
+            ("system",str(wallet_message)),
+            ("human", user_message)
+        ]
+    logger.debug("Starting new conversation for user_id=%s", user_id)
+    return messages
+
+# Fold old turns into the running summary before the thread is loaded for this request. Only
+# threads an earlier turn found over HISTORY_COMPACT_SLACK are touched; other turns skip it entirely.
+def compact_history(config):
+    try:
+        get_history_policy().compact_if_due(get_agent(), config)
+    except Exception as e:
+        logger.error(f"Failed to compact history for thread {config['configurable']['thread_id']}: {str(e)}")
+
+# One agent turn for a thread. Messages that queued up behind an earlier turn arrive together
+# and are answered in a single run.
+def run_turn(user_id, user_messages):
+    config = agent_config(user_id)
+    # Lets the tools attribute spending to this user
+    current_user_id.set(user_id)
+
+    messages = build_messages(user_id, user_messages[0]) + [("human", message) for message in user_messages[1:]]
+    for message in user_messages:
+        chat_history.record(user_id, "human", message)
+    compact_history(config)
+
+    agent_response = fast_path.respond(get_agent(), messages, config)
+    if agent_response is None:
+        # Pass the conversation history to the agent and log the intermediate steps
+        for step in get_agent().stream({"messages": messages}, stream_mode="updates", config=config):
+            if "agent" in step:
+                logger.debug("Agent message: %s", step['agent']['messages'], extra={"payload": True})
+            elif "tools" in step:
+                logger.debug("Tool message: %s", step['tools']['messages'], extra={"payload": True})
+
+        # Get the agent's final response content; tools that return directly end the run on a tool message
+        agent_response = next(iter(step.values()))["messages"][-1].content
+    chat_history.record(user_id, "agent", agent_response)
+    return agent_response
+
+# Admission control: refuse work up front rather than start a turn that can only time out
+def admit():
+    if rate_limiter is not None:
+        rate_limiter.admit(ADMISSION_UPSTREAMS)
+
+# The RateLimited behind a failed turn (our budget, or an upstream 429), or None
+def as_rate_limited(error):
+    if rate_limiter is not None:
+        return rate_limiter.throttled(error)
+    return error if isinstance(error, RateLimited) else None
+
+def overloaded_response(error):
+    retry_after = math.ceil(error.retry_after)
+    body = {"error": f"The agent is busy right now; please try again in {retry_after}s", "retry_after": retry_after}
+    return jsonify(body), 503, {"Retry-After": str(retry_after)}
+
 @app.route('/query-agent', methods=['POST'])
 def query_agent():
     try:
         data = request.json
-        logging.info(f"Received request data: {data}")
         user_id = data.get('user_id')
         user_message = data.get('message')
-        logging.info(f"Received request: user_id={user_id}, message={user_message}")
-        config = {"configurable": {"thread_id": user_id}}
-
-        # Create the ReAct agent using the LangGraph create_react_agent method
-        with PostgresSaver.from_conn_string(app.config['SQLALCHEMY_DATABASE_URI']) as checkpointer:
-            checkpointer.setup()
-            agent = create_react_agent(llm, tools, checkpointer=checkpointer)
-
-            # Always begin/continue a conversation with system message and wallet informations
-            wallet_message, is_new_wallet = setup_wallet(user_id)
-            system_message = load_system_message()
-            logging.info(f"Loaded system message: {system_message}")
-            if is_new_wallet:
-                messages = [
-                    ("system", system_message),
-                    ("system", str(wallet_message)),
-                    ("human", user_message)
-                ]
-            else:
-                messages = [
-                    ("system",str(wallet_message)),
-                    ("human", user_message)
-                ]
-            logging.info(f"Starting new conversation for user_id={user_id}")
-        
-            # Pass the conversation history to the agent and log the intermediate steps
-            for step in agent.stream({"messages": messages}, stream_mode="updates", config=config):
-                if "agent" in step:
-                    logging.info(f"Agent message: {step['agent']['messages']}")
-                elif "tools" in step:
-                    logging.info(f"Tool message: {step['tools']['messages']}")
-
-            # Get the agent's final response content
-            agent_response = step["agent"]["messages"][-1].content
-            
-            logging.info(f"Agent response for user_id={user_id}: {agent_response}")
-
-            # Return the response as JSON
-            return jsonify(agent_response), 200
+        logger.info("Received request: user_id=%s", user_id)
+        logger.info("Request message for user_id=%s: %s", user_id, user_message, extra={"payload": True})
+
+        admit()
+        agent_response = thread_queue.submit(user_id, user_message, lambda user_messages: run_turn(user_id, user_messages))
 
+        logger.info("Agent response for user_id=%s: %s", user_id, agent_response, extra={"payload": True})
+
+        # Return the response as JSON
+        return jsonify(agent_response), 200
+
+    except ThreadQueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    except ThreadQueueTimeout as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        logging.error(f"Error processing request: {str(e)}")
+        rate_limited = as_rate_limited(e)
+        if rate_limited is not None:
+            logger.warning(f"Turned request away: {str(rate_limited)}")
+            return overloaded_response(rate_limited)
+        logger.error(f"Error processing request: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/history/<user_id>', methods=['GET'])
+def get_history(user_id):
+    # Constant-time, so response timing doesn't reveal how much of a guessed token was right
+    authorization = request.headers.get("Authorization", "").encode()
+    if not HISTORY_API_TOKEN or not hmac.compare_digest(authorization, f"Bearer {HISTORY_API_TOKEN}".encode()):
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        limit = int(request.args.get("limit", HISTORY_PAGE_SIZE))
+        messages, next_cursor = history_page(user_id, limit, request.args.get("cursor"))
+    except (ValueError, InvalidCursor) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Failed to read history for user_id={user_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"user_id": user_id, "messages": messages, "next_cursor": next_cursor}), 200
+
+@app.route('/health', methods=['GET'])
+def health():
+    try:
+        with checkpoint_pool.connection(timeout=5) as conn:
+            conn.execute("SELECT 1")
+        return jsonify({
+            "status": "ok",
+            "checkpoint_pool": pool_stats(checkpoint_pool),
+            "chat_history": chat_history.stats(),
+            "quotes": quote_cache.stats(),
+            "prompts": prompt_registry.versions(),
+        }), 200
+    except Exception as e:
+        logger.error(f"Health check failed: {str(e)}")
+        return jsonify({"status": "unavailable", "error": str(e)}), 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, mimetype=content_type)
+
+# Build the agent in the background so the worker can start serving health checks right away
+# and the first query rarely has to wait for it
+if AGENT_WARMUP:
+    threading.Thread(target=get_agent, name="agent-warmup", daemon=True).start()
+
 if __name__ == '__main__':
-    logging.info("Starting Flask application...")
+    logger.info("Starting Flask application...")
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import itertools
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+import httpx
+import requests
+from metrics import SPEND_POLICY_DECISIONS
+from rate_limit import RateLimited
+
+logger = logging.getLogger(__name__)
+
+SPEND_POLICY_FILE = os.getenv("SPEND_POLICY_FILE", os.path.join(os.path.dirname(__file__), "policies", "spend.json"))
+
+# Namespace for the per-user advisory locks; the two-key form can't collide with REFILL_LOCK_KEY
+SPEND_LOCK_NAMESPACE = 7_415_002
+
+Reservation = namedtuple("Reservation", ["user_id", "asset", "entry_id"])
+
+
+class SpendPolicyViolation(Exception):
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class SpendPolicy:
+    """Declarative spending rules, loaded from policies/spend.json.
+
+    Each asset can have a `max_per_transaction` and a rolling `max_per_window` cap (amounts in
+    whole units, e.g. ETH); the `*` entry applies to assets that aren't listed. Destinations are
+    checked against the deny list and, if it is non-empty, the allow list.
+    """
+
+    def __init__(self, window_seconds=86400, assets=None, allow=None, deny=None):
+        self.window_seconds = window_seconds
+        self.assets = {
+            asset.lower(): {name: Decimal(value) for name, value in limits.items()}
+            for asset, limits in (assets or {}).items()
+        }
+        self.allow = {address.lower() for address in allow or []}
+        self.deny = {address.lower() for address in deny or []}
+
+    @classmethod
+    def load(cls, path=SPEND_POLICY_FILE):
+        with open(path) as file:
+            spec = json.load(file)
+        destinations = spec.get("destinations", {})
+        return cls(
+            window_seconds=spec.get("window_seconds", 86400),
+            assets=spec.get("assets"),
+            allow=destinations.get("allow"),
+            deny=destinations.get("deny"),
+        )
+
+    def limits(self, asset):
+        return self.assets.get(asset, self.assets.get("*", {}))
+
+    def check(self, asset, amount, destination=None) -> Decimal:
+        """Apply the stateless rules. Returns the parsed amount or raises SpendPolicyViolation."""
+        try:
+            amount = Decimal(str(amount))
+        except InvalidOperation:
+            raise SpendPolicyViolation("invalid_amount", f"{amount!r} is not a valid amount")
+        if not amount.is_finite() or amount <= 0:
+            raise SpendPolicyViolation("invalid_amount", "The amount must be greater than zero")
+
+        cap = self.limits(asset).get("max_per_transaction")
+        if cap is not None and amount > cap:
+            raise SpendPolicyViolation(
+                "transaction_cap", f"{amount} {asset.upper()} exceeds the limit of {cap} {asset.upper()} per transaction"
+            )
+
+        if destination is not None:
+            address = destination.lower()
+            if address in self.deny:
+                raise SpendPolicyViolation("destination_denied", f"Transfers to {destination} are not allowed")
+            if self.allow and address not in self.allow:
+                raise SpendPolicyViolation("destination_not_allowed", f"{destination} is not an approved destination")
+        return amount
+
+
+def is_definite_failure(error) -> bool:
+    """True if a failed cdp call certainly moved no funds, so its reservation can be released."""
+    # Rate limited calls were refused before (or instead of) reaching the SDK
+    if isinstance(error, (RateLimited, requests.exceptions.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and 400 <= response.status_code < 500
+
+
+class SpendLedger:
+    """Per-user spend ledger enforcing a SpendPolicy.
+
+    `reserve` records a spend before the cdp call and `settle` confirms or releases it after.
+    Stateless rules (amount, per-transaction cap, destinations) are answered without any I/O.
+    The rolling window cap is checked against the `spend_ledger` table under a per-user advisory
+    lock, which keeps it exact across workers: no worker keeps a copy of the rows, since another
+    worker can release a reservation at any time. Without an app the ledger is in-memory only
+    (the CLI and the offline benchmarks) and the window is checked against its own entries.
+
+    Failed calls stay counted unless they certainly moved no funds; see is_definite_failure.
+    """
+
+    def __init__(self, policy, app=None):
+        self.policy = policy
+        self.app = app
+        self._lock = threading.Lock()
+        # In-memory ledgers only: (user_id, asset) -> {entry_id: (unix time, amount)} for spends inside the window
+        self._entries = {}
+        self._local_ids = itertools.count(1)
+
+    def start(self):
+        """Create the ledger table if needed."""
+        from models import db, SpendLedgerEntry
+        with self.app.app_context():
+            SpendLedgerEntry.__table__.create(db.engine, checkfirst=True)
+
+    def _window_total(self, key):
+        # Caller holds self._lock
+        entries = self._entries.get(key)
+        if not entries:
+            return Decimal(0)
+        cutoff = time.time() - self.policy.window_seconds
+        for entry_id in [entry_id for entry_id, (at, _) in entries.items() if at <= cutoff]:
+            del entries[entry_id]
+        return sum((amount for _, amount in entries.values()), Decimal(0))
+
+    def _window_violation(self, asset, total, amount, cap):
+        return SpendPolicyViolation(
+            "window_cap",
+            f"{amount} {asset.upper()} would bring your total to {total + amount} {asset.upper()}, over the limit of "
+            f"{cap} {asset.upper()} per {self.policy.window_seconds // 3600} hours",
+        )
+
+    def _precheck(self, tool, asset, amount, destination):
+        try:
+            amount = self.policy.check(asset, amount, destination)
+        except SpendPolicyViolation as e:
+            SPEND_POLICY_DECISIONS.labels(tool=tool, result=e.reason).inc()
+            raise
+        return amount, self.policy.limits(asset).get("max_per_window")
+
+    def _record(self, user_id, tool, asset, amount, destination, cap):
+        key = (user_id, asset)
+        if self.app is None:
+            with self._lock:
+                total = self._window_total(key)
+                if cap is not None and total + amount > cap:
+                    SPEND_POLICY_DECISIONS.labels(tool=tool, result="window_cap").inc()
+                    raise self._window_violation(asset, total, amount, cap)
+                entry_id = next(self._local_ids)
+                self._entries.setdefault(key, {})[entry_id] = (time.time(), amount)
+        else:
+            entry_id = self._record_db(user_id, tool, asset, amount, destination, cap)
+        SPEND_POLICY_DECISIONS.labels(tool=tool, result="allowed").inc()
+        return Reservation(user_id, asset, entry_id)
+
+    def _record_db(self, user_id, tool, asset, amount, destination, cap):
+        # Only ledgers bound to an app touch the database, so only they load the models
+        from sqlalchemy import text
+        from models import db, SpendLedgerEntry
+        with self.app.app_context():
+            try:
+                # Serializes this user's reservations across every worker until commit
+                db.session.execute(
+                    text("SELECT pg_advisory_xact_lock(:namespace, hashtext(:user_id))"),
+                    {"namespace": SPEND_LOCK_NAMESPACE, "user_id": user_id},
+                )
+                rows = db.session.execute(text("""
+                    SELECT amount FROM spend_ledger
+                    WHERE user_id = :user_id AND asset = :asset AND status <> 'released'
+                        AND timestamp > LOCALTIMESTAMP - make_interval(secs => :window)
+                """), {"user_id": user_id, "asset": asset, "window": self.policy.window_seconds}).all()
+                total = sum((row[0] for row in rows), Decimal(0))
+                if cap is not None and total + amount > cap:
+                    db.session.rollback()
+                    SPEND_POLICY_DECISIONS.labels(tool=tool, result="window_cap").inc()
+                    raise self._window_violation(asset, total, amount, cap)
+
+                entry = SpendLedgerEntry(user_id=user_id, tool=tool, asset=asset, amount=amount, destination=destination)
+                db.session.add(entry)
+                db.session.flush()
+                entry_id = entry.id
+                db.session.commit()
+            except SpendPolicyViolation:
+                raise
+            except Exception:
+                db.session.rollback()
+                raise
+            return entry_id
+
+    def reserve(self, user_id, tool, asset, amount, destination=None) -> Reservation:
+        """Check a spend against the policy and record it. Raises SpendPolicyViolation."""
+        asset = asset.lower()
+        amount, cap = self._precheck(tool, asset, amount, destination)
+        return self._record(user_id, tool, asset, amount, destination, cap)
+
+    async def areserve(self, user_id, tool, asset, amount, destination=None) -> Reservation:
+        asset = asset.lower()
+        amount, cap = self._precheck(tool, asset, amount, destination)
+        if self.app is None:
+            return self._record(user_id, tool, asset, amount, destination, cap)
+        return await asyncio.to_thread(self._record, user_id, tool, asset, amount, destination, cap)
+
+    def settle(self, reservation, error=None):
+        """Mark a reservation confirmed, or failed/released after the cdp call raised `error`."""
+        if error is None:
+            self._mark(reservation, "confirmed")
+        else:
+            self._mark(reservation, "released" if is_definite_failure(error) else "failed")
+
+    def release(self, reservation):
+        """Drop a reservation whose spend never happened."""
+        self._mark(reservation, "released")
+
+    def _mark(self, reservation, status):
+        if self.app is None:
+            if status == "released":
+                with self._lock:
+                    self._entries.get((reservation.user_id, reservation.asset), {}).pop(reservation.entry_id, None)
+            return
+        from sqlalchemy import text
+        from models import db
+        with self.app.app_context():
+            try:
+                db.session.execute(
+                    text("UPDATE spend_ledger SET status = :status WHERE id = :id"),
+                    {"status": status, "id": reservation.entry_id},
+                )
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to mark spend {reservation.entry_id} {status}: {str(e)}")
+
+    async def asettle(self, reservation, error=None):
+        if self.app is None:
+            return self.settle(reservation, error)
+        await asyncio.to_thread(self.settle, reservation, error)
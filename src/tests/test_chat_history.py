@@ -0,0 +1,150 @@
+import time
+import pytest
+from datetime import datetime, timedelta, timezone
+from models import db, ChatHistory
+from chat_history import ChatHistoryWriter, InvalidCursor, history_page
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def stored(app):
+    with app.app_context():
+        return [row.message for row in ChatHistory.query.order_by(ChatHistory.timestamp, ChatHistory.id)]
+
+
+@pytest.fixture
+def writer(app):
+    writers = []
+
+    def make(**kwargs):
+        writer = ChatHistoryWriter(app, enabled=True, **kwargs)
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        writer.close()
+
+
+def test_flushes_at_batch_size(app, writer):
+    history = writer(batch_size=3, flush_interval=60)
+    history.start()
+    for n in range(3):
+        history.record("alice", "human", f"message {n}")
+
+    wait_for(lambda: len(stored(app)) == 3)
+    history.record("alice", "human", "message 3")
+    time.sleep(0.2)
+    assert stored(app) == [f"message {n}" for n in range(3)]
+    assert history.depth() == 1
+
+
+def test_flushes_after_interval(app, writer):
+    history = writer(batch_size=100, flush_interval=0.1)
+    history.start()
+    history.record("alice", "human", "hello")
+    history.record("alice", "agent", "hi")
+
+    wait_for(lambda: stored(app) == ["hello", "hi"])
+    assert history.depth() == 0
+
+
+def test_failed_batch_is_put_back_and_retried(app, writer, monkeypatch):
+    history = writer(batch_size=2)
+    for n in range(5):
+        history.record("alice", "human", f"message {n}")
+    write = history._write
+    calls = []
+
+    def flaky(batch):
+        calls.append(len(batch))
+        if len(calls) == 2:
+            raise ConnectionError("database went away")
+        write(batch)
+
+    monkeypatch.setattr(history, "_write", flaky)
+    with pytest.raises(ConnectionError):
+        history.flush()
+
+    # The failed batch is back at the front, ahead of anything recorded meanwhile
+    history.record("alice", "human", "message 5")
+    assert [row["message"] for row in history._buffer] == [f"message {n}" for n in range(2, 6)]
+
+    assert history.flush() == 4
+    assert stored(app) == [f"message {n}" for n in range(6)]
+
+
+def test_close_writes_what_is_left(app, writer):
+    history = writer(batch_size=100, flush_interval=60)
+    history.start()
+    for n in range(4):
+        history.record("alice", "human", f"message {n}")
+
+    history.close()
+
+    assert stored(app) == [f"message {n}" for n in range(4)]
+
+
+def test_full_buffer_drops_the_oldest(writer):
+    history = writer(max_buffer=3)
+    for n in range(5):
+        history.record("alice", "human", f"message {n}")
+
+    assert [row["message"] for row in history._buffer] == ["message 2", "message 3", "message 4"]
+
+
+def insert(app, rows):
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(ChatHistory.__table__.insert(), rows)
+
+
+def pages(user_id, limit, cursor=None):
+    messages = []
+    while True:
+        page, cursor = history_page(user_id, limit, cursor)
+        messages.append([row["message"] for row in page])
+        if cursor is None:
+            return messages
+
+
+def test_keyset_pages_cover_rows_with_equal_timestamps(app):
+    now = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    # Seven rows in one instant (as a batch of one turn's messages can be), between two others
+    rows = [{"user_id": "alice", "role": "human", "message": "oldest", "timestamp": now - timedelta(seconds=1)}]
+    rows += [{"user_id": "alice", "role": "human", "message": f"same {n}", "timestamp": now} for n in range(7)]
+    rows += [{"user_id": "alice", "role": "agent", "message": "newest", "timestamp": now + timedelta(seconds=1)}]
+    rows += [{"user_id": "bob", "role": "human", "message": "not alice's", "timestamp": now}]
+    insert(app, rows)
+
+    with app.app_context():
+        walked = pages("alice", 3)
+
+    assert walked == [
+        ["newest", "same 6", "same 5"],
+        ["same 4", "same 3", "same 2"],
+        ["same 1", "same 0", "oldest"],
+    ]
+
+
+def test_cursors_are_stable_as_new_turns_arrive(app):
+    now = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    insert(app, [{"user_id": "alice", "role": "human", "message": f"message {n}", "timestamp": now} for n in range(5)])
+
+    with app.app_context():
+        first, cursor = history_page("alice", 2)
+        second, _ = history_page("alice", 2, cursor)
+        insert(app, [{"user_id": "alice", "role": "human", "message": "later", "timestamp": now + timedelta(minutes=1)}])
+        again, _ = history_page("alice", 2, cursor)
+
+    assert [row["message"] for row in first] == ["message 4", "message 3"]
+    assert again == second
+
+
+def test_invalid_cursor(app):
+    with app.app_context(), pytest.raises(InvalidCursor):
+        history_page("alice", 10, "not-a-cursor")
@@ -0,0 +1,141 @@
+import pytest
+from decimal import Decimal
+from web3 import Web3
+from bench.fake_chain import deploy_multicall3, deploy_runtime, eth_tester_web3
+from tools.context import current_user_id
+from tools.get_portfolio import GetPortfolioTool
+
+# balanceOf(owner) returns the low 32 bits of the owner's address, so every holder has a known balance
+TOKEN_RUNTIME = "600435" "63ffffffff" "16" "600052" "60206000f3"
+# Reverts every call
+BROKEN_TOKEN_RUNTIME = "60006000fd"
+
+USER = "user-1"
+
+
+@pytest.fixture
+def web3():
+    return eth_tester_web3()
+
+
+@pytest.fixture
+def tokens(web3):
+    return [
+        ("USDC", deploy_runtime(web3, TOKEN_RUNTIME), 6),
+        ("CBBTC", deploy_runtime(web3, TOKEN_RUNTIME), 8),
+    ]
+
+
+@pytest.fixture
+def wallets(web3):
+    """Three fresh addresses holding 1, 2 and 3 ETH, and 1000, 2000 and 3000 base units of each token."""
+    wallets = []
+    for n in range(1, 4):
+        address = Web3.to_checksum_address(f"0x{n * 1000:040x}")
+        web3.eth.send_transaction({"from": web3.eth.accounts[0], "to": address, "value": Web3.to_wei(n, "ether")})
+        wallets.append({"address": address})
+    return wallets
+
+
+@pytest.fixture
+def caller():
+    token = current_user_id.set(USER)
+    yield USER
+    current_user_id.reset(token)
+
+
+def portfolio_tool(web3, tokens, multicall_address=None, **kwargs):
+    return GetPortfolioTool(web3_provider_url="eth-tester", web3=web3, tokens=tokens, multicall_address=multicall_address, **kwargs)
+
+
+def expected(wallets, tokens):
+    return [
+        {
+            **wallet,
+            "eth": str(n),
+            "tokens": {symbol: format(Decimal(n * 1000).scaleb(-decimals), "f") for symbol, _, decimals in tokens},
+        }
+        for n, wallet in enumerate(wallets, start=1)
+    ]
+
+
+def count_batches(monkeypatch):
+    sizes = []
+    batch = GetPortfolioTool._batch
+
+    def counting(self, requests):
+        sizes.append(len(requests))
+        return batch(self, requests)
+
+    monkeypatch.setattr(GetPortfolioTool, "_batch", counting)
+    return sizes
+
+
+def test_reads_through_multicall3(web3, tokens, wallets, monkeypatch):
+    tool = portfolio_tool(web3, tokens, deploy_multicall3(web3))
+    batches = count_batches(monkeypatch)
+
+    result = tool.get_portfolio(wallets)
+
+    assert result["block"] == web3.eth.block_number
+    assert result["wallets"] == expected(wallets, tokens)
+    # Nine balances in a single aggregate3 call
+    assert batches == [1]
+
+
+def test_falls_back_without_multicall3(web3, tokens, wallets, monkeypatch):
+    # Nothing is deployed at the canonical address on this chain
+    tool = portfolio_tool(web3, tokens, "0xcA11bde05977b3631167028862bE2a173976CA11")
+    batches = count_batches(monkeypatch)
+
+    assert tool.get_portfolio(wallets)["wallets"] == expected(wallets, tokens)
+    assert batches == [9]
+
+
+def test_multicall_chunks(web3, tokens, wallets, monkeypatch):
+    tool = portfolio_tool(web3, tokens, deploy_multicall3(web3), chunk_size=4)
+    batches = count_batches(monkeypatch)
+
+    assert tool.get_portfolio(wallets)["wallets"] == expected(wallets, tokens)
+    # Nine calls in chunks of four, sent as one batch of three eth_calls
+    assert batches == [3]
+
+
+def test_failed_token_read_is_reported_as_missing(web3, tokens, wallets):
+    tokens = tokens + [("BROKEN", deploy_runtime(web3, BROKEN_TOKEN_RUNTIME), 18)]
+    tool = portfolio_tool(web3, tokens, deploy_multicall3(web3))
+
+    holdings = tool.get_portfolio(wallets[:1])["wallets"][0]
+
+    assert holdings["eth"] == "1"
+    assert holdings["tokens"]["BROKEN"] is None
+    assert holdings["tokens"]["USDC"] is not None
+
+
+def test_reads_only_the_callers_wallet(web3, tokens, wallets, caller):
+    own = {"wallet_id": "wallet-1", **wallets[0]}
+    lookups = []
+
+    def wallet_lookup(user_id):
+        lookups.append(user_id)
+        return (own["wallet_id"], own["address"]) if user_id == USER else None
+
+    tool = portfolio_tool(web3, tokens, deploy_multicall3(web3), wallet_lookup=wallet_lookup)
+
+    # Addresses or wallet ids the model makes up are ignored
+    result = tool._run(address=wallets[1]["address"], wallet_addresses=[wallets[2]["address"]], wallet_id="wallet-2")
+
+    assert result["wallets"] == expected([own], tokens)
+    assert lookups == [USER]
+
+
+def test_no_caller_or_no_wallet(web3, tokens, wallets):
+    tool = portfolio_tool(web3, tokens, wallet_lookup=lambda user_id: None)
+    assert tool._run() == {"error": "No wallet found for this customer"}
+
+    token = current_user_id.set(USER)
+    try:
+        assert tool._run() == {"error": "No wallet found for this customer"}
+        assert portfolio_tool(web3, tokens)._run() == {"error": "No wallet found for this customer"}
+    finally:
+        current_user_id.reset(token)
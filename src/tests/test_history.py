@@ -0,0 +1,129 @@
+import json
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.prebuilt import create_react_agent
+from bench.fake_llm import ScriptedChatModel
+from history import SUMMARY_NAME, HistoryPolicy, is_summary, is_wallet_message
+
+WALLET = json.dumps({"wallet_id": "w-1", "address": "0xE9B0f8a530736313fdD388B0660163e93b298c77"})
+
+
+class Summarizer:
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        return AIMessage(content=f"summary {self.calls}")
+
+
+def add_turns(agent, config, start, count):
+    messages = []
+    for i in range(start, start + count):
+        messages += [SystemMessage(content=WALLET), HumanMessage(content=f"question {i}"), AIMessage(content=f"answer {i}")]
+    agent.update_state(config, {"messages": messages}, as_node="agent")
+
+
+@pytest.fixture
+def agent():
+    return create_react_agent(ScriptedChatModel(), [], checkpointer=MemorySaver())
+
+
+@pytest.fixture
+def config():
+    return {"configurable": {"thread_id": "thread-1"}}
+
+
+def stored(agent, config):
+    return agent.get_state(config).values["messages"]
+
+
+@pytest.mark.parametrize("summarizer", [None, Summarizer()], ids=["no-summarizer", "summarizer"])
+def test_compact_prunes_thread_and_keeps_last_reply_last(agent, config, summarizer):
+    policy = HistoryPolicy(max_turns=3, compact_slack=2, summarizer=summarizer)
+    agent.update_state(config, {"messages": [SystemMessage(content="policy")]}, as_node="agent")
+    add_turns(agent, config, 0, 6)
+
+    assert policy.compact(agent, config)
+
+    messages = stored(agent, config)
+    assert messages[-1].content == "answer 5"
+    assert [m.content for m in messages if isinstance(m, HumanMessage)] == ["question 3", "question 4", "question 5"]
+    assert len([m for m in messages if is_wallet_message(m)]) == 1
+    summaries = [i for i, m in enumerate(messages) if is_summary(m)]
+    if summarizer is None:
+        assert summaries == []
+    else:
+        # Ahead of every kept turn, not appended after the last reply
+        assert len(summaries) == 1
+        assert summaries[0] < messages.index(next(m for m in messages if isinstance(m, HumanMessage)))
+    # Nothing left to do until the thread grows past the slack again
+    assert not policy.compact(agent, config)
+
+
+def test_compact_replaces_summary_in_place(agent, config):
+    summarizer = Summarizer()
+    policy = HistoryPolicy(max_turns=3, compact_slack=2, summarizer=summarizer)
+    add_turns(agent, config, 0, 6)
+    assert policy.compact(agent, config)
+    add_turns(agent, config, 6, 3)
+    assert policy.compact(agent, config)
+
+    messages = stored(agent, config)
+    summaries = [m for m in messages if is_summary(m)]
+    assert [m.content for m in summaries] == ["summary 2"] and summaries[0].name == SUMMARY_NAME
+    assert messages[-1].content == "answer 8"
+    assert summarizer.calls == 2
+
+
+def test_compacted_thread_keeps_answering(agent, config):
+    policy = HistoryPolicy(max_turns=3, compact_slack=2, summarizer=Summarizer())
+    add_turns(agent, config, 0, 6)
+    assert policy.compact(agent, config)
+
+    result = agent.invoke({"messages": [("human", "Hello, who are you?")]}, config)
+    assert isinstance(result["messages"][-1], AIMessage)
+
+
+def test_compact_skips_unfinished_turn(agent, config):
+    policy = HistoryPolicy(max_turns=3, compact_slack=2, summarizer=Summarizer())
+    add_turns(agent, config, 0, 6)
+    agent.update_state(config, {"messages": [HumanMessage(content="question 6")]}, as_node="agent")
+    assert not policy.compact(agent, config)
+
+
+class CountingAgent:
+    """Wraps an agent to count checkpoint reads."""
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.reads = 0
+
+    def get_state(self, config):
+        self.reads += 1
+        return self.agent.get_state(config)
+
+    def update_state(self, *args, **kwargs):
+        return self.agent.update_state(*args, **kwargs)
+
+
+def test_compacts_only_threads_found_over_the_slack():
+    summarizer = Summarizer()
+    policy = HistoryPolicy(max_turns=3, compact_slack=2, summarizer=summarizer)
+    agent = create_react_agent(ScriptedChatModel(), [], checkpointer=MemorySaver(), state_modifier=policy.state_modifier)
+    counting = CountingAgent(agent)
+    config = {"configurable": {"thread_id": "thread-1"}}
+
+    def turn(i):
+        compacted = policy.compact_if_due(counting, config)
+        agent.invoke({"messages": [("system", WALLET), ("human", f"Hello {i}")]}, config)
+        return compacted
+
+    compacted = [turn(i) for i in range(8)]
+
+    # Six turns stored at the LLM call of turn 5, so turn 6 compacts; no other turn reads the checkpoint
+    assert compacted == [False] * 6 + [True, False]
+    assert counting.reads == 1
+    assert summarizer.calls == 1
+    assert [m.content for m in stored(agent, config) if isinstance(m, HumanMessage)] == [f"Hello {i}" for i in range(3, 8)]
@@ -0,0 +1,197 @@
+import time
+import threading
+import pytest
+from decimal import Decimal
+import cache
+import pricing
+from bench.stub_cdp import StubCdpServer
+from pricing import (
+    PriceUnavailable, QuoteCache, StaticPriceSource, asset_decimals, from_base_units, to_base_units, to_trade_amount,
+)
+from spend_policy import SpendLedger, SpendPolicy
+from tools.coinbase_api import CoinbaseAPIWrapper
+from tools.trade_assets import TradeAssetsTool
+
+
+class FakeClock:
+    """Stands in for the time module in cache.py and pricing.py."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1_700_000_000 + self.now
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+
+class CountingSource(StaticPriceSource):
+    def __init__(self, prices, gate=None):
+        super().__init__(prices)
+        self.calls = 0
+        # When set, every fetch waits for it, so concurrent misses overlap
+        self.gate = gate
+        self._lock = threading.Lock()
+
+    def price(self, base, quote):
+        with self._lock:
+            self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        return super().price(base, quote)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, "time", clock)
+    monkeypatch.setattr(pricing, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def source():
+    return CountingSource({("ETH", "USD"): "2500", ("USDC", "USD"): "1", ("CBBTC", "USD"): "60000"})
+
+
+def test_exact_conversion():
+    assert to_base_units("1.1") == 1_100_000_000_000_000_000
+    assert to_base_units("0.000000000000000001") == 1
+    assert to_base_units("2.5", asset_decimals("usdc")) == 2_500_000
+    assert to_base_units("12345678901234567.123456789012345678") == 12345678901234567123456789012345678
+    assert from_base_units(1_100_000, 6) == Decimal("1.1")
+
+
+@pytest.mark.parametrize("amount", ["0", "-1", "abc", "NaN", "Infinity", "0.0000001"])
+def test_rejects_invalid_amounts_and_extra_decimals(amount):
+    with pytest.raises(ValueError):
+        to_base_units(amount, asset_decimals("USDC"))
+
+
+def test_rejects_unlisted_assets():
+    with pytest.raises(ValueError):
+        asset_decimals("DOGE")
+
+
+@pytest.mark.parametrize("amount, decimals, expected", [
+    ("1.1", 18, "1.1"),
+    ("1.10", 18, "1.1"),
+    ("100", 6, "100"),
+    ("2.500000", 6, "2.5"),
+    ("12345678901234567.123456789012345678", 18, "12345678901234567.123456789012345678"),
+])
+def test_trade_amount_is_a_whole_unit_string(amount, decimals, expected):
+    assert to_trade_amount(amount, decimals) == expected
+
+
+def test_bridge_gets_the_whole_unit_string():
+    with StubCdpServer() as stub:
+        tool = TradeAssetsTool(api=CoinbaseAPIWrapper(base_url=stub.url), spend_ledger=SpendLedger(SpendPolicy()))
+        tool._run(amount="1.10", asset_from="eth", asset_to="usdc")
+        tool._run(amount="12345678901234567.123456789012345678", asset_from="eth", asset_to="usdc")
+        tool._run(amount="2.5", asset_from="usdc", asset_to="eth")
+        # More decimals than USDC has; rejected before anything is sent
+        assert "rejected" in tool._run(amount="0.0000001", asset_from="usdc", asset_to="eth")
+
+    assert [body["amount"] for path, body in stub.posted if path == "/trade-assets"] == [
+        "1.1", "12345678901234567.123456789012345678", "2.5",
+    ]
+
+
+def test_quote_expires_after_ttl(clock, source):
+    quotes = QuoteCache(source, ttl=30, refresh_ahead=10)
+
+    assert quotes.get("eth").price == Decimal("2500")
+    clock.now += 29
+    assert quotes.get("ETH", "usd").price == Decimal("2500")
+    assert source.calls == 1
+
+    clock.now += 1
+    assert quotes.cached("eth") is None
+    quotes.get("eth")
+    assert source.calls == 2
+
+
+def test_derived_and_unknown_pairs(clock, source):
+    quotes = QuoteCache(source)
+
+    assert quotes.get("usdc", "eth").price == Decimal(1) / Decimal(2500)
+    with pytest.raises(PriceUnavailable):
+        quotes.get("doge")
+
+
+def test_concurrent_misses_are_coalesced(source):
+    source.gate = threading.Event()
+    quotes = QuoteCache(source)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(quotes.get("eth"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    # Let every caller join the flight before the source answers
+    time.sleep(0.1)
+    source.gate.set()
+    for thread in threads:
+        thread.join()
+
+    assert source.calls == 1
+    assert len(results) == 8 and len(set(results)) == 1
+
+
+def test_cached_never_calls_the_source(clock, source):
+    quotes = QuoteCache(source)
+
+    assert quotes.cached("eth") is None
+    assert source.calls == 0
+    # The cold read asked for the pair to be refreshed
+    assert quotes._due(clock.now) == [("ETH", "USD")]
+
+
+def test_pairs_in_use_are_refreshed_ahead_of_expiry(clock, source):
+    quotes = QuoteCache(source, ttl=30, refresh_ahead=10)
+    first = quotes.get("eth")
+    quotes.start()
+    try:
+        clock.now += 21
+        # Inside the refresh window: still served, and the refresh thread is woken
+        assert quotes.cached("eth") == first
+        deadline = time.monotonic() + 5
+        while source.calls < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        quotes.close()
+
+    assert source.calls == 2
+    # Past the first quote's expiry, the refreshed one is served without a miss
+    clock.now += 10
+    refreshed = quotes.cached("eth")
+    assert refreshed is not None and refreshed.as_of > first.as_of
+
+
+def test_warm_pairs_are_evicted_by_last_read(clock, source):
+    quotes = QuoteCache(source, maxsize=2, idle_timeout=300)
+    quotes.get("eth")
+    quotes.get("usdc")
+    quotes.get("eth")
+    quotes.get("cbbtc")
+
+    # USDC was read least recently, so it is no longer kept warm
+    assert set(quotes._reads) == {("ETH", "USD"), ("CBBTC", "USD")}
+    assert quotes.stats()["warm_pairs"] == 2
+    # The cached quote goes the same way
+    assert quotes.cached("usdc") is None and quotes.cached("eth") is not None
+
+
+def test_idle_pairs_stop_being_refreshed(clock, source):
+    quotes = QuoteCache(source, ttl=30, refresh_ahead=10, idle_timeout=60)
+    quotes.get("eth")
+    clock.now += 25
+    quotes.get("usdc")
+    assert quotes._due(clock.now) == [("ETH", "USD")]
+
+    clock.now += 40
+    # ETH hasn't been read for 65s; USDC is due again
+    assert quotes._due(clock.now) == [("USDC", "USD")]
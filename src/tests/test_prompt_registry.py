@@ -0,0 +1,112 @@
+import pytest
+import prompt_registry
+from prompt_registry import PromptMissing, PromptRegistry, prompt_version
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(prompt_registry, "PROMPT_LOAD_RETRY_DELAY", 0)
+
+
+@pytest.fixture
+def prompts(tmp_path):
+    (tmp_path / "agent_prompt.txt").write_text("Be careful with funds.\n")
+    (tmp_path / "summary.txt").write_text("Summarize.")
+    return tmp_path
+
+
+def make_registry(directory):
+    return PromptRegistry(directory=str(directory), required=("agent_prompt",), reload_interval=0)
+
+
+def changing_while_read(monkeypatch, registry, reads):
+    """Make the first `reads` reads of `registry` see a file change between their two stats."""
+    stat = registry._stat
+    calls = [0]
+
+    def racing_stat():
+        calls[0] += 1
+        signature = stat()
+        # The second stat of each read differs from the first
+        if calls[0] <= 2 * reads and calls[0] % 2 == 0:
+            return signature + (("new.txt", 0, 0),)
+        return signature
+
+    monkeypatch.setattr(registry, "_stat", racing_stat)
+
+
+def test_startup_load(prompts):
+    registry = make_registry(prompts)
+
+    assert registry.load() is True
+    assert registry.policy().text == "Be careful with funds."
+    assert registry.versions() == {
+        "agent_prompt": prompt_version("Be careful with funds."),
+        "summary": prompt_version("Summarize."),
+    }
+    assert registry.load() is False
+
+
+@pytest.mark.parametrize("contents", [None, "  \n"])
+def test_startup_fails_without_policy_prompt(prompts, contents):
+    if contents is None:
+        (prompts / "agent_prompt.txt").unlink()
+    else:
+        (prompts / "agent_prompt.txt").write_text(contents)
+
+    with pytest.raises(PromptMissing):
+        make_registry(prompts).load()
+
+
+def test_startup_retries_a_read_raced_by_a_write(prompts, monkeypatch):
+    registry = make_registry(prompts)
+    changing_while_read(monkeypatch, registry, reads=2)
+
+    assert registry.load() is True
+    assert registry.policy().text == "Be careful with funds."
+
+
+def test_startup_fails_when_files_keep_changing(prompts, monkeypatch):
+    registry = make_registry(prompts)
+    changing_while_read(monkeypatch, registry, reads=prompt_registry.PROMPT_LOAD_ATTEMPTS)
+
+    with pytest.raises(PromptMissing):
+        registry.load()
+
+
+def test_reload_picks_up_edits_and_keeps_old_versions(prompts):
+    registry = make_registry(prompts)
+    registry.load()
+    old = registry.policy()
+
+    (prompts / "agent_prompt.txt").write_text("Be very careful with funds.")
+
+    assert registry.load() is True
+    assert registry.policy().text == "Be very careful with funds."
+    assert registry.version(old.version) == old
+
+
+def test_refused_reload_keeps_loaded_prompts(prompts):
+    registry = make_registry(prompts)
+    registry.load()
+    versions = registry.versions()
+
+    (prompts / "agent_prompt.txt").write_text("")
+    with pytest.raises(PromptMissing):
+        registry.load()
+
+    assert registry.versions() == versions
+    assert registry.policy().text == "Be careful with funds."
+
+
+def test_reload_raced_by_a_write_waits_for_the_next_check(prompts, monkeypatch):
+    registry = make_registry(prompts)
+    registry.load()
+    versions = registry.versions()
+    (prompts / "summary.txt").write_text("Summarize briefly.")
+    changing_while_read(monkeypatch, registry, reads=1)
+
+    assert registry.load() is False
+    assert registry.versions() == versions
+    assert registry.load() is True
+    assert registry.get("summary").text == "Summarize briefly."
@@ -0,0 +1,273 @@
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import rate_limit
+import tools.coinbase_api as coinbase_api
+from rate_limit import FileBucketStore, MemoryBucketStore, PostgresBucketStore, RateLimited, RateLimiter, parse_retry_after
+from tools.coinbase_api import AsyncCoinbaseAPIWrapper, CoinbaseAPIWrapper
+
+
+class FakeClock:
+    """Stands in for the time module in rate_limit.py; sleeping moves the clock forward."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class ScriptedServer:
+    """HTTP server answering each request with the next scripted (status, headers), then 200s."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _answer(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                server.requests.append((self.command, self.path))
+                status, headers = server.responses.pop(0) if server.responses else (200, {})
+                body = json.dumps({"status": status}).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _answer
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "file"])
+def store(request, tmp_path):
+    return MemoryBucketStore() if request.param == "memory" else FileBucketStore(str(tmp_path))
+
+
+@pytest.fixture
+def slept(monkeypatch):
+    """Delays the cdp wrappers sleep for between attempts, without sleeping."""
+    delays = []
+    monkeypatch.setattr(coinbase_api.time, "sleep", delays.append)
+
+    async def no_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(coinbase_api.asyncio, "sleep", no_sleep)
+    return delays
+
+
+def test_bucket_bursts_then_refills(clock, store):
+    # Two tokens of burst, refilled at 4 per second
+    assert [store.take("cdp", 4, 2) for _ in range(2)] == [0, 0]
+    assert store.take("cdp", 4, 2) == pytest.approx(0.25)
+
+    clock.now += 0.25
+    assert store.take("cdp", 4, 2) == 0
+    clock.now += 10
+    # Never more than the burst
+    assert [store.take("cdp", 4, 2) for _ in range(3)] == [0, 0, pytest.approx(0.25)]
+
+
+def test_blocked_bucket_waits_out_the_block(clock, store):
+    store.take("cdp", 4, 2)
+    store.block("cdp", 5)
+
+    assert store.take("cdp", 4, 2) == pytest.approx(5.25)
+    clock.now += 5.25
+    assert store.take("cdp", 4, 2) == 0
+
+
+def test_buckets_are_independent(clock, store):
+    store.take("cdp", 1, 1)
+
+    assert store.take("cdp", 1, 1) == pytest.approx(1)
+    assert store.take("openai", 1, 1) == 0
+
+
+def test_postgres_bucket(database_url):
+    store = PostgresBucketStore(database_url)
+    store.setup()
+    with store._conn_lock:
+        store._connection().execute("DELETE FROM rate_limit_bucket")
+
+    assert [store.take("cdp", 2, 2) for _ in range(2)] == [0, 0]
+    assert store.take("cdp", 2, 2) == pytest.approx(0.5, abs=0.05)
+    store.block("cdp", 5)
+    assert store.take("cdp", 2, 2) == pytest.approx(5.5, abs=0.05)
+
+
+def test_acquire_waits_within_max_wait_then_raises(clock):
+    limiter = RateLimiter(MemoryBucketStore(), {"cdp": (1, 1)}, max_wait=2)
+    limiter.acquire("cdp")
+    limiter.acquire("cdp")
+    assert clock.slept == [pytest.approx(1)]
+
+    limiter.block("cdp", 10)
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.acquire("cdp")
+    assert excinfo.value.upstream == "cdp" and excinfo.value.retry_after == pytest.approx(11)
+    # Gave up without sleeping through the block
+    assert clock.slept == [pytest.approx(1)]
+
+
+def test_admit_turns_work_away_while_the_budget_is_exhausted(clock):
+    limiter = RateLimiter(MemoryBucketStore(), {"cdp": (1, 1), "openai": (1, 1)}, max_wait=2, admission_cache=0)
+    limiter.admit(["cdp", "openai"])
+
+    limiter.block("openai", 30)
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.admit(["cdp", "openai"])
+    assert excinfo.value.upstream == "openai"
+
+    clock.now += 31
+    limiter.admit(["cdp", "openai"])
+
+
+def test_unlimited_upstreams_are_never_held():
+    limiter = RateLimiter(MemoryBucketStore(), {"cdp": (0, 0)}, max_wait=0)
+    for _ in range(100):
+        limiter.acquire("cdp")
+
+
+@pytest.mark.parametrize("value, expected", [("3", 3.0), ("-1", 0.0), ("soon", None), (None, None)])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    value = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 120))
+    assert parse_retry_after(value) == pytest.approx(120, abs=2)
+
+
+def test_429_is_retried_after_retry_after(clock, slept):
+    server = ScriptedServer((429, {"Retry-After": "2"}))
+    limiter = RateLimiter(MemoryBucketStore(), {"cdp": (100, 100)})
+    try:
+        api = CoinbaseAPIWrapper(base_url=server.url, limiter=limiter)
+        assert api.transfer_funds("wallet-1", "0xabc", "0.1") == {"status": 200}
+    finally:
+        server.stop()
+
+    # Even a transfer is retried on a 429: the bridge refused it unprocessed
+    assert server.requests == [("POST", "/transfer-funds")] * 2
+    assert slept == [2]
+    # The Retry-After went into the shared bucket, so the retry itself waited it out there too
+    assert clock.slept == [pytest.approx(2 + 1 / 100)]
+
+
+@pytest.mark.parametrize("status", [500, 502, 503])
+def test_post_is_not_retried_on_server_errors(slept, status):
+    server = ScriptedServer((status, {}))
+    try:
+        api = CoinbaseAPIWrapper(base_url=server.url)
+        with pytest.raises(requests.HTTPError):
+            api.transfer_funds("wallet-1", "0xabc", "0.1")
+    finally:
+        server.stop()
+
+    assert len(server.requests) == 1
+
+
+def test_get_is_retried_on_server_errors(slept):
+    server = ScriptedServer((503, {}), (502, {}))
+    try:
+        api = CoinbaseAPIWrapper(base_url=server.url)
+        assert api.get_balance("wallet-1") == {"status": 200}
+    finally:
+        server.stop()
+
+    assert len(server.requests) == 3
+
+
+def test_long_retry_after_raises_rate_limited(slept):
+    server = ScriptedServer((429, {"Retry-After": "60"}))
+    try:
+        api = CoinbaseAPIWrapper(base_url=server.url, max_retry_after=10)
+        with pytest.raises(RateLimited) as excinfo:
+            api.fund_wallet("wallet-1")
+    finally:
+        server.stop()
+
+    assert excinfo.value.retry_after == 60
+    assert len(server.requests) == 1 and slept == []
+
+
+def test_repeated_429s_give_up_with_rate_limited(slept):
+    server = ScriptedServer(*[(429, {"Retry-After": "1"})] * 4)
+    try:
+        api = CoinbaseAPIWrapper(base_url=server.url, max_retries=3)
+        with pytest.raises(RateLimited):
+            api.create_wallet()
+    finally:
+        server.stop()
+
+    assert len(server.requests) == 4
+
+
+def test_exhausted_budget_raises_before_sending(clock):
+    server = ScriptedServer()
+    limiter = RateLimiter(MemoryBucketStore(), {"cdp": (1, 1)}, max_wait=5)
+    limiter.block("cdp", 30)
+    try:
+        api = CoinbaseAPIWrapper(base_url=server.url, limiter=limiter)
+        with pytest.raises(RateLimited):
+            api.transfer_funds("wallet-1", "0xabc", "0.1")
+    finally:
+        server.stop()
+
+    assert server.requests == []
+
+
+def test_async_429_is_retried(slept):
+    server = ScriptedServer((429, {"Retry-After": "1"}))
+
+    async def transfer():
+        api = AsyncCoinbaseAPIWrapper(base_url=server.url)
+        try:
+            return await api.transfer_funds("wallet-1", "0xabc", "0.1")
+        finally:
+            await api.aclose()
+
+    try:
+        assert asyncio.run(transfer()) == {"status": 200}
+    finally:
+        server.stop()
+
+    assert len(server.requests) == 2 and slept == [1]
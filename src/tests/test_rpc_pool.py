@@ -0,0 +1,105 @@
+import time
+import pytest
+from bench.stub_rpc import StubRpcServer
+from rpc_pool import RPCPool
+
+
+@pytest.fixture
+def stubs():
+    # Each stub reports its own block number, so a response tells which endpoint answered
+    first, second = StubRpcServer().start(), StubRpcServer().start()
+    first.block_number, second.block_number = 1, 2
+    yield first, second
+    first.stop()
+    second.stop()
+
+
+def answered_by(response):
+    return int(response["result"], 16)
+
+
+def block_number(pool):
+    return answered_by(pool.make_request("eth_blockNumber", []))
+
+
+def warm_up(pool, stubs):
+    """Measure every endpoint once; unmeasured endpoints are probed first."""
+    seen = {block_number(pool) for _ in stubs}
+    assert seen == {stub.block_number for stub in stubs}
+
+
+def test_requests_go_to_the_best_scoring_endpoint(stubs):
+    fast, slow = stubs
+    slow.latency = 0.05
+    pool = RPCPool([slow.url, fast.url], resample_interval=60)
+    warm_up(pool, stubs)
+    before = slow.requests
+
+    assert {block_number(pool) for _ in range(20)} == {fast.block_number}
+    assert slow.requests == before
+
+
+def test_slow_primary_is_hedged_and_first_answer_wins(stubs):
+    primary, backup = stubs
+    backup.latency = 0.01
+    pool = RPCPool([primary.url, backup.url], hedge_min_delay=0.02, hedge_max_delay=0.05, resample_interval=60)
+    warm_up(pool, stubs)
+    primary.latency = 1.0
+
+    start = time.perf_counter()
+    assert block_number(pool) == backup.block_number
+    # The hedge went out after the 0.05s cap on the primary's p95, not after the slow answer
+    assert time.perf_counter() - start < 0.5
+
+
+def test_error_fails_over_without_waiting_for_the_hedge(stubs):
+    primary, backup = stubs
+    backup.latency = 0.01
+    pool = RPCPool([primary.url, backup.url], hedge_min_delay=5, hedge_max_delay=5, resample_interval=60)
+    warm_up(pool, stubs)
+    primary.error_rate = 1.0
+
+    start = time.perf_counter()
+    assert block_number(pool) == backup.block_number
+    assert time.perf_counter() - start < 1
+
+
+def test_failing_endpoint_is_ejected_then_readmitted_on_probation(stubs):
+    flaky, steady = stubs
+    pool = RPCPool(
+        [flaky.url, steady.url], eject_min_samples=2, eject_error_rate=0.5, eject_seconds=0.3, resample_interval=0.2
+    )
+    warm_up(pool, stubs)
+    flaky.error_rate = 1.0
+    while pool.stats()[0]["healthy"]:
+        assert block_number(pool) == steady.block_number
+
+    # Ejected: not even tried for eject_seconds
+    tried = flaky.requests
+    assert {block_number(pool) for _ in range(5)} == {steady.block_number}
+    assert flaky.requests == tried
+
+    # Readmitted and probed first; on probation a single failure ejects it again
+    time.sleep(0.35)
+    assert block_number(pool) == steady.block_number
+    assert flaky.requests == tried + 1
+    assert not pool.stats()[0]["healthy"]
+
+    flaky.error_rate = 0.0
+    time.sleep(0.35)
+    assert block_number(pool) == flaky.block_number
+    assert pool.stats()[0]["healthy"] and not pool.endpoints[0].probation
+
+
+def test_batch_requests_are_hedged(stubs):
+    primary, backup = stubs
+    backup.latency = 0.01
+    pool = RPCPool([primary.url, backup.url], hedge_min_delay=0.02, hedge_max_delay=0.05, resample_interval=60)
+    warm_up(pool, stubs)
+    primary.latency = 1.0
+
+    start = time.perf_counter()
+    responses = pool.make_batch_request([("eth_blockNumber", []), ("eth_chainId", [])])
+
+    assert [response["result"] for response in responses] == [hex(backup.block_number), "0x1"]
+    assert time.perf_counter() - start < 0.5
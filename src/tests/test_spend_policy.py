@@ -0,0 +1,118 @@
+import httpx
+import pytest
+from decimal import Decimal
+from spend_policy import SpendLedger, SpendPolicy, SpendPolicyViolation
+
+USER = "user-1"
+DEST = "0xa7979BF6Ce644E4e36da2Ee65Db73c3f5A0dF895"
+DENIED = "0x000000000000000000000000000000000000dEaD"
+
+
+@pytest.fixture
+def policy():
+    return SpendPolicy(
+        window_seconds=3600,
+        assets={"eth": {"max_per_transaction": "1", "max_per_window": "2"}},
+        deny=[DENIED],
+    )
+
+
+def reason(call):
+    with pytest.raises(SpendPolicyViolation) as excinfo:
+        call()
+    return excinfo.value.reason
+
+
+def test_transaction_cap(policy):
+    ledger = SpendLedger(policy)
+
+    assert ledger.reserve(USER, "CreateTransfer", "ETH", "1", DEST)
+    assert reason(lambda: ledger.reserve(USER, "CreateTransfer", "eth", "1.000000000000000001", DEST)) == "transaction_cap"
+
+
+def test_invalid_amounts(policy):
+    ledger = SpendLedger(policy)
+
+    for amount in ("0", "-1", "abc", "NaN"):
+        assert reason(lambda: ledger.reserve(USER, "CreateTransfer", "eth", amount, DEST)) == "invalid_amount"
+
+
+def test_window_cap_is_per_user_and_asset(policy):
+    ledger = SpendLedger(policy)
+    ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    ledger.reserve(USER, "CreateTransfer", "eth", "0.5", DEST)
+
+    assert reason(lambda: ledger.reserve(USER, "CreateTransfer", "eth", "0.6", DEST)) == "window_cap"
+    # Exactly up to the cap is allowed; other users and unlisted assets have their own budgets
+    assert ledger.reserve(USER, "CreateTransfer", "eth", "0.5", DEST)
+    assert ledger.reserve("user-2", "CreateTransfer", "eth", "1", DEST)
+    assert ledger.reserve(USER, "TradeAssets", "usdc", "100")
+
+
+def test_window_expires(policy, monkeypatch):
+    ledger = SpendLedger(policy)
+    now = [1_000_000.0]
+    monkeypatch.setattr("spend_policy.time.time", lambda: now[0])
+    ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    assert reason(lambda: ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)) == "window_cap"
+
+    now[0] += policy.window_seconds + 1
+    assert ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+
+
+def test_destination_lists(policy):
+    ledger = SpendLedger(policy)
+    assert reason(lambda: ledger.reserve(USER, "CreateTransfer", "eth", "0.1", DENIED.lower())) == "destination_denied"
+
+    allow_only = SpendLedger(SpendPolicy(allow=[DEST]))
+    assert allow_only.reserve(USER, "CreateTransfer", "eth", "0.1", DEST.lower())
+    assert reason(lambda: allow_only.reserve(USER, "CreateTransfer", "eth", "0.1", DENIED)) == "destination_not_allowed"
+
+
+def test_release_and_settle(policy):
+    ledger = SpendLedger(policy)
+    released = ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    ledger.release(released)
+    definite = ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    ledger.settle(definite, httpx.ConnectError("refused"))
+    # Both freed their room in the window
+    confirmed = ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    ledger.settle(confirmed)
+    ambiguous = ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    # A read timeout may have moved funds, so it stays counted like a confirmed spend
+    ledger.settle(ambiguous, httpx.ReadTimeout("timed out"))
+
+    assert reason(lambda: ledger.reserve(USER, "CreateTransfer", "eth", "0.1", DEST)) == "window_cap"
+
+
+def test_database_ledger_records_and_marks(app, policy):
+    from models import SpendLedgerEntry
+
+    ledger = SpendLedger(policy, app)
+    confirmed = ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    released = ledger.reserve(USER, "CreateTransfer", "eth", "0.75", DEST)
+    assert reason(lambda: ledger.reserve(USER, "CreateTransfer", "eth", "0.5", DEST)) == "window_cap"
+    ledger.settle(confirmed)
+    ledger.release(released)
+
+    with app.app_context():
+        entries = SpendLedgerEntry.query.order_by(SpendLedgerEntry.id).all()
+        assert [(entry.amount, entry.status) for entry in entries] == [
+            (Decimal("1"), "confirmed"),
+            (Decimal("0.75"), "released"),
+        ]
+    assert ledger.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+
+
+def test_release_by_another_worker_frees_the_window(app, policy):
+    # Two ledgers on one database stand in for two workers
+    first, second = SpendLedger(policy, app), SpendLedger(policy, app)
+    reservation = first.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    second.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    assert reason(lambda: second.reserve(USER, "CreateTransfer", "eth", "1", DEST)) == "window_cap"
+
+    first.release(reservation)
+
+    assert second.reserve(USER, "CreateTransfer", "eth", "1", DEST)
+    assert reason(lambda: first.reserve(USER, "CreateTransfer", "eth", "0.1", DEST)) == "window_cap"
@@ -0,0 +1,188 @@
+import time
+import threading
+import psycopg
+import pytest
+from thread_queue import ThreadQueue, ThreadQueueFull, ThreadQueueTimeout
+
+
+class FakeTurns:
+    """A turn function that records every run and can be held open until released."""
+
+    def __init__(self):
+        self.runs = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def hold(self):
+        self.started.clear()
+        self.release.clear()
+
+    def __call__(self, messages):
+        self.runs.append(list(messages))
+        self.started.set()
+        self.release.wait(5)
+        return f"reply to {len(self.runs)}"
+
+
+def in_background(call, results, *args):
+    def target():
+        try:
+            results.append(call(*args))
+        except Exception as e:
+            results.append(e)
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def queued(queue, thread_id):
+    state = queue._threads.get(thread_id)
+    return state.queued if state else 0
+
+
+@pytest.fixture
+def turns():
+    return FakeTurns()
+
+
+def test_messages_sent_during_a_turn_are_answered_in_one_run(turns):
+    queue = ThreadQueue(max_depth=10)
+    turns.hold()
+    first = []
+    threads = [in_background(queue.submit, first, "thread-1", "first", turns)]
+    assert turns.started.wait(5)
+
+    results = []
+    for n in range(5):
+        threads.append(in_background(queue.submit, results, "thread-1", f"message {n}", turns))
+    wait_for(lambda: queued(queue, "thread-1") == 5)
+    turns.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert turns.runs == [["first"], [f"message {n}" for n in range(5)]]
+    # Every caller coalesced into the second run gets its reply
+    assert first == ["reply to 1"] and results == ["reply to 2"] * 5
+
+
+def test_threads_run_independently(turns):
+    queue = ThreadQueue()
+    turns.hold()
+    results = []
+    blocked = in_background(queue.submit, results, "thread-1", "slow", turns)
+    assert turns.started.wait(5)
+
+    assert queue.submit("thread-2", "fast", lambda messages: "other thread") == "other thread"
+    turns.release.set()
+    blocked.join()
+
+
+def test_full_queue_is_rejected(turns):
+    queue = ThreadQueue(max_depth=2)
+    turns.hold()
+    results = []
+    threads = [in_background(queue.submit, results, "thread-1", "running", turns)]
+    assert turns.started.wait(5)
+    threads += [in_background(queue.submit, results, "thread-1", f"queued {n}", turns) for n in range(2)]
+    wait_for(lambda: queued(queue, "thread-1") == 2)
+
+    with pytest.raises(ThreadQueueFull):
+        queue.submit("thread-1", "one too many", turns)
+    turns.release.set()
+    for thread in threads:
+        thread.join()
+    assert turns.runs == [["running"], ["queued 0", "queued 1"]]
+
+
+def test_waiting_too_long_times_out_and_is_withdrawn(turns):
+    queue = ThreadQueue(timeout=0.2)
+    turns.hold()
+    results = []
+    running = in_background(queue.submit, results, "thread-1", "running", turns)
+    assert turns.started.wait(5)
+
+    start = time.perf_counter()
+    with pytest.raises(ThreadQueueTimeout):
+        queue.submit("thread-1", "impatient", turns)
+    assert time.perf_counter() - start < 1
+    turns.release.set()
+    running.join()
+
+    # The timed-out message never runs
+    assert turns.runs == [["running"]]
+    assert queue._threads == {}
+
+
+def test_streams_wait_for_the_thread_and_are_never_coalesced(turns):
+    queue = ThreadQueue()
+    turns.hold()
+    results = []
+    running = in_background(queue.submit, results, "thread-1", "running", turns)
+    assert turns.started.wait(5)
+
+    tokens = []
+    stream = in_background(queue.enter, tokens, "thread-1")
+    wait_for(lambda: queued(queue, "thread-1") == 1)
+    after = in_background(queue.submit, results, "thread-1", "after the stream", turns)
+    wait_for(lambda: queued(queue, "thread-1") == 2)
+    assert tokens == []
+
+    turns.release.set()
+    running.join()
+    stream.join()
+    # The stream has the thread; the message behind it waits rather than joining it
+    time.sleep(0.05)
+    assert turns.runs == [["running"]]
+    queue.exit("thread-1", tokens[0])
+    after.join()
+
+    assert turns.runs == [["running"], ["after the stream"]]
+
+
+def test_disabled_queue_runs_every_message_alone(turns):
+    queue = ThreadQueue(enabled=False)
+
+    assert queue.submit("thread-1", "hello", turns) == "reply to 1"
+    assert queue.enter("thread-1") is None
+    assert turns.runs == [["hello"]]
+
+
+def test_turns_on_one_thread_exclude_other_workers(database_url, turns):
+    first, second = ThreadQueue(database_url, timeout=2), ThreadQueue(database_url, timeout=2)
+    token = first.enter("thread-1")
+    results = []
+    waiting = in_background(second.submit, results, "thread-1", "hello", turns)
+
+    time.sleep(0.2)
+    assert turns.runs == []
+    first.exit("thread-1", token)
+    waiting.join()
+
+    assert results == ["reply to 1"]
+
+
+def test_failed_unlock_keeps_other_threads_locked(database_url):
+    worker, other = ThreadQueue(database_url, timeout=0.3), ThreadQueue(database_url, timeout=0.3)
+    kept = worker.enter("thread-1")
+    lost = worker.enter("thread-2")
+    # The connection holding thread-2's lock dies
+    with psycopg.connect(database_url, autocommit=True) as admin:
+        admin.execute("SELECT pg_terminate_backend(%s)", (worker._held["thread-2"].info.backend_pid,))
+
+    worker.exit("thread-2", lost)
+
+    # thread-2's lock went with its connection; thread-1 is still held
+    other.exit("thread-2", other.enter("thread-2"))
+    with pytest.raises(ThreadQueueTimeout):
+        other.enter("thread-1")
+    worker.exit("thread-1", kept)
+    other.exit("thread-1", other.enter("thread-1"))
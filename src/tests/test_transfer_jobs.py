@@ -0,0 +1,168 @@
+import threading
+import pytest
+from sqlalchemy import text
+from models import db, TransferJob
+from spend_policy import Reservation
+from transfer_jobs import TransferJobQueue
+
+SOURCE = "wallet-1"
+DEST = "0xa7979BF6Ce644E4e36da2Ee65Db73c3f5A0dF895"
+
+
+class FakeAPI:
+    """Answers transfers like the cdp bridge and records every call."""
+
+    def __init__(self):
+        self.transfers = []
+        self._lock = threading.Lock()
+
+    def transfer_funds(self, source_wallet_id, destination, amount):
+        with self._lock:
+            self.transfers.append((source_wallet_id, destination, amount))
+            n = len(self.transfers)
+        return {
+            "message": "Transfer created",
+            "transfer": {"model": {
+                "transfer_id": f"transfer-{n}",
+                "address_id": "0x0000000000000000000000000000000000000001",
+                "destination": destination,
+                "transaction": {"transaction_hash": f"0x{n:064x}"},
+            }},
+        }
+
+
+class FakeLedger:
+    def __init__(self):
+        self.settled = []
+        self.released = []
+
+    def settle(self, reservation, error=None):
+        self.settled.append((reservation, error))
+
+    def release(self, reservation):
+        self.released.append(reservation)
+
+
+@pytest.fixture
+def api():
+    return FakeAPI()
+
+
+@pytest.fixture
+def ledger():
+    return FakeLedger()
+
+
+@pytest.fixture
+def jobs(app, api, ledger):
+    return TransferJobQueue(app, api, "http://127.0.0.1:8545", spend_ledger=ledger, enabled=True)
+
+
+def transfer(amount="0.1"):
+    return {"source_wallet_id": SOURCE, "destination_wallet_address": DEST, "amount": amount}
+
+
+def statuses(app):
+    with app.app_context():
+        return {job.id: job.status for job in TransferJob.query.all()}
+
+
+def test_job_runs_once(jobs, api, ledger, app):
+    reservation = Reservation("alice", "eth", 7)
+    job = jobs.submit("transfer", transfer(), user_id="alice", reservation=reservation)
+    assert job["status"] == "queued"
+
+    assert jobs.run_one()
+    assert not jobs.run_one()
+
+    view = jobs.get(job["job_id"], "alice")
+    assert view["status"] == "submitted" and view["transaction_hash"] == f"0x{1:064x}"
+    assert api.transfers == [(SOURCE, DEST, "0.1")]
+    assert ledger.settled == [(reservation, None)]
+
+
+def test_claim_skips_locked_jobs(jobs, api, app):
+    first = jobs.submit("transfer", transfer("0.1"), user_id="alice")
+    second = jobs.submit("transfer", transfer("0.2"), user_id="alice")
+
+    # Another worker is in the middle of claiming the first job
+    with app.app_context(), db.engine.connect() as other:
+        transaction = other.begin()
+        other.execute(text("SELECT id FROM transfer_job WHERE id = :id FOR UPDATE"), {"id": first["job_id"]})
+
+        assert jobs.run_one()
+        assert api.transfers == [(SOURCE, DEST, "0.2")]
+        transaction.rollback()
+
+    assert statuses(app) == {first["job_id"]: "queued", second["job_id"]: "submitted"}
+
+
+def test_concurrent_workers_run_every_job_once(jobs, api, app):
+    submitted = [jobs.submit("transfer", transfer(f"0.{n}"), user_id="alice")["job_id"] for n in range(1, 9)]
+
+    def work():
+        while jobs.run_one():
+            pass
+
+    workers = [threading.Thread(target=work) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert sorted(amount for _, _, amount in api.transfers) == sorted(f"0.{n}" for n in range(1, 9))
+    assert statuses(app) == {job_id: "submitted" for job_id in submitted}
+
+
+def test_idempotency_keys_are_per_user(jobs, ledger):
+    first = jobs.submit("transfer", transfer(), user_id="alice", idempotency_key="pay-rent")
+    duplicate_reservation = Reservation("alice", "eth", 2)
+    repeat = jobs.submit("transfer", transfer(), user_id="alice", idempotency_key="pay-rent", reservation=duplicate_reservation)
+    other_user = jobs.submit("transfer", transfer(), user_id="bob", idempotency_key="pay-rent")
+
+    assert repeat == {**first, "deduplicated": True}
+    # The repeat's reservation is never going to be settled by a job
+    assert ledger.released == [duplicate_reservation]
+    assert other_user["job_id"] != first["job_id"] and "deduplicated" not in other_user
+    assert jobs.get(other_user["job_id"], "bob")["status"] == "queued"
+
+
+def test_requests_without_a_key_are_never_deduplicated(jobs):
+    first = jobs.submit("transfer", transfer(), user_id="alice")
+    second = jobs.submit("transfer", transfer(), user_id="alice")
+
+    assert first["job_id"] != second["job_id"]
+
+
+def test_get_hides_other_users_jobs(jobs):
+    job = jobs.submit("transfer", transfer(), user_id="alice")
+
+    assert jobs.get(job["job_id"], "alice")["job_id"] == job["job_id"]
+    assert jobs.get(job["job_id"], "bob") is None
+    assert jobs.get(job["job_id"], None) is None
+
+
+def test_crashed_running_job_is_never_retried(jobs, api, app):
+    job = jobs.submit("transfer", transfer(), user_id="alice")
+    # A worker claimed it and died before recording the outcome
+    jobs._update(job["job_id"], status="running")
+
+    assert not jobs.run_one()
+    assert api.transfers == []
+    assert jobs.get(job["job_id"], "alice")["status"] == "running"
+
+
+def test_failed_job_settles_its_reservation_with_the_error(jobs, api, ledger):
+    def refuse(*args):
+        raise RuntimeError("insufficient funds")
+
+    api.transfer_funds = refuse
+    reservation = Reservation("alice", "eth", 3)
+    job = jobs.submit("transfer", transfer(), user_id="alice", reservation=reservation)
+
+    assert jobs.run_one()
+
+    view = jobs.get(job["job_id"], "alice")
+    assert view["status"] == "failed" and view["error"] == "insufficient funds"
+    [(settled, error)] = ledger.settled
+    assert settled == reservation and str(error) == "insufficient funds"
@@ -0,0 +1,118 @@
+import itertools
+import threading
+import pytest
+from models import db, PooledWallet, UserWallet
+from wallet_pool import WalletPool
+
+
+class FakeWallets:
+    """Stands in for the cdp bridge: every created wallet gets a fresh id and address."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self.created = []
+
+    def __call__(self):
+        n = next(self._ids)
+        wallet = (f"wallet-{n}", f"0x{n:040x}")
+        self.created.append(wallet)
+        return wallet
+
+    # The CoinbaseAPIWrapper calls used by WalletPool.refill
+    def create_wallet(self):
+        return {"walletId": self()[0]}
+
+    def get_wallet(self, wallet_id):
+        n = int(wallet_id.split("-")[1])
+        return {"wallet": {"addresses": [{"id": f"0x{n:040x}"}]}}
+
+
+@pytest.fixture
+def wallets():
+    return FakeWallets()
+
+
+@pytest.fixture
+def pool(app, wallets):
+    return WalletPool(app, wallets, enabled=True, low_watermark=2, high_watermark=3)
+
+
+def assign(app, pool, user_id, create):
+    with app.app_context():
+        return pool.assign(user_id, create)
+
+
+def test_claim_from_pool(app, pool, wallets):
+    pool.refill()
+    with app.app_context():
+        assert pool.depth() == 3
+
+    wallet, is_new = assign(app, pool, "alice", wallets)
+
+    assert is_new and wallet == ("wallet-1", f"0x{1:040x}")
+    assert assign(app, pool, "alice", wallets) == (wallet, False)
+    with app.app_context():
+        assert pool.depth() == 2
+    # Claiming doesn't create wallets inline
+    assert len(wallets.created) == 3
+
+
+def test_empty_pool_falls_back_to_inline_creation(app, pool, wallets):
+    wallet, is_new = assign(app, pool, "alice", wallets)
+
+    assert is_new and wallets.created == [wallet]
+    with app.app_context():
+        assert UserWallet.query.filter_by(user_id="alice").one().wallet_id == wallet[0]
+    # The miss wakes the refill worker
+    assert pool._wakeup.is_set()
+
+
+def test_disabled_pool_creates_inline(app, wallets):
+    pool = WalletPool(app, wallets, enabled=False)
+    with app.app_context():
+        db.session.add(PooledWallet(wallet_id="pooled", wallet_address="0xpooled"))
+        db.session.commit()
+
+    wallet, is_new = assign(app, pool, "alice", wallets)
+
+    assert is_new and wallet == wallets.created[0]
+
+
+def test_refill_stops_at_low_watermark(app, pool, wallets):
+    pool.refill()
+    assign(app, pool, "alice", wallets)
+    pool.refill()
+    # Still at the low watermark, so nothing was created
+    assert len(wallets.created) == 3
+
+    assign(app, pool, "bob", wallets)
+    pool.refill()
+    with app.app_context():
+        assert pool.depth() == 3
+
+
+@pytest.mark.parametrize("pooled", [0, 1, 4])
+def test_concurrent_claims_for_one_user_end_with_one_wallet(app, pool, wallets, pooled):
+    with app.app_context():
+        for n in range(pooled):
+            db.session.add(PooledWallet(wallet_id=f"pooled-{n}", wallet_address=f"0xpooled{n}"))
+        db.session.commit()
+    barrier = threading.Barrier(4)
+    results = []
+
+    def claim():
+        barrier.wait()
+        results.append(assign(app, pool, "alice", wallets))
+
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({wallet for wallet, _ in results}) == 1
+    assert sum(is_new for _, is_new in results) == 1
+    with app.app_context():
+        assert UserWallet.query.filter_by(user_id="alice").count() == 1
+        # No wallet is lost: losing claims leave theirs in the pool and inline ones go back to it
+        assert pool.depth() == pooled + len(wallets.created) - 1
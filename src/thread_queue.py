@@ -0,0 +1,249 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+import psycopg
+from metrics import THREAD_QUEUE_COALESCED, THREAD_QUEUE_DEPTH, THREAD_QUEUE_REJECTED, THREAD_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+THREAD_QUEUE_ENABLED = os.getenv("THREAD_QUEUE_ENABLED", "true").lower() == "true"
+# Requests allowed to wait behind a running turn on one thread before new ones get a 429
+THREAD_QUEUE_MAX_DEPTH = int(os.getenv("THREAD_QUEUE_MAX_DEPTH", "5"))
+# Longest a request waits for its turn to start, including waiting on another worker
+THREAD_QUEUE_TIMEOUT = float(os.getenv("THREAD_QUEUE_TIMEOUT", "60"))
+THREAD_LOCK_POLL_INTERVAL = float(os.getenv("THREAD_LOCK_POLL_INTERVAL", "0.05"))
+
+# Namespace for the per-thread advisory locks; the two-key form can't collide with REFILL_LOCK_KEY
+THREAD_LOCK_NAMESPACE = 7_415_003
+
+
+class ThreadQueueFull(Exception):
+    pass
+
+
+class ThreadQueueTimeout(Exception):
+    pass
+
+
+class _Turn:
+    """One agent run on a thread, carrying every request coalesced into it."""
+
+    def __init__(self, coalesce):
+        self.coalesce = coalesce
+        self.items = []  # [item, enqueued_at] entries
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class _ThreadState:
+    def __init__(self, lock):
+        self.cond = threading.Condition(lock)
+        self.turns = deque()
+        self.running = False
+        self.queued = 0
+
+
+class ThreadQueue:
+    """Runs at most one agent turn per conversation thread at a time.
+
+    Within a process, requests for a thread that is busy wait in a queue, and messages that
+    arrive while a turn is running are coalesced into the next turn, so the agent sees them
+    together and answers once. Across processes a turn also holds a Postgres advisory lock on
+    the thread. Each held lock sits on its own connection, outside the checkpoint pool, so
+    waiting turns never tie the pool up and losing one connection never loses another thread's
+    lock. Connections are reused across turns, so there are only as many as turns running at
+    once. Without `conninfo` only the in-process queue applies.
+    """
+
+    def __init__(
+        self,
+        conninfo=None,
+        enabled=THREAD_QUEUE_ENABLED,
+        max_depth=THREAD_QUEUE_MAX_DEPTH,
+        timeout=THREAD_QUEUE_TIMEOUT,
+        poll_interval=THREAD_LOCK_POLL_INTERVAL,
+    ):
+        self.conninfo = conninfo
+        self.enabled = enabled
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._threads = {}
+        # thread_id -> the connection holding its advisory lock; idle connections are reused
+        self._held = {}
+        self._idle = []
+        self._conn_lock = threading.Lock()
+
+    def submit(self, thread_id, item, run):
+        """Queue `item` for the thread and return `run(items)` for the turn it ends up in.
+
+        Whichever waiting request reaches the front first runs the turn with all the items
+        coalesced into it; the others get the same result (or exception).
+        """
+        if not self.enabled:
+            return run([item])
+        state, turn, entry = self._enqueue(thread_id, item, coalesce=True)
+        if self._wait(thread_id, state, turn, entry):
+            self._run(thread_id, state, turn, run)
+        if turn.error is not None:
+            raise turn.error
+        return turn.result
+
+    def enter(self, thread_id):
+        """Wait for exclusive use of the thread, without coalescing. Pair with `exit`."""
+        if not self.enabled:
+            return None
+        state, turn, entry = self._enqueue(thread_id, None, coalesce=False)
+        self._wait(thread_id, state, turn, entry)
+        try:
+            self._lock_thread(thread_id, turn)
+        except Exception:
+            self._finish(thread_id, state, turn)
+            raise
+        return state, turn
+
+    def exit(self, thread_id, token):
+        if token is None:
+            return
+        state, turn = token
+        self._unlock_thread(thread_id)
+        self._finish(thread_id, state, turn)
+
+    def _enqueue(self, thread_id, item, coalesce):
+        with self._lock:
+            state = self._threads.get(thread_id)
+            if state is None:
+                state = self._threads[thread_id] = _ThreadState(self._lock)
+            if state.queued >= self.max_depth:
+                THREAD_QUEUE_REJECTED.labels(reason="full").inc()
+                raise ThreadQueueFull("Too many requests in flight for this conversation")
+            if coalesce and state.turns and state.turns[-1].coalesce:
+                turn = state.turns[-1]
+                THREAD_QUEUE_COALESCED.inc()
+            else:
+                turn = _Turn(coalesce)
+                state.turns.append(turn)
+            entry = [item, time.perf_counter()]
+            turn.items.append(entry)
+            state.queued += 1
+            THREAD_QUEUE_DEPTH.inc()
+            return state, turn, entry
+
+    def _wait(self, thread_id, state, turn, entry):
+        """Block until the turn is finished or ready to start. Returns True if the caller runs it."""
+        deadline = entry[1] + self.timeout
+        with self._lock:
+            while True:
+                if turn.done:
+                    return False
+                if not state.running and state.turns and state.turns[0] is turn:
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 and turn in state.turns:
+                    # Still queued, so nobody depends on this request; withdraw it
+                    del turn.items[next(i for i, other in enumerate(turn.items) if other is entry)]
+                    if not turn.items:
+                        state.turns.remove(turn)
+                    state.queued -= 1
+                    THREAD_QUEUE_DEPTH.dec()
+                    self._forget(thread_id, state)
+                    state.cond.notify_all()
+                    THREAD_QUEUE_REJECTED.labels(reason="timeout").inc()
+                    raise ThreadQueueTimeout("Timed out waiting for the previous message in this conversation")
+                state.cond.wait(remaining if remaining > 0 else None)
+
+            state.turns.popleft()
+            state.running = True
+            state.queued -= len(turn.items)
+            THREAD_QUEUE_DEPTH.dec(len(turn.items))
+            started = time.perf_counter()
+            for _, enqueued_at in turn.items:
+                THREAD_QUEUE_WAIT.observe(started - enqueued_at)
+            return True
+
+    def _run(self, thread_id, state, turn, run):
+        try:
+            self._lock_thread(thread_id, turn)
+            try:
+                turn.result = run([item for item, _ in turn.items])
+            finally:
+                self._unlock_thread(thread_id)
+        except Exception as e:
+            turn.error = e
+        finally:
+            self._finish(thread_id, state, turn)
+
+    def _finish(self, thread_id, state, turn):
+        with self._lock:
+            turn.done = True
+            state.running = False
+            self._forget(thread_id, state)
+            state.cond.notify_all()
+
+    def _forget(self, thread_id, state):
+        # Caller holds self._lock
+        if not state.running and not state.turns:
+            self._threads.pop(thread_id, None)
+
+    def _checkout(self):
+        with self._conn_lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    return conn
+        return psycopg.connect(self.conninfo, autocommit=True)
+
+    def _checkin(self, conn):
+        with self._conn_lock:
+            self._idle.append(conn)
+
+    def _try_lock(self, thread_id):
+        conn = self._checkout()
+        try:
+            locked = conn.execute(
+                "SELECT pg_try_advisory_lock(%s, hashtext(%s))", (THREAD_LOCK_NAMESPACE, thread_id)
+            ).fetchone()[0]
+        except psycopg.OperationalError:
+            # Locks die with the session, so a fresh connection starts from a clean slate
+            logger.warning("Thread lock connection lost, reconnecting")
+            conn.close()
+            raise
+        if not locked:
+            self._checkin(conn)
+            return False
+        with self._conn_lock:
+            self._held[thread_id] = conn
+        return True
+
+    def _lock_thread(self, thread_id, turn):
+        """Take the cross-process lock for the thread, polling until THREAD_QUEUE_TIMEOUT."""
+        if self.conninfo is None:
+            return
+        deadline = turn.items[0][1] + self.timeout
+        delay = self.poll_interval
+        while not self._try_lock(thread_id):
+            if time.perf_counter() + delay > deadline:
+                THREAD_QUEUE_REJECTED.labels(reason="timeout").inc()
+                raise ThreadQueueTimeout("Timed out waiting for another worker to finish this conversation's turn")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def _unlock_thread(self, thread_id):
+        if self.conninfo is None:
+            return
+        with self._conn_lock:
+            conn = self._held.pop(thread_id, None)
+        if conn is None:
+            return
+        try:
+            conn.execute("SELECT pg_advisory_unlock(%s, hashtext(%s))", (THREAD_LOCK_NAMESPACE, thread_id))
+        except psycopg.OperationalError as e:
+            # Closing the session releases the lock; it holds no other thread's lock
+            logger.warning(f"Failed to release thread lock for {thread_id}, closing its connection: {str(e)}")
+            conn.close()
+            return
+        self._checkin(conn)
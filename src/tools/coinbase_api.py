@@ -1,35 +1,136 @@
 import os
+import random
+import time
+import asyncio
+import logging
 import requests
+import httpx
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from rate_limit import RateLimited, get_rate_limiter, parse_retry_after
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_WALLET_ID = os.getenv('DEFAULT_WALLET_ID')
 COINBASE_API_URL = os.getenv('COINBASE_API_URL')
 
+# Transport settings for the cdp bridge. Wallet creation and transfers can take a while on the
+# SDK side, so the read timeout is generous; the connect timeout is what keeps workers from
+# hanging when the bridge is down.
+COINBASE_API_CONNECT_TIMEOUT = float(os.getenv('COINBASE_API_CONNECT_TIMEOUT', '3.05'))
+COINBASE_API_READ_TIMEOUT = float(os.getenv('COINBASE_API_READ_TIMEOUT', '60'))
+COINBASE_API_POOL_SIZE = int(os.getenv('COINBASE_API_POOL_SIZE', '10'))
+COINBASE_API_MAX_RETRIES = int(os.getenv('COINBASE_API_MAX_RETRIES', '3'))
+COINBASE_API_BACKOFF_FACTOR = float(os.getenv('COINBASE_API_BACKOFF_FACTOR', '0.25'))
+# A Retry-After longer than this fails the call straight away instead of holding the worker
+COINBASE_API_MAX_RETRY_AFTER = float(os.getenv('COINBASE_API_MAX_RETRY_AFTER', '10'))
+
+# Upstream statuses worth retrying for idempotent calls
+RETRY_STATUS_CODES = {502, 503, 504}
+# A 429 means the request was refused unprocessed, so even transfers can be retried
+RATE_LIMITED_STATUS = 429
+
+
+def _backoff_delay(attempt, backoff_factor):
+    """Full-jitter exponential backoff for the given (zero-based) retry attempt."""
+    return random.uniform(0, backoff_factor * (2 ** attempt))
+
+
+def _throttle(response, method, path, attempt, attempts, backoff_factor, max_retry_after, limiter):
+    """Delay before retrying a 429 or a 503 with Retry-After; raises RateLimited when giving up.
+
+    The Retry-After is shared with every worker through the rate limiter, so they all pause.
+    """
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    if limiter is not None and retry_after:
+        limiter.block("cdp", retry_after)
+    delay = max(retry_after or 0.0, _backoff_delay(attempt, backoff_factor))
+    if response.status_code == RATE_LIMITED_STATUS and (attempt == attempts - 1 or delay > max_retry_after):
+        raise RateLimited("cdp", delay)
+    logger.warning(f"{method} {path} returned {response.status_code}, retrying in {delay:.2f}s")
+    return delay
+
+
 class CoinbaseAPIWrapper:
-    def __init__(self, base_url=COINBASE_API_URL):
+    def __init__(
+        self,
+        base_url=COINBASE_API_URL,
+        connect_timeout=COINBASE_API_CONNECT_TIMEOUT,
+        read_timeout=COINBASE_API_READ_TIMEOUT,
+        pool_size=COINBASE_API_POOL_SIZE,
+        max_retries=COINBASE_API_MAX_RETRIES,
+        backoff_factor=COINBASE_API_BACKOFF_FACTOR,
+        max_retry_after=COINBASE_API_MAX_RETRY_AFTER,
+        limiter=None,
+    ):
         self.base_url = base_url
         self.default_wallet_id = DEFAULT_WALLET_ID
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
+        # Falls back to the process-wide limiter the server installs; None means unlimited
+        self._limiter = limiter
+
+        # Keep-alive connection pool shared by every call made through this wrapper
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def limiter(self):
+        return self._limiter or get_rate_limiter()
+
+    def _request(self, method, path, idempotent=False, **kwargs):
+        """Send a request to the cdp bridge, retrying idempotent calls on transient failures.
+
+        Every attempt takes a token from the `cdp` rate limit bucket first, and 429s are retried
+        (for any call) after their Retry-After, within bounds. Raises RateLimited when the
+        budget is exhausted.
+        """
+        url = f"{self.base_url}{path}"
+        attempts = self.max_retries + 1
+        limiter = self.limiter
+        for attempt in range(attempts):
+            if limiter is not None:
+                limiter.acquire("cdp")
+            retryable = idempotent and attempt < attempts - 1
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code == RATE_LIMITED_STATUS or (response.status_code == 503 and retryable):
+                    delay = _throttle(response, method, path, attempt, attempts, self.backoff_factor, self.max_retry_after, limiter)
+                elif response.status_code in RETRY_STATUS_CODES and retryable:
+                    logger.warning(f"{method} {path} returned {response.status_code}, retrying")
+                    delay = _backoff_delay(attempt, self.backoff_factor)
+                else:
+                    response.raise_for_status()
+                    return response.json()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not retryable:
+                    raise
+                logger.warning(f"{method} {path} failed ({e}), retrying")
+                delay = _backoff_delay(attempt, self.backoff_factor)
+            time.sleep(delay)
+
+    def close(self):
+        """Release pooled connections."""
+        self.session.close()
 
     def create_wallet(self):
         """Create a new wallet."""
-        response = requests.post(f"{self.base_url}/create-wallet")
-        response.raise_for_status()
-        return response.json()
-    
+        return self._request("POST", "/create-wallet")
+
     def get_balance(self, wallet_id):
         """Get the balance of an asset in a wallet by its ID."""
-        response = requests.get(f"{self.base_url}/get-balance/{wallet_id}")
-        response.raise_for_status()
-        return response.json()
+        return self._request("GET", f"/get-balance/{wallet_id}", idempotent=True)
 
     def fund_wallet(self, wallet_id):
         """Fund a wallet with testnet ETH."""
         data = {"walletId": wallet_id}
-        response = requests.post(f"{self.base_url}/fund-wallet", json=data)
-        response.raise_for_status()
-        return response.json()
+        return self._request("POST", "/fund-wallet", json=data)
 
     def transfer_funds(self, source_wallet_id, destination_wallet_address, amount):
         """Transfer funds between wallets."""
@@ -38,9 +139,7 @@ class CoinbaseAPIWrapper:
             "destinationWalletAddress": destination_wallet_address,
             "amount": amount
         }
-        response = requests.post(f"{self.base_url}/transfer-funds", json=data)
-        response.raise_for_status()
-        return response.json()
+        return self._request("POST", "/transfer-funds", json=data)
 
     def trade_assets(self, wallet_id, from_asset_id, to_asset_id, amount):
         """Trade assets within a wallet."""
@@ -48,23 +147,121 @@ class CoinbaseAPIWrapper:
             "walletId": wallet_id,
             "fromAssetId": from_asset_id,
             "toAssetId": to_asset_id,
-            "amount": amount
+            # Always a string: the bridge's JSON.parse would round a large number
+            "amount": str(amount)
         }
-        response = requests.post(f"{self.base_url}/trade-assets", json=data)
-        response.raise_for_status()
-        return response.json()
-    
-    def get_wallets(self):
-        """Get all wallets."""
-        response = requests.get(f"{self.base_url}/get-wallets")
-        response.raise_for_status()
-        return response.json()
-    
+        return self._request("POST", "/trade-assets", json=data)
+
     def get_wallet(self, wallet_id):
         """Get a wallet by ID."""
-        response = requests.get(f"{self.base_url}/get-wallet/{wallet_id}")
-        response.raise_for_status()
-        return response.json()
+        return self._request("GET", f"/get-wallet/{wallet_id}", idempotent=True)
+
+
+class AsyncCoinbaseAPIWrapper:
+    """Asyncio twin of CoinbaseAPIWrapper, used by the tools' `_arun` implementations."""
+
+    def __init__(
+        self,
+        base_url=COINBASE_API_URL,
+        connect_timeout=COINBASE_API_CONNECT_TIMEOUT,
+        read_timeout=COINBASE_API_READ_TIMEOUT,
+        pool_size=COINBASE_API_POOL_SIZE,
+        max_retries=COINBASE_API_MAX_RETRIES,
+        backoff_factor=COINBASE_API_BACKOFF_FACTOR,
+        max_retry_after=COINBASE_API_MAX_RETRY_AFTER,
+        limiter=None,
+    ):
+        self.base_url = base_url
+        self.default_wallet_id = DEFAULT_WALLET_ID
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_retry_after = max_retry_after
+        self._limiter = limiter
+        self._client = None
+        self._client_loop = None
+
+    def _get_client(self):
+        # httpx clients are bound to the event loop they were first used on
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+            self._client_loop = loop
+        return self._client
+
+    @property
+    def limiter(self):
+        return self._limiter or get_rate_limiter()
+
+    async def _request(self, method, path, idempotent=False, **kwargs):
+        """Send a request to the cdp bridge; retries and rate limits as in CoinbaseAPIWrapper._request."""
+        client = self._get_client()
+        attempts = self.max_retries + 1
+        limiter = self.limiter
+        for attempt in range(attempts):
+            if limiter is not None:
+                await limiter.aacquire("cdp")
+            retryable = idempotent and attempt < attempts - 1
+            try:
+                response = await client.request(method, path, **kwargs)
+                if response.status_code == RATE_LIMITED_STATUS or (response.status_code == 503 and retryable):
+                    delay = _throttle(response, method, path, attempt, attempts, self.backoff_factor, self.max_retry_after, limiter)
+                elif response.status_code in RETRY_STATUS_CODES and retryable:
+                    logger.warning(f"{method} {path} returned {response.status_code}, retrying")
+                    delay = _backoff_delay(attempt, self.backoff_factor)
+                else:
+                    response.raise_for_status()
+                    return response.json()
+            except httpx.TransportError as e:
+                if not retryable:
+                    raise
+                logger.warning(f"{method} {path} failed ({e}), retrying")
+                delay = _backoff_delay(attempt, self.backoff_factor)
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        """Release pooled connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def create_wallet(self):
+        """Create a new wallet."""
+        return await self._request("POST", "/create-wallet")
+
+    async def get_balance(self, wallet_id):
+        """Get the balance of an asset in a wallet by its ID."""
+        return await self._request("GET", f"/get-balance/{wallet_id}", idempotent=True)
+
+    async def fund_wallet(self, wallet_id):
+        """Fund a wallet with testnet ETH."""
+        data = {"walletId": wallet_id}
+        return await self._request("POST", "/fund-wallet", json=data)
+
+    async def transfer_funds(self, source_wallet_id, destination_wallet_address, amount):
+        """Transfer funds between wallets."""
+        data = {
+            "sourceWalletId": source_wallet_id,
+            "destinationWalletAddress": destination_wallet_address,
+            "amount": amount
+        }
+        return await self._request("POST", "/transfer-funds", json=data)
+
+    async def trade_assets(self, wallet_id, from_asset_id, to_asset_id, amount):
+        """Trade assets within a wallet."""
+        data = {
+            "walletId": wallet_id,
+            "fromAssetId": from_asset_id,
+            "toAssetId": to_asset_id,
+            # Always a string: the bridge's JSON.parse would round a large number
+            "amount": str(amount)
+        }
+        return await self._request("POST", "/trade-assets", json=data)
+
+    async def get_wallet(self, wallet_id):
+        """Get a wallet by ID."""
+        return await self._request("GET", f"/get-wallet/{wallet_id}", idempotent=True)
 
 # # Usage example:
 # if __name__ == "__main__":
@@ -91,4 +288,4 @@ class CoinbaseAPIWrapper:
 #         print("Traded assets:", trade)
 #
 #     except requests.exceptions.RequestException as e:
-#         print("An error occurred:", e)
\ No newline at end of file
+#         print("An error occurred:", e)
@@ -0,0 +1,6 @@
+from contextvars import ContextVar
+from typing import Optional
+
+# The user whose request is being served. The server sets this around each agent run; it follows
+# the run into the tool executor threads and tasks because LangChain copies the context.
+current_user_id: ContextVar[Optional[str]] = ContextVar("current_user_id", default=None)
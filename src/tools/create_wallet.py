@@ -1,11 +1,10 @@
-from typing import Optional, Type, Dict, Any
-from json import dumps
-from langchain_core.callbacks import CallbackManagerForToolRun
+from typing import Optional
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 from langchain_core.tools import BaseTool
-from tools.coinbase_api import CoinbaseAPIWrapper
+from tools.coinbase_api import AsyncCoinbaseAPIWrapper, CoinbaseAPIWrapper
+from tools.projection import CREATE_WALLET, truncate
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class CreateWalletTool(BaseTool):
@@ -13,10 +12,14 @@ class CreateWalletTool(BaseTool):
     description = "Generate a new Ethereum wallet and return the address and wallet ID"
     return_direct: bool = True
     api: CoinbaseAPIWrapper = None
+    async_api: AsyncCoinbaseAPIWrapper = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.api = CoinbaseAPIWrapper()
+        if self.api is None:
+            self.api = CoinbaseAPIWrapper()
+        if self.async_api is None:
+            self.async_api = AsyncCoinbaseAPIWrapper()
 
     def _run(
         self,
@@ -27,18 +30,29 @@ class CreateWalletTool(BaseTool):
             logger.info("Creating a new Ethereum wallet...")
             # API Saves the wallet's sensitive information, so we don't need to return it here.
             result = self.api.create_wallet()
-            wallet = self.api.get_wallet(result["walletId"])
-            logger.info(f"Wallet created successfully: {result}") 
-            ret = {
-                "message": result["message"],
-                "address": wallet["wallet"]["addresses"][0]["id"],
-                "wallet_id": result["walletId"]
-            }
-            logger.info(f"Returning wallet information: {ret}")
-            return dumps(ret)
+            return self._result(result, self.api.get_wallet(result["walletId"]))
         except Exception as e:
-            logger.error(f"Failed to create wallet: {str(e)}")
-            return {"error": f"Failed to create wallet: {str(e)}"}
+            return self._failure(e)
+
+    async def _arun(
+        self,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments
+    ) -> dict:
+        try:
+            logger.info("Creating a new Ethereum wallet...")
+            result = await self.async_api.create_wallet()
+            return self._result(result, await self.async_api.get_wallet(result["walletId"]))
+        except Exception as e:
+            return self._failure(e)
+
+    def _result(self, result, wallet):
+        logger.info("Wallet created successfully: %s", result["walletId"])
+        return CREATE_WALLET.dumps({**result, "wallet": wallet["wallet"]})
+
+    def _failure(self, error) -> dict:
+        logger.error(f"Failed to create wallet: {str(error)}")
+        return {"error": f"Failed to create wallet: {truncate(str(error))}"}
 
 # Usage example:
 if __name__ == "__main__":
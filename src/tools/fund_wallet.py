@@ -1,12 +1,12 @@
 from typing import Optional, Type
-from json import dumps
 from langchain.pydantic_v1 import BaseModel, Field
-from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 from langchain_core.tools import BaseTool
-from tools.coinbase_api import CoinbaseAPIWrapper, DEFAULT_WALLET_ID
+from tools.coinbase_api import AsyncCoinbaseAPIWrapper, CoinbaseAPIWrapper, DEFAULT_WALLET_ID
+from tools.projection import FUND_WALLET, truncate
+from balances import BalanceCache
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class FundWalletInput(BaseModel):
@@ -18,10 +18,16 @@ class FundWalletTool(BaseTool):
     args_schema: Type[BaseModel] = FundWalletInput
     return_direct: bool = True
     api: CoinbaseAPIWrapper = None
+    async_api: AsyncCoinbaseAPIWrapper = None
+    # Faucet responses don't say which address was funded, so every cached balance is dropped
+    balances: BalanceCache = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.api = CoinbaseAPIWrapper()  # Initialize our API wrapper
+        if self.api is None:
+            self.api = CoinbaseAPIWrapper()  # Initialize our API wrapper
+        if self.async_api is None:
+            self.async_api = AsyncCoinbaseAPIWrapper()
 
     def _run(
         self,
@@ -30,13 +36,32 @@ class FundWalletTool(BaseTool):
         **kwargs  # Absorbs any unexpected keyword arguments
     ) -> str:
         try:
-            logger.info(f"Funding wallet with ID: {wallet_id}")
-            result = self.api.fund_wallet(wallet_id)
-            logger.info(f"Wallet funded successfully: {result}")
-            return dumps(result)
+            logger.info("Funding wallet with ID: %s", wallet_id)
+            return self._result(self.api.fund_wallet(wallet_id))
         except Exception as e:
-            logger.error(f"Funding failed for wallet ID {wallet_id}: {str(e)}")
-            return f"Funding failed: {str(e)}"
+            return self._failure(e, wallet_id)
+
+    async def _arun(
+        self,
+        wallet_id: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments
+    ) -> str:
+        try:
+            logger.info("Funding wallet with ID: %s", wallet_id)
+            return self._result(await self.async_api.fund_wallet(wallet_id))
+        except Exception as e:
+            return self._failure(e, wallet_id)
+
+    def _result(self, result) -> str:
+        if self.balances is not None:
+            self.balances.invalidate()
+        logger.debug("Wallet funded: %s", result, extra={"payload": True})
+        return FUND_WALLET.dumps(result)
+
+    def _failure(self, error, wallet_id) -> str:
+        logger.error(f"Funding failed for wallet ID {wallet_id}: {str(error)}")
+        return f"Funding failed: {truncate(str(error))}"
 
 # Usage example:
 if __name__ == "__main__":
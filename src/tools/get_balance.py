@@ -1,67 +1,131 @@
-from typing import Optional, Type, Dict, Any
+from typing import Optional, Type, Dict, Any, List
+import requests
 from web3 import Web3
-from langchain.pydantic_v1 import BaseModel, Field
+from web3.exceptions import Web3TypeError
+from langchain.pydantic_v1 import BaseModel, Field, root_validator
 from langchain_core.callbacks import CallbackManagerForToolRun
 from langchain_core.tools import BaseTool
+from balances import BalanceCache
+from rpc_pool import RPCPool
+from pricing import QuoteCache, from_base_units, quote_value
 import logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class GetWalletBalanceInput(BaseModel):
-    wallet_address: str = Field(description="The Ethereum wallet address to check the balance for")
+    wallet_address: Optional[str] = Field(None, description="The Ethereum wallet address to check the balance for")
+    wallet_addresses: Optional[List[str]] = Field(None, description="Several Ethereum wallet addresses to check in one request")
+
+    @root_validator(skip_on_failure=True)
+    def check_addresses(cls, values):
+        if not values.get("wallet_address") and not values.get("wallet_addresses"):
+            raise ValueError("Provide wallet_address or wallet_addresses")
+        return values
 
 class GetWalletBalanceOutput(BaseModel):
     address: str
     balance_eth: float
     balance_wei: int
+    # Only present when the tool has a quote cache and ETH-USD is cached
+    balance_usd: Optional[str] = None
+    eth_usd_price: Optional[str] = None
 
 class GetWalletBalanceTool(BaseTool):
     name = "GetWalletBalance"
-    description = "Retrieve the ETH balance of a specified wallet address using web3.py"
+    description = "Retrieve the ETH balance of one wallet address, or of several addresses at once, using web3.py"
     args_schema: Type[BaseModel] = GetWalletBalanceInput
     return_direct: bool = True
-    web3_provider_url: str = Field(..., description="The URL of the Ethereum node to connect to")
+    web3_provider_url: Optional[str] = Field(None, description="The URL of the Ethereum node to connect to")
+    web3_provider_urls: Optional[List[str]] = Field(None, description="Several node URLs to pool, hedging slow reads across them")
     web3: Web3 = None
+    # When set, balances are also valued in USD from whatever price is cached; never fetched inline
+    quotes: QuoteCache = None
+    # Balances keyed on (address, block number); the registry shares one with the tools that
+    # move funds, so they can invalidate it
+    balances: BalanceCache = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        if self.balances is None:
+            self.balances = BalanceCache()
         self._initialize_web3()
 
     def _initialize_web3(self):
+        if self.web3_provider_urls:
+            # The pool fails over by itself; rebuilding it would only throw away its health stats
+            if self.web3 is None:
+                self.web3 = Web3(RPCPool(self.web3_provider_urls))
+            return
         self.web3 = Web3(Web3.HTTPProvider(self.web3_provider_url))
 
-    def _ensure_connection(self):
-        if not self.web3 or not self.web3.is_connected():
+    def _with_reconnect(self, call):
+        # No liveness probe up front: a failed request is what triggers a reconnect
+        try:
+            return call()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
             logger.info("Reconnecting to Ethereum node...")
             self._initialize_web3()
-        if not self.web3.is_connected():
-            raise ConnectionError("Failed to connect to the Ethereum node.")
+            try:
+                return call()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                raise ConnectionError("Failed to connect to the Ethereum node.") from e
+
+    def _fetch_balances(self, addresses: List[str], block: int) -> List[int]:
+        if len(addresses) == 1:
+            return [self.web3.eth.get_balance(addresses[0], block)]
+        try:
+            # One JSON-RPC batch for all addresses
+            with self.web3.batch_requests() as batch:
+                for address in addresses:
+                    batch.add(self.web3.eth.get_balance(address, block))
+                return batch.execute()
+        except Web3TypeError:
+            # Provider doesn't support batching (e.g. in-process test providers)
+            return [self.web3.eth.get_balance(address, block) for address in addresses]
+
+    def get_balances(self, wallet_addresses: List[str]) -> List[Dict[str, Any]]:
+        # Normalize the addresses
+        addresses = [self.web3.to_checksum_address(address) for address in wallet_addresses]
+        generation = self.balances.generation
+        # One eth_blockNumber shared by every lookup in the process, at most once per BALANCE_HEAD_TTL
+        block = self.balances.head(lambda: self._with_reconnect(lambda: self.web3.eth.block_number))
+
+        balances = {address: self.balances.get(address, block) for address in addresses}
+        misses = [address for address, balance in balances.items() if balance is None]
+        if misses:
+            fetched = self._with_reconnect(lambda: self._fetch_balances(misses, block))
+            for address, balance_wei in zip(misses, fetched):
+                self.balances.set(address, block, balance_wei, generation)
+                balances[address] = balance_wei
+
+        quote = self.quotes.cached("ETH", "USD") if self.quotes is not None else None
+
+        # Convert each balance from Wei to Ether
+        return [
+            GetWalletBalanceOutput(
+                address=address,
+                balance_eth=float(self.web3.from_wei(balances[address], 'ether')),
+                balance_wei=balances[address],
+                balance_usd=quote_value(from_base_units(balances[address]), quote) if quote else None,
+                eth_usd_price=format(quote.price, "f") if quote else None,
+            ).dict(exclude_none=True)
+            for address in addresses
+        ]
 
     def _run(
         self,
-        wallet_address: str,
+        wallet_address: Optional[str] = None,
+        wallet_addresses: Optional[List[str]] = None,
         run_manager: Optional[CallbackManagerForToolRun] = None,
         **kwargs  # Absorbs any unexpected keyword arguments
     ) -> Dict[str, Any]:
         try:
-            self._ensure_connection()
-
-            # Normalize the address
-            normalized_address = self.web3.to_checksum_address(wallet_address)
-
-            # Get the balance and convert it from Wei to Ether
-            balance_wei = self.web3.eth.get_balance(normalized_address)
-            balance_eth = self.web3.from_wei(balance_wei, 'ether')
-            
-            return GetWalletBalanceOutput(
-                address=normalized_address,
-                balance_eth=float(balance_eth),
-                balance_wei=balance_wei
-            ).dict()
+            if wallet_addresses:
+                return {"balances": self.get_balances(wallet_addresses)}
+            return self.get_balances([wallet_address])[0]
         except ValueError as ve:
-            logger.error(f"Invalid Ethereum address: {wallet_address}")
-            raise ValueError(f"Invalid Ethereum address: {wallet_address}") from ve
+            logger.error(f"Invalid Ethereum address: {wallet_address or wallet_addresses}")
+            raise ValueError(f"Invalid Ethereum address: {wallet_address or wallet_addresses}") from ve
         except ConnectionError as ce:
             logger.error(f"Connection error: {str(ce)}")
             raise
@@ -78,4 +142,4 @@ if __name__ == "__main__":
         print(f"Balance: {result['balance_eth']} ETH")
         print(f"Balance in Wei: {result['balance_wei']}")
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
\ No newline at end of file
+        print(f"An error occurred: {str(e)}")
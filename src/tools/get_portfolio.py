@@ -0,0 +1,165 @@
+import os
+from decimal import Decimal
+from typing import Callable, Optional, Type, Dict, Any, List, Tuple
+from eth_abi import decode, encode
+from web3 import Web3
+from web3.exceptions import Web3TypeError
+from langchain.pydantic_v1 import BaseModel, Field, PrivateAttr
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+from tools.context import current_user_id
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Multicall3 is deployed at the same address on Base, Base Sepolia and most other EVM chains.
+# Point MULTICALL3_ADDRESS at your own deployment on a local dev chain, or leave it unset there
+# and the tool falls back to batched per-address reads.
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+# Calls per aggregate3 eth_call; keeps each call under provider gas/response-size limits
+MULTICALL_CHUNK_SIZE = int(os.getenv("MULTICALL_CHUNK_SIZE", "500"))
+# ERC-20s to include, as comma-separated SYMBOL:address:decimals entries
+PORTFOLIO_TOKENS = os.getenv("PORTFOLIO_TOKENS", "USDC:0x036CbD53842c5426634e7929541eC2318f3dCF7e:6")
+
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")  # aggregate3((address,bool,bytes)[])
+GET_ETH_BALANCE_SELECTOR = bytes.fromhex("4d2301cc")  # getEthBalance(address)
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")  # balanceOf(address)
+
+
+def parse_tokens(spec: str) -> List[Tuple[str, str, int]]:
+    """Parse PORTFOLIO_TOKENS into (symbol, checksum address, decimals) tuples."""
+    tokens = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        symbol, address, decimals = entry.split(":")
+        tokens.append((symbol, Web3.to_checksum_address(address), int(decimals)))
+    return tokens
+
+
+class GetPortfolioInput(BaseModel):
+    pass
+
+class GetPortfolioTool(BaseTool):
+    name = "GetPortfolio"
+    description = "Summarize the ETH and ERC-20 token holdings of the customer's own wallet"
+    args_schema: Type[BaseModel] = GetPortfolioInput
+    return_direct: bool = True
+    web3_provider_url: str = Field(..., description="The URL of the Ethereum node to connect to")
+    multicall_address: Optional[str] = MULTICALL3_ADDRESS
+    chunk_size: int = MULTICALL_CHUNK_SIZE
+    tokens: List[Tuple[str, str, int]] = None
+    web3: Web3 = None
+    # user_id -> (wallet_id, address) of that user's wallet, or None. Only the caller's own wallet
+    # is ever read; the cdp wallet listing covers every user and is never exposed to the model.
+    wallet_lookup: Optional[Callable[[str], Optional[Tuple[str, str]]]] = None
+
+    _has_multicall: Optional[bool] = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.tokens is None:
+            self.tokens = parse_tokens(PORTFOLIO_TOKENS)
+        if self.web3 is None:
+            self.web3 = Web3(Web3.HTTPProvider(self.web3_provider_url))
+
+    def _own_wallet(self) -> Optional[Dict[str, str]]:
+        user_id = current_user_id.get()
+        if user_id is None or self.wallet_lookup is None:
+            return None
+        wallet = self.wallet_lookup(user_id)
+        if wallet is None:
+            return None
+        wallet_id, address = wallet
+        return {"wallet_id": wallet_id, "address": address}
+
+    def _multicall_available(self) -> bool:
+        if self._has_multicall is None:
+            self._has_multicall = bool(self.multicall_address) and len(self.web3.eth.get_code(self.multicall_address)) > 0
+            if not self._has_multicall:
+                logger.info("Multicall3 not deployed on this chain; using batched per-address reads")
+        return self._has_multicall
+
+    def _batch(self, requests: List[Any]) -> List[Any]:
+        """Send already-built web3 calls as a single JSON-RPC batch when the provider supports it."""
+        try:
+            with self.web3.batch_requests() as batch:
+                for method, args in requests:
+                    batch.add(method(*args))
+                return batch.execute()
+        except Web3TypeError:
+            return [method(*args) for method, args in requests]
+
+    def _read_multicall(self, calls: List[Tuple[str, bytes]], block: int) -> List[Optional[int]]:
+        chunks = [calls[i:i + self.chunk_size] for i in range(0, len(calls), self.chunk_size)]
+        requests = []
+        for chunk in chunks:
+            data = AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [[(target, True, call_data) for target, call_data in chunk]])
+            requests.append((self.web3.eth.call, ({"to": self.multicall_address, "data": data}, block)))
+
+        values = []
+        for raw in self._batch(requests):
+            (results,) = decode(["(bool,bytes)[]"], bytes(raw))
+            values.extend(decode(["uint256"], data)[0] if success and len(data) == 32 else None for success, data in results)
+        return values
+
+    def _read_direct(self, calls: List[Tuple[str, bytes]], block: int) -> List[Optional[int]]:
+        requests = []
+        for target, call_data in calls:
+            if call_data[:4] == GET_ETH_BALANCE_SELECTOR:
+                address = Web3.to_checksum_address(decode(["address"], call_data[4:])[0])
+                requests.append((self.web3.eth.get_balance, (address, block)))
+            else:
+                requests.append((self.web3.eth.call, ({"to": target, "data": call_data}, block)))
+        values = []
+        for raw in self._batch(requests):
+            if isinstance(raw, int):
+                values.append(raw)
+            else:
+                values.append(decode(["uint256"], bytes(raw))[0] if len(raw) == 32 else None)
+        return values
+
+    def get_portfolio(self, wallets: List[Dict[str, str]]) -> Dict[str, Any]:
+        # Every read is pinned to one block so the snapshot is consistent
+        block = self.web3.eth.block_number
+        calls = []
+        for wallet in wallets:
+            owner = encode(["address"], [Web3.to_checksum_address(wallet["address"])])
+            calls.append((self.multicall_address, GET_ETH_BALANCE_SELECTOR + owner))
+            calls.extend((token_address, BALANCE_OF_SELECTOR + owner) for _, token_address, _ in self.tokens)
+
+        if self._multicall_available():
+            values = self._read_multicall(calls, block)
+        else:
+            values = self._read_direct(calls, block)
+
+        holdings = []
+        per_wallet = 1 + len(self.tokens)
+        for i, wallet in enumerate(wallets):
+            eth_wei, *token_units = values[i * per_wallet:(i + 1) * per_wallet]
+            holdings.append({
+                **wallet,
+                "eth": format(Web3.from_wei(eth_wei, "ether"), "f") if eth_wei is not None else None,
+                "tokens": {
+                    symbol: format(Decimal(units).scaleb(-decimals), "f") if units is not None else None
+                    for (symbol, _, decimals), units in zip(self.tokens, token_units)
+                },
+            })
+        return {"block": block, "wallets": holdings}
+
+    def _run(
+        self,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments, including addresses the model made up
+    ) -> Dict[str, Any]:
+        try:
+            wallet = self._own_wallet()
+            if wallet is None:
+                return {"error": "No wallet found for this customer"}
+            return self.get_portfolio([wallet])
+        except Exception as e:
+            logger.error(f"Failed to retrieve portfolio: {str(e)}")
+            raise
+
+# Usage example:
+if __name__ == "__main__":
+    tool = GetPortfolioTool(web3_provider_url=os.getenv("WEB3_PROVIDER_URL"))
+    print(tool.get_portfolio([{"address": "your_wallet_address_here"}]))
@@ -0,0 +1,95 @@
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Optional, Type
+from json import dumps
+from langchain.pydantic_v1 import BaseModel, Field
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+from tools.projection import truncate
+from pricing import PriceUnavailable, QuoteCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+class GetQuoteInput(BaseModel):
+    base: str = Field(description="The asset/token symbol to price (e.g. ETH)")
+    quote: str = Field("USD", description="The currency or asset to price it in (e.g. USD, USDC)")
+    amount: Optional[str] = Field(None, description="Optional amount of the base asset to value (as a string, e.g., '0.1')")
+
+class GetQuoteTool(BaseTool):
+    name = "GetQuote"
+    description = (
+        "Get the current price of an asset/token in another currency or asset, and optionally what an "
+        "amount of it is worth. Use it to preview a trade or show USD values; prices are cached for a few seconds"
+    )
+    args_schema: Type[BaseModel] = GetQuoteInput
+    return_direct: bool = True
+    quotes: QuoteCache = None
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.quotes is None:
+            self.quotes = QuoteCache.from_env()  # Fetch-on-miss only; the server passes a shared, refreshed one
+
+    def _format(self, quote, amount: Optional[str]) -> str:
+        output = {
+            "base": quote.base,
+            "quote": quote.quote,
+            "price": format(quote.price, "f"),
+            "source": quote.source,
+            "age_seconds": round(max(time.time() - quote.as_of, 0.0), 1),
+        }
+        if amount is not None:
+            output["amount"] = amount
+            output["value"] = format(Decimal(amount) * quote.price, "f")
+        return dumps(output, separators=(",", ":"))
+
+    def _check_amount(self, amount: Optional[str]) -> Optional[str]:
+        if amount is None:
+            return None
+        try:
+            if Decimal(amount).is_finite():
+                return None
+        except InvalidOperation:
+            pass
+        return f"Invalid amount: {truncate(amount)}"
+
+    def _run(
+        self,
+        base: str,
+        quote: str = "USD",
+        amount: Optional[str] = None,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments
+    ) -> str:
+        error = self._check_amount(amount)
+        if error:
+            return error
+        try:
+            return self._format(self.quotes.get(base, quote), amount)
+        except PriceUnavailable as e:
+            logger.warning(f"No price for {base}-{quote}: {str(e)}")
+            return f"Price unavailable for {base}-{quote}"
+        except Exception as e:
+            logger.error(f"Failed to get {base}-{quote} quote: {str(e)}")
+            return f"Failed to get quote: {truncate(str(e))}"
+
+    async def _arun(
+        self,
+        base: str,
+        quote: str = "USD",
+        amount: Optional[str] = None,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments
+    ) -> str:
+        error = self._check_amount(amount)
+        if error:
+            return error
+        try:
+            return self._format(await self.quotes.aget(base, quote), amount)
+        except PriceUnavailable as e:
+            logger.warning(f"No price for {base}-{quote}: {str(e)}")
+            return f"Price unavailable for {base}-{quote}"
+        except Exception as e:
+            logger.error(f"Failed to get {base}-{quote} quote: {str(e)}")
+            return f"Failed to get quote: {truncate(str(e))}"
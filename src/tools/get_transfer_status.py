@@ -0,0 +1,60 @@
+import asyncio
+from typing import Optional, Type
+from json import dumps
+from langchain.pydantic_v1 import BaseModel, Field
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+from tools.context import current_user_id
+from tools.projection import truncate
+from transfer_jobs import TransferJobQueue
+import logging
+
+logger = logging.getLogger(__name__)
+
+class GetTransferStatusInput(BaseModel):
+    job_id: str = Field(description="The job ID returned when the transfer or trade was queued")
+
+class GetTransferStatusTool(BaseTool):
+    name = "GetTransferStatus"
+    description = "Check the progress of a queued transfer or trade, including its on-chain receipt"
+    args_schema: Type[BaseModel] = GetTransferStatusInput
+    return_direct: bool = True
+    jobs: TransferJobQueue = None
+
+    def _status(self, job_id: str) -> str:
+        # Only the caller's own jobs; another user's job id reads as unknown
+        user_id = current_user_id.get()
+        job = self.jobs.get(job_id, user_id) if user_id is not None else None
+        if job is None:
+            return f"No transfer job with ID {job_id}"
+        # The receipt tracker resolves jobs once per block; look directly if it hasn't yet
+        if job["status"] == "submitted":
+            receipt = self.jobs.receipt(job["transaction_hash"])
+            if receipt is not None:
+                job["status"] = "confirmed" if receipt["status"] == 1 else "reverted"
+                job["block_number"] = receipt["blockNumber"]
+        return dumps(job, separators=(",", ":"))
+
+    def _run(
+        self,
+        job_id: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments
+    ) -> str:
+        try:
+            return self._status(job_id)
+        except Exception as e:
+            logger.error(f"Failed to get status of job {job_id}: {str(e)}")
+            return f"Failed to get transfer status: {truncate(str(e))}"
+
+    async def _arun(
+        self,
+        job_id: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments
+    ) -> str:
+        try:
+            return await asyncio.to_thread(self._status, job_id)
+        except Exception as e:
+            logger.error(f"Failed to get status of job {job_id}: {str(e)}")
+            return f"Failed to get transfer status: {truncate(str(e))}"
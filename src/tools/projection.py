@@ -0,0 +1,108 @@
+import os
+import json
+from typing import Any, Dict
+from metrics import TOOL_OUTPUT_BYTES
+
+# Longest string kept in a tool result; the rest is replaced by a marker saying how much was cut
+TOOL_OUTPUT_MAX_STRING = int(os.getenv("TOOL_OUTPUT_MAX_STRING", "256"))
+
+_MISSING = object()
+
+
+def truncate(value: str, limit: int = TOOL_OUTPUT_MAX_STRING) -> str:
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}...[{len(value) - limit} more chars]"
+
+
+def resolve(response: Any, path: str, default: Any = None) -> Any:
+    """Follow a dotted path (`transfer.model.status`, `wallet.addresses.0.id`) into a response.
+
+    Returns `default` when any part of the path is missing.
+    """
+    value = response
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return default
+        if value is _MISSING:
+            return default
+    return value
+
+
+def _cap(value: Any, limit: int) -> Any:
+    if isinstance(value, str):
+        return truncate(value, limit)
+    if isinstance(value, dict):
+        return {key: _cap(item, limit) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_cap(item, limit) for item in value]
+    return value
+
+
+class Projection:
+    """Declares which fields of a cdp response a tool hands back to the model.
+
+    `fields` maps output keys to dotted paths in the raw response. Anything not listed (signed
+    and unsigned payloads, nested network metadata) never reaches the prompt or the checkpoint,
+    and strings are capped at `max_string` characters. Missing fields are left out.
+    """
+
+    def __init__(self, tool: str, fields: Dict[str, str], max_string: int = TOOL_OUTPUT_MAX_STRING):
+        self.tool = tool
+        self.fields = fields
+        self.max_string = max_string
+
+    def project(self, response: Any, **extra) -> Dict[str, Any]:
+        projected = {}
+        for key, path in self.fields.items():
+            value = resolve(response, path)
+            if value is not None:
+                projected[key] = _cap(value, self.max_string)
+        projected.update(extra)
+        return projected
+
+    def dumps(self, response: Any, **extra) -> str:
+        """Project and serialize compactly; `extra` adds fields the tool already knows."""
+        output = json.dumps(self.project(response, **extra), separators=(",", ":"))
+        TOOL_OUTPUT_BYTES.labels(tool=self.tool).observe(len(output))
+        return output
+
+
+CREATE_WALLET = Projection("CreateWallet", {
+    "message": "message",
+    "address": "wallet.addresses.0.id",
+    "wallet_id": "walletId",
+})
+
+FUND_WALLET = Projection("FundWallet", {
+    "message": "message",
+    "status": "transaction.model.status",
+    "transaction_hash": "transaction.model.transaction_hash",
+    "transaction_link": "transaction.model.transaction_link",
+})
+
+TRANSFER_FUNDS = Projection("CreateTransfer", {
+    "message": "message",
+    "transfer_id": "transfer.model.transfer_id",
+    "status": "transfer.model.status",
+    "asset": "transfer.model.asset_id",
+    "from_address": "transfer.model.address_id",
+    "to_address": "transfer.model.destination",
+    "transaction_hash": "transfer.model.transaction.transaction_hash",
+    "transaction_link": "transfer.model.transaction.transaction_link",
+})
+
+TRADE_ASSETS = Projection("TradeAssets", {
+    "message": "message",
+    "trade_id": "trade.model.trade_id",
+    "from_asset": "trade.model.from_asset.asset_id",
+    "from_amount": "trade.model.from_amount",
+    "to_asset": "trade.model.to_asset.asset_id",
+    "to_amount": "trade.model.to_amount",
+    "status": "trade.model.transaction.status",
+    "transaction_hash": "trade.model.transaction.transaction_hash",
+})
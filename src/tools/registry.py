@@ -0,0 +1,117 @@
+import os
+import time
+import logging
+import threading
+from importlib import import_module
+from balances import BalanceCache
+from tools.coinbase_api import AsyncCoinbaseAPIWrapper, CoinbaseAPIWrapper
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated list of JSON-RPC endpoints; when set, balance reads are spread and hedged across them
+WEB3_PROVIDER_URLS = [url.strip() for url in os.getenv("WEB3_PROVIDER_URLS", "").split(",") if url.strip()]
+
+
+class ToolRegistry:
+    """Imports and builds tools on first use.
+
+    Tool modules pull in web3 and the langchain tool machinery, so importing and constructing all
+    of them up front is most of a worker's cold start. Each tool is registered by name with the
+    module and class that implement it; `get` imports the module and builds the tool the first
+    time it is asked for. Every tool built here shares one pair of cdp API wrappers, so they also
+    share one keep-alive connection pool.
+    """
+
+    def __init__(self, api=None, async_api=None):
+        self._api = api
+        self._async_api = async_api
+        self._specs = {}
+        self._tools = {}
+        self._lock = threading.RLock()
+
+    @property
+    def api(self):
+        with self._lock:
+            if self._api is None:
+                self._api = CoinbaseAPIWrapper()
+            return self._api
+
+    @property
+    def async_api(self):
+        with self._lock:
+            if self._async_api is None:
+                self._async_api = AsyncCoinbaseAPIWrapper()
+            return self._async_api
+
+    def register(self, name, module, class_name, **kwargs):
+        """Declare a tool; `kwargs` are passed to its constructor when it is first built."""
+        self._specs[name] = (module, class_name, kwargs)
+
+    def get(self, name):
+        tool = self._tools.get(name)
+        if tool is not None:
+            return tool
+        with self._lock:
+            if name not in self._tools:
+                self._tools[name] = self._build(name)
+            return self._tools[name]
+
+    def __contains__(self, name):
+        return name in self._specs
+
+    def tools(self, names):
+        return [self.get(name) for name in names]
+
+    def built(self):
+        return list(self._tools)
+
+    def _build(self, name):
+        module, class_name, kwargs = self._specs[name]
+        start = time.perf_counter()
+        cls = getattr(import_module(module), class_name)
+        kwargs = dict(kwargs)
+        if "api" in cls.__fields__:
+            kwargs.setdefault("api", self.api)
+        if "async_api" in cls.__fields__:
+            kwargs.setdefault("async_api", self.async_api)
+        tool = cls(**kwargs)
+        logger.info(f"Built tool {name} in {(time.perf_counter() - start) * 1000:.1f}ms")
+        return tool
+
+
+def default_registry(api=None, spend_ledger=None, transfer_jobs=None, quotes=None, wallet_lookup=None, balances=None):
+    """The registry behind the agent, with every tool in ./tools.
+
+    GetTransferStatus is only registered when `transfer_jobs` is enabled. Balances and trades
+    are only valued in USD when a shared `quotes` cache is passed. GetPortfolio reads the
+    caller's wallet through `wallet_lookup` (user_id -> (wallet_id, address)) and finds none
+    without it. GetWalletBalance shares one `balances` cache (a new one unless passed) with the
+    tools that move funds, which invalidate it.
+    """
+    web3_provider_url = os.getenv("WEB3_PROVIDER_URL")
+    ledger = {"spend_ledger": spend_ledger} if spend_ledger is not None else {}
+    jobs = {"jobs": transfer_jobs} if transfer_jobs is not None else {}
+    pricing = {"quotes": quotes} if quotes is not None else {}
+    balances = {"balances": balances if balances is not None else BalanceCache()}
+
+    registry = ToolRegistry(api=api)
+    registry.register("CreateWallet", "tools.create_wallet", "CreateWalletTool")
+    registry.register("FundWallet", "tools.fund_wallet", "FundWalletTool", **balances)
+    registry.register("CreateTransfer", "tools.transfer_funds", "TransferFundsTool", **ledger, **jobs, **balances)
+    registry.register("TradeAssets", "tools.trade_assets", "TradeAssetsTool", **ledger, **jobs, **pricing, **balances)
+    registry.register(
+        "GetWalletBalance",
+        "tools.get_balance",
+        "GetWalletBalanceTool",
+        web3_provider_url=web3_provider_url,
+        web3_provider_urls=WEB3_PROVIDER_URLS or None,
+        **pricing,
+        **balances,
+    )
+    registry.register("GetQuote", "tools.get_quote", "GetQuoteTool", **pricing)
+    registry.register(
+        "GetPortfolio", "tools.get_portfolio", "GetPortfolioTool", web3_provider_url=web3_provider_url, wallet_lookup=wallet_lookup
+    )
+    if transfer_jobs is not None and transfer_jobs.enabled:
+        registry.register("GetTransferStatus", "tools.get_transfer_status", "GetTransferStatusTool", jobs=transfer_jobs)
+    return registry
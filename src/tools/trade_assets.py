@@ -1,38 +1,143 @@
-from typing import Optional, Type
+import asyncio
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Optional, Type
+from json import dumps
 from langchain.pydantic_v1 import BaseModel, Field
-from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 from langchain_core.tools import BaseTool
-from tools.coinbase_api import CoinbaseAPIWrapper  
+from tools.coinbase_api import AsyncCoinbaseAPIWrapper, CoinbaseAPIWrapper
+from tools.context import current_user_id
+from tools.projection import TRADE_ASSETS, resolve, truncate
+from balances import BalanceCache
+from pricing import QuoteCache, asset_decimals, to_trade_amount
+from spend_policy import SpendLedger, SpendPolicy, SpendPolicyViolation
+
+if TYPE_CHECKING:
+    from transfer_jobs import TransferJobQueue
+else:
+    # The job queue's module loads the SQLAlchemy models; building the tool shouldn't
+    TransferJobQueue = Any
 
 class TradeAssetsInput(BaseModel):
     amount: str = Field(description="The amount of the asset/token to trade (as a string, e.g., '0.1')")
     asset_from: str = Field(description="The asset/token symbol to trade from (e.g. USDC, ETH)")
     asset_to: str = Field(description="The asset/token symbol to trade to (e.g. USDC, ETH)")
+    idempotency_key: Optional[str] = Field(None, description="Optional key; repeating a request with the same key never trades twice")
 
 class TradeAssetsTool(BaseTool):
     name = "TradeAssets"
     description = "Trade one asset/token for another asset/token within a specified wallet"
     args_schema: Type[BaseModel] = TradeAssetsInput
     return_direct: bool = True
+    api: CoinbaseAPIWrapper = None
+    async_api: AsyncCoinbaseAPIWrapper = None
+    spend_ledger: SpendLedger = None
+    # When set and enabled, trades are queued and run in the background
+    jobs: TransferJobQueue = None
+    # When set, a successful trade also reports the cached price it was expected to fill at
+    quotes: QuoteCache = None
+    # The trading address's cached balance is dropped once a trade goes through
+    balances: BalanceCache = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.api = CoinbaseAPIWrapper()  # Initialize our API wrapper
+        if self.api is None:
+            self.api = CoinbaseAPIWrapper()  # Initialize our API wrapper
+        if self.async_api is None:
+            self.async_api = AsyncCoinbaseAPIWrapper()
+        if self.spend_ledger is None:
+            self.spend_ledger = SpendLedger(SpendPolicy.load())  # In-memory only; the server passes a shared one
 
     def _run(
         self,
         amount: str,
         asset_from: str,
         asset_to: str,
+        idempotency_key: Optional[str] = None,
         run_manager: Optional[CallbackManagerForToolRun] = None,
         **kwargs  # Absorbs any unexpected keyword arguments
     ) -> str:
         try:
-            amount = int(float(amount) * 1e18)
-            result = self.api.trade_assets(self.api.default_wallet_id, asset_from, asset_to, amount)
-            return f"Trade successful: {result}"
+            trade_amount = to_trade_amount(amount, asset_decimals(asset_from))
+            reservation = self.spend_ledger.reserve(*self._spend(amount, asset_from))
+        except Exception as e:
+            return self._rejected(e)
+
+        if self.jobs is not None and self.jobs.enabled:
+            return self._queue(reservation, idempotency_key, amount, asset_from, asset_to)
+
+        try:
+            result = self.api.trade_assets(self.api.default_wallet_id, asset_from, asset_to, trade_amount)
+        except Exception as e:
+            self.spend_ledger.settle(reservation, e)
+            return self._failure(e)
+        self.spend_ledger.settle(reservation)
+        return self._result(result, amount, asset_from, asset_to)
+
+    async def _arun(
+        self,
+        amount: str,
+        asset_from: str,
+        asset_to: str,
+        idempotency_key: Optional[str] = None,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments
+    ) -> str:
+        try:
+            trade_amount = to_trade_amount(amount, asset_decimals(asset_from))
+            reservation = await self.spend_ledger.areserve(*self._spend(amount, asset_from))
         except Exception as e:
-            return f"Trade failed: {str(e)}"
+            return self._rejected(e)
+
+        if self.jobs is not None and self.jobs.enabled:
+            return await asyncio.to_thread(self._queue, reservation, idempotency_key, amount, asset_from, asset_to)
+
+        try:
+            result = await self.async_api.trade_assets(self.async_api.default_wallet_id, asset_from, asset_to, trade_amount)
+        except Exception as e:
+            await self.spend_ledger.asettle(reservation, e)
+            return self._failure(e)
+        await self.spend_ledger.asettle(reservation)
+        return self._result(result, amount, asset_from, asset_to)
+
+    def _spend(self, amount, asset_from):
+        """Arguments for SpendLedger.reserve/areserve. Trades spend `asset_from`, so it is what the policy caps."""
+        return current_user_id.get() or self.api.default_wallet_id, self.name, asset_from, amount
+
+    def _rejected(self, error) -> str:
+        # Bad amounts and unlisted assets (ValueError) are rejected like policy violations
+        if isinstance(error, (ValueError, SpendPolicyViolation)):
+            return f"Trade rejected: {str(error)}"
+        return self._failure(error)
+
+    def _failure(self, error) -> str:
+        return f"Trade failed: {truncate(str(error))}"
+
+    def _result(self, result, amount, asset_from, asset_to) -> str:
+        # The trading address's cached balance is stale now
+        if self.balances is not None:
+            self.balances.invalidate(resolve(result, "trade.model.address_id"))
+        return f"Trade successful: {TRADE_ASSETS.dumps(result, **self._estimate(amount, asset_from, asset_to))}"
+
+    def _estimate(self, amount, asset_from, asset_to) -> dict:
+        quote = self.quotes.cached(asset_from, asset_to) if self.quotes is not None else None
+        if quote is None:
+            return {}
+        return {"quoted_price": format(quote.price, "f"), "quoted_to_amount": format(Decimal(amount) * quote.price, "f")}
+
+    def _queue(self, reservation, idempotency_key, amount, asset_from, asset_to) -> str:
+        params = {"amount": amount, "asset_from": asset_from, "asset_to": asset_to}
+        try:
+            job = self.jobs.submit("trade", params, reservation.user_id, idempotency_key, reservation)
+        except Exception as e:
+            self.spend_ledger.release(reservation)
+            return self._failure(e)
+        return dumps({**job, "message": self._queued_message(job)}, separators=(",", ":"))
+
+    def _queued_message(self, job) -> str:
+        if job.get("deduplicated"):
+            return "Not sent again: a trade with this idempotency key was already submitted; this is its status"
+        return "Trade queued; check on it with GetTransferStatus"
 
 # Only works on mainnet
 ## Usage example:
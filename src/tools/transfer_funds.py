@@ -1,18 +1,29 @@
-from typing import Optional, Type
+import asyncio
+from typing import TYPE_CHECKING, Any, Optional, Type
 from json import dumps
 from langchain.pydantic_v1 import BaseModel, Field
-from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 from langchain_core.tools import BaseTool
-from tools.coinbase_api import CoinbaseAPIWrapper  # Import our API wrapper
+from tools.coinbase_api import AsyncCoinbaseAPIWrapper, CoinbaseAPIWrapper  # Import our API wrappers
+from tools.context import current_user_id
+from tools.projection import TRANSFER_FUNDS, resolve, truncate
+from balances import BalanceCache
+from spend_policy import SpendLedger, SpendPolicy, SpendPolicyViolation
 import logging
 
-logging.basicConfig(level=logging.INFO)
+if TYPE_CHECKING:
+    from transfer_jobs import TransferJobQueue
+else:
+    # The job queue's module loads the SQLAlchemy models; building the tool shouldn't
+    TransferJobQueue = Any
+
 logger = logging.getLogger(__name__)
 
 class TransferFundsInput(BaseModel):
     source_wallet_id: str = Field(description="The wallet ID from which ETH will be sent")
     destination_wallet_address: str = Field(description="The wallet address to which ETH will be sent")
     amount: str = Field(description="The amount of ETH to send (as a string, e.g., '0.1')")
+    idempotency_key: Optional[str] = Field(None, description="Optional key; repeating a request with the same key never sends twice")
 
 class TransferFundsTool(BaseTool):
     name = "CreateTransfer"
@@ -20,30 +31,117 @@ class TransferFundsTool(BaseTool):
     args_schema: Type[BaseModel] = TransferFundsInput
     return_direct: bool = True
     api: CoinbaseAPIWrapper = None
+    async_api: AsyncCoinbaseAPIWrapper = None
+    spend_ledger: SpendLedger = None
+    # When set and enabled, transfers are queued and run in the background
+    jobs: TransferJobQueue = None
+    # Cached balances of both ends are dropped once a transfer goes through
+    balances: BalanceCache = None
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.api = CoinbaseAPIWrapper()  # Initialize our API wrapper
+        if self.api is None:
+            self.api = CoinbaseAPIWrapper()  # Initialize our API wrapper
+        if self.async_api is None:
+            self.async_api = AsyncCoinbaseAPIWrapper()
+        if self.spend_ledger is None:
+            self.spend_ledger = SpendLedger(SpendPolicy.load())  # In-memory only; the server passes a shared one
 
     def _run(
         self, 
         source_wallet_id: str,
         destination_wallet_address: str, 
         amount: str, 
+        idempotency_key: Optional[str] = None,
         run_manager: Optional[CallbackManagerForToolRun] = None,
         **kwargs  # Absorbs any unexpected keyword arguments
     ) -> str:
+        # Enforce the spend policy before anything reaches the cdp bridge
+        try:
+            reservation = self.spend_ledger.reserve(*self._spend(source_wallet_id, destination_wallet_address, amount))
+        except Exception as e:
+            return self._rejected(e, source_wallet_id, destination_wallet_address, amount)
+
+        if self.jobs is not None and self.jobs.enabled:
+            return self._queue(reservation, idempotency_key, source_wallet_id, destination_wallet_address, amount)
+
         try:
-            logger.info(f"Initiating transfer of {amount} ETH from wallet {source_wallet_id} to address {destination_wallet_address}")
+            self._log_start(source_wallet_id, destination_wallet_address, amount)
             result = self.api.transfer_funds(source_wallet_id, destination_wallet_address, amount)
-            logger.info(f"Transfer result: {result}")
-            # Remove some unneeded text from the result before returning it
-            del result["transfer"]["model"]["transaction"]["unsigned_payload"]
-            del result["transfer"]["model"]["unsigned_payload"]
-            return dumps(result)
         except Exception as e:
-            logger.error(f"Transfer failed from wallet {source_wallet_id} to {destination_wallet_address}: {str(e)}")
-            return f"Transfer failed: {str(e)}"
+            self.spend_ledger.settle(reservation, e)
+            return self._failure(e, source_wallet_id, destination_wallet_address)
+        self.spend_ledger.settle(reservation)
+        return self._result(result, destination_wallet_address, amount)
+
+    async def _arun(
+        self,
+        source_wallet_id: str,
+        destination_wallet_address: str,
+        amount: str,
+        idempotency_key: Optional[str] = None,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        **kwargs  # Absorbs any unexpected keyword arguments
+    ) -> str:
+        try:
+            reservation = await self.spend_ledger.areserve(*self._spend(source_wallet_id, destination_wallet_address, amount))
+        except Exception as e:
+            return self._rejected(e, source_wallet_id, destination_wallet_address, amount)
+
+        if self.jobs is not None and self.jobs.enabled:
+            return await asyncio.to_thread(
+                self._queue, reservation, idempotency_key, source_wallet_id, destination_wallet_address, amount
+            )
+
+        try:
+            self._log_start(source_wallet_id, destination_wallet_address, amount)
+            result = await self.async_api.transfer_funds(source_wallet_id, destination_wallet_address, amount)
+        except Exception as e:
+            await self.spend_ledger.asettle(reservation, e)
+            return self._failure(e, source_wallet_id, destination_wallet_address)
+        await self.spend_ledger.asettle(reservation)
+        return self._result(result, destination_wallet_address, amount)
+
+    def _spend(self, source_wallet_id, destination_wallet_address, amount):
+        """Arguments for SpendLedger.reserve/areserve."""
+        return current_user_id.get() or source_wallet_id, self.name, "eth", amount, destination_wallet_address
+
+    def _rejected(self, error, source_wallet_id, destination_wallet_address, amount) -> str:
+        if isinstance(error, SpendPolicyViolation):
+            logger.info(f"Transfer of {amount} ETH to {destination_wallet_address} rejected: {str(error)}")
+            return f"Transfer rejected: {str(error)}"
+        logger.error(f"Spend policy check failed for wallet {source_wallet_id}: {str(error)}")
+        return f"Transfer failed: {truncate(str(error))}"
+
+    def _log_start(self, source_wallet_id, destination_wallet_address, amount):
+        logger.info("Initiating transfer of %s ETH from wallet %s to address %s", amount, source_wallet_id, destination_wallet_address)
+
+    def _failure(self, error, source_wallet_id, destination_wallet_address) -> str:
+        logger.error(f"Transfer failed from wallet {source_wallet_id} to {destination_wallet_address}: {str(error)}")
+        return f"Transfer failed: {truncate(str(error))}"
+
+    def _result(self, result, destination_wallet_address, amount) -> str:
+        # Cached balances of both ends are stale now
+        if self.balances is not None:
+            self.balances.invalidate(resolve(result, "transfer.model.address_id"), destination_wallet_address)
+        logger.debug("Transfer result: %s", result, extra={"payload": True})
+        return TRANSFER_FUNDS.dumps(result, amount=amount)
+
+    def _queue(self, reservation, idempotency_key, source_wallet_id, destination_wallet_address, amount) -> str:
+        params = {"source_wallet_id": source_wallet_id, "destination_wallet_address": destination_wallet_address, "amount": amount}
+        try:
+            job = self.jobs.submit("transfer", params, reservation.user_id, idempotency_key, reservation)
+        except Exception as e:
+            self.spend_ledger.release(reservation)
+            logger.error(f"Failed to queue transfer from wallet {source_wallet_id}: {str(e)}")
+            return f"Transfer failed: {truncate(str(e))}"
+        logger.info(f"Queued transfer job {job['job_id']} ({job['status']})")
+        return dumps({**job, "message": self._queued_message(job)}, separators=(",", ":"))
+
+    def _queued_message(self, job) -> str:
+        if job.get("deduplicated"):
+            return "Not sent again: a transfer with this idempotency key was already submitted; this is its status"
+        return "Transfer queued; check on it with GetTransferStatus"
 
 # Usage example:
 if __name__ == "__main__":
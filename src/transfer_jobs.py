@@ -0,0 +1,319 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from sqlalchemy import text
+from models import db, TransferJob
+from metrics import TRANSFER_JOB_SECONDS, TRANSFER_JOBS, TRANSFER_JOBS_PENDING_RECEIPTS
+from spend_policy import Reservation
+from pricing import asset_decimals, to_trade_amount
+from tools.projection import TRADE_ASSETS, TRANSFER_FUNDS, resolve
+
+logger = logging.getLogger(__name__)
+
+TRANSFER_JOBS_ENABLED = os.getenv("TRANSFER_JOBS_ENABLED", "false").lower() == "true"
+TRANSFER_JOB_WORKERS = int(os.getenv("TRANSFER_JOB_WORKERS", "4"))
+# How often idle workers look for jobs queued by other processes
+TRANSFER_JOB_POLL_INTERVAL = float(os.getenv("TRANSFER_JOB_POLL_INTERVAL", "1"))
+# How often the receipt tracker checks for a new block
+RECEIPT_POLL_INTERVAL = float(os.getenv("RECEIPT_POLL_INTERVAL", "2"))
+RECEIPT_BATCH_SIZE = int(os.getenv("RECEIPT_BATCH_SIZE", "500"))
+
+# Namespaces for the advisory locks; the two-key forms can't collide with each other or REFILL_LOCK_KEY
+SUBMIT_LOCK_NAMESPACE = 7_415_004
+RECEIPT_LOCK_KEY = 7_415_005
+
+FINAL_STATUSES = ("confirmed", "reverted", "completed", "failed")
+
+
+def job_view(job):
+    """What GetTransferStatus and the enqueueing tools report for a job."""
+    view = {"job_id": job.id, "kind": job.kind, "status": job.status}
+    for key in ("transaction_hash", "block_number", "result", "error"):
+        value = getattr(job, key)
+        if value is not None:
+            view[key] = value
+    return view
+
+
+class TransferJobQueue:
+    """Runs transfers and trades in the background instead of on the request thread.
+
+    Jobs live in the `transfer_job` table. Every worker thread, in every process, claims queued
+    jobs with SELECT ... FOR UPDATE SKIP LOCKED and runs them against the cdp bridge. A job is
+    only ever attempted once: one left `running` by a crashed worker may or may not have moved
+    funds, so it is left for an operator rather than retried.
+
+    Transactions that were submitted are followed by a single receipt tracker per deployment
+    (whichever process holds RECEIPT_LOCK_KEY). On every new block it fetches the receipts of
+    all pending jobs in one JSON-RPC batch.
+    """
+
+    def __init__(
+        self,
+        app,
+        api,
+        web3_provider_url,
+        spend_ledger=None,
+        balances=None,
+        enabled=TRANSFER_JOBS_ENABLED,
+        workers=TRANSFER_JOB_WORKERS,
+        poll_interval=TRANSFER_JOB_POLL_INTERVAL,
+        receipt_poll_interval=RECEIPT_POLL_INTERVAL,
+    ):
+        self.app = app
+        self.api = api
+        self.web3_provider_url = web3_provider_url
+        self._web3 = None
+        self.spend_ledger = spend_ledger
+        # A balances.BalanceCache whose entries for the addresses a job moved funds from or to are dropped
+        self.balances = balances
+        self.enabled = enabled
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.receipt_poll_interval = receipt_poll_interval
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    @property
+    def web3(self):
+        # Built on first use so importing this module (and the tools that queue jobs) stays cheap
+        if self._web3 is None:
+            from web3 import Web3
+            self._web3 = Web3(Web3.HTTPProvider(self.web3_provider_url))
+        return self._web3
+
+    def start(self):
+        """Create the job table if needed and start the workers and the receipt tracker."""
+        with self.app.app_context():
+            TransferJob.__table__.create(db.engine, checkfirst=True)
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work_loop, name=f"transfer-job-{i}", daemon=True))
+        self._threads.append(threading.Thread(target=self._receipt_loop, name="transfer-receipts", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, kind, params, user_id=None, idempotency_key=None, reservation=None):
+        """Queue a job and return its view.
+
+        Only an explicit idempotency key deduplicates: a repeat of a key the same user already
+        used returns the existing job, marked `deduplicated`. Requests without a key always get a
+        new job, so a user who deliberately sends the same amount twice gets two transfers.
+        """
+        # Keys are per user; another user's job is never returned
+        scoped_key = f"{user_id}:{idempotency_key}" if idempotency_key else None
+        with self.app.app_context():
+            try:
+                if scoped_key:
+                    # Serializes submissions with the same key so only one of them creates a job
+                    db.session.execute(
+                        text("SELECT pg_advisory_xact_lock(:namespace, hashtext(:key))"),
+                        {"namespace": SUBMIT_LOCK_NAMESPACE, "key": scoped_key},
+                    )
+                    existing = TransferJob.query.filter_by(idempotency_key=scoped_key).first()
+                    if existing is not None:
+                        view = {**job_view(existing), "deduplicated": True}
+                        db.session.rollback()
+                        TRANSFER_JOBS.labels(kind=kind, status="deduplicated").inc()
+                        # The duplicate's reservation would otherwise stay counted forever
+                        if reservation is not None and self.spend_ledger is not None:
+                            self.spend_ledger.release(reservation)
+                        return view
+
+                job_id = str(uuid.uuid4())
+                job = TransferJob(
+                    id=job_id,
+                    # Scoped keys always contain a colon, so a bare job id never collides with one
+                    idempotency_key=scoped_key or job_id,
+                    user_id=user_id,
+                    kind=kind,
+                    params=params,
+                    asset=reservation.asset if reservation else None,
+                    reservation_id=reservation.entry_id if reservation else None,
+                )
+                db.session.add(job)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        TRANSFER_JOBS.labels(kind=kind, status="queued").inc()
+        self._wakeup.set()
+        return {"job_id": job_id, "kind": kind, "status": "queued"}
+
+    def get(self, job_id, user_id):
+        """Return the view of `user_id`'s job, or None if that user has no such job."""
+        with self.app.app_context():
+            job = TransferJob.query.filter_by(id=job_id, user_id=user_id).first()
+            view = job_view(job) if job is not None else None
+            db.session.rollback()
+        return view
+
+    def receipt(self, transaction_hash):
+        """Fetch a receipt directly, for jobs the tracker hasn't caught up with yet."""
+        try:
+            return self.web3.eth.get_transaction_receipt(transaction_hash)
+        except Exception:
+            return None
+
+    def _claim(self):
+        with self.app.app_context():
+            try:
+                job = (
+                    TransferJob.query
+                    .filter_by(status="queued")
+                    .order_by(TransferJob.timestamp)
+                    .with_for_update(skip_locked=True)
+                    .first()
+                )
+                if job is None:
+                    db.session.rollback()
+                    return None
+                job.status = "running"
+                claimed = (job.id, job.kind, dict(job.params), job.user_id, job.asset, job.reservation_id, job.timestamp)
+                db.session.commit()
+                return claimed
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _execute(self, kind, params):
+        """Run the cdp call. Returns (projected result, transaction hash or None, addresses whose balance changed)."""
+        if kind == "transfer":
+            raw = self.api.transfer_funds(params["source_wallet_id"], params["destination_wallet_address"], params["amount"])
+            result, hash_path = TRANSFER_FUNDS.project(raw, amount=params["amount"]), "transfer.model.transaction.transaction_hash"
+            addresses = (resolve(raw, "transfer.model.address_id"), params["destination_wallet_address"])
+        elif kind == "trade":
+            trade_amount = to_trade_amount(params["amount"], asset_decimals(params["asset_from"]))
+            raw = self.api.trade_assets(self.api.default_wallet_id, params["asset_from"], params["asset_to"], trade_amount)
+            result, hash_path = TRADE_ASSETS.project(raw), "trade.model.transaction.transaction_hash"
+            addresses = (resolve(raw, "trade.model.address_id"),)
+        else:
+            raise ValueError(f"Unknown job kind {kind}")
+        return result, resolve(raw, hash_path, None), addresses
+
+    def _update(self, job_id, **values):
+        with self.app.app_context():
+            try:
+                TransferJob.query.filter_by(id=job_id).update(values)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def run_one(self):
+        """Claim and run a single queued job. Returns False if there was nothing to do."""
+        claimed = self._claim()
+        if claimed is None:
+            return False
+        job_id, kind, params, user_id, asset, reservation_id, _ = claimed
+        reservation = Reservation(user_id, asset, reservation_id) if reservation_id is not None else None
+        start = time.perf_counter()
+        try:
+            result, transaction_hash, addresses = self._execute(kind, params)
+        except Exception as e:
+            logger.error(f"Transfer job {job_id} failed: {str(e)}")
+            if reservation is not None and self.spend_ledger is not None:
+                self.spend_ledger.settle(reservation, e)
+            self._update(job_id, status="failed", error=str(e)[:1000])
+            TRANSFER_JOBS.labels(kind=kind, status="failed").inc()
+            return True
+        finally:
+            TRANSFER_JOB_SECONDS.labels(kind=kind).observe(time.perf_counter() - start)
+
+        if reservation is not None and self.spend_ledger is not None:
+            self.spend_ledger.settle(reservation)
+        if self.balances is not None:
+            self.balances.invalidate(*addresses)
+        status = "submitted" if transaction_hash else "completed"
+        self._update(job_id, status=status, result=result, transaction_hash=transaction_hash)
+        TRANSFER_JOBS.labels(kind=kind, status=status).inc()
+        return True
+
+    def _work_loop(self):
+        while True:
+            try:
+                if self.run_one():
+                    continue
+            except Exception as e:
+                logger.error(f"Transfer job worker error: {str(e)}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _fetch_receipts(self, hashes):
+        """Return (status, block number) per hash, or None where there is no receipt yet."""
+        make_batch_request = getattr(self.web3.provider, "make_batch_request", None)
+        if make_batch_request is None:
+            # Provider doesn't support batching (e.g. in-process test providers)
+            receipts = [self.receipt(transaction_hash) for transaction_hash in hashes]
+            return [(receipt["status"], receipt["blockNumber"]) if receipt else None for receipt in receipts]
+
+        # Raw batch rather than web3.batch_requests(), which fails the whole batch when any
+        # transaction is still unmined
+        responses = make_batch_request([("eth_getTransactionReceipt", [transaction_hash]) for transaction_hash in hashes])
+        receipts = [response.get("result") for response in responses]
+        return [
+            (int(receipt["status"], 16), int(receipt["blockNumber"], 16)) if receipt and receipt.get("blockNumber") else None
+            for receipt in receipts
+        ]
+
+    def track_receipts(self):
+        """Resolve every submitted job whose receipt is now available. Returns how many were."""
+        with self.app.app_context():
+            pending = (
+                db.session.query(TransferJob.id, TransferJob.transaction_hash)
+                .filter_by(status="submitted")
+                .order_by(TransferJob.timestamp)
+                .limit(RECEIPT_BATCH_SIZE)
+                .all()
+            )
+            db.session.rollback()
+        TRANSFER_JOBS_PENDING_RECEIPTS.set(len(pending))
+        if not pending:
+            return 0
+
+        resolved = 0
+        for (job_id, _), receipt in zip(pending, self._fetch_receipts([transaction_hash for _, transaction_hash in pending])):
+            if receipt is None:
+                continue
+            status = "confirmed" if receipt[0] == 1 else "reverted"
+            self._update(job_id, status=status, block_number=receipt[1])
+            TRANSFER_JOBS.labels(kind="receipt", status=status).inc()
+            resolved += 1
+        TRANSFER_JOBS_PENDING_RECEIPTS.set(len(pending) - resolved)
+        return resolved
+
+    def _track_while_leader(self):
+        """Track receipts for as long as this process holds RECEIPT_LOCK_KEY.
+
+        The session lock sits on an AUTOCOMMIT connection, so holding it never leaves a
+        transaction open (and idle_in_transaction_session_timeout never kills it). Errors in one
+        round are logged and the next round runs; only losing the connection gives up the lock.
+        """
+        last_block = None
+        with self.app.app_context(), db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+            if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": RECEIPT_LOCK_KEY}).scalar():
+                return
+            try:
+                while True:
+                    try:
+                        block = self.web3.eth.block_number
+                        if block != last_block:
+                            self.track_receipts()
+                            last_block = block
+                    except Exception as e:
+                        logger.error(f"Receipt tracker error: {str(e)}")
+                    time.sleep(self.receipt_poll_interval)
+                    # Fails once the connection is gone, and with it the lock
+                    lock_conn.execute(text("SELECT 1"))
+            finally:
+                if not lock_conn.closed and not lock_conn.invalidated:
+                    lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RECEIPT_LOCK_KEY})
+
+    def _receipt_loop(self):
+        while True:
+            time.sleep(self.receipt_poll_interval)
+            try:
+                self._track_while_leader()
+            except Exception as e:
+                logger.error(f"Receipt tracker lost its database connection: {str(e)}")
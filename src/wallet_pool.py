@@ -0,0 +1,205 @@
+import os
+import time
+import logging
+import threading
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from models import db, PooledWallet, UserWallet
+from metrics import WALLET_POOL_CLAIM_SECONDS, WALLET_POOL_CLAIMS, WALLET_POOL_CREATED, WALLET_POOL_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Off by default: when on, every worker start tops the pool up with real cdp wallets
+WALLET_POOL_ENABLED = os.getenv("WALLET_POOL_ENABLED", "false").lower() == "true"
+WALLET_POOL_LOW_WATERMARK = int(os.getenv("WALLET_POOL_LOW_WATERMARK", "5"))
+WALLET_POOL_HIGH_WATERMARK = int(os.getenv("WALLET_POOL_HIGH_WATERMARK", "20"))
+WALLET_POOL_REFILL_INTERVAL = float(os.getenv("WALLET_POOL_REFILL_INTERVAL", "30"))
+
+# Arbitrary constant; only one process across all workers refills the pool at a time
+REFILL_LOCK_KEY = 7_415_001
+
+
+def save_wallet(user_id, wallet_id, wallet_address):
+    """Assign a wallet to `user_id` unless it already has one. Returns the user's (wallet_id, address)."""
+    stmt = (
+        insert(UserWallet)
+        .values(user_id=user_id, wallet_id=wallet_id, wallet_address=wallet_address)
+        .on_conflict_do_nothing(index_elements=[UserWallet.user_id])
+        .returning(UserWallet.wallet_id)
+    )
+    try:
+        inserted = db.session.execute(stmt).scalar()
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Failed to save wallet info: {str(e)}")
+        db.session.rollback()
+        raise
+    if inserted is None:
+        existing = UserWallet.query.filter_by(user_id=user_id).first()
+        return existing.wallet_id, existing.wallet_address
+    logger.debug("Saved wallet info to database: user_id=%s, wallet_id=%s", user_id, wallet_id)
+    return wallet_id, wallet_address
+
+
+class WalletPool:
+    """Background-replenished pool of pre-created MPC wallets.
+
+    Wallets sit unassigned in the `pooled_wallet` table. A first-time user claims one with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent claims never block each other or hand out
+    the same wallet. A daemon thread tops the pool back up to the high watermark whenever it
+    drops below the low watermark.
+    """
+
+    def __init__(
+        self,
+        app,
+        api,
+        enabled=WALLET_POOL_ENABLED,
+        low_watermark=WALLET_POOL_LOW_WATERMARK,
+        high_watermark=WALLET_POOL_HIGH_WATERMARK,
+        refill_interval=WALLET_POOL_REFILL_INTERVAL,
+    ):
+        self.app = app
+        self.api = api
+        self.enabled = enabled
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.refill_interval = refill_interval
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Create the pool table if needed and start the refill worker."""
+        with self.app.app_context():
+            PooledWallet.__table__.create(db.engine, checkfirst=True)
+        self._thread = threading.Thread(target=self._refill_loop, name="wallet-pool-refill", daemon=True)
+        self._thread.start()
+
+    def depth(self):
+        """Count unclaimed wallets. Requires an app context."""
+        depth = db.session.query(db.func.count(PooledWallet.id)).scalar()
+        WALLET_POOL_DEPTH.set(depth)
+        return depth
+
+    def claim(self, user_id):
+        """Atomically assign a pooled wallet to `user_id`.
+
+        Returns ((wallet_id, address), is_new), or None when the pool is empty or the claim fails.
+        If another worker assigned the user a wallet first, the pooled wallet stays in the pool and
+        the user's existing wallet is returned with is_new False.
+        """
+        start = time.perf_counter()
+        try:
+            pooled = (
+                PooledWallet.query
+                .order_by(PooledWallet.id)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if pooled is None:
+                db.session.rollback()
+                WALLET_POOL_CLAIMS.labels(result="miss").inc()
+                self._wakeup.set()
+                return None
+
+            # Move the wallet to the user inside the same transaction as the row lock
+            claimed = (pooled.wallet_id, pooled.wallet_address)
+            inserted = db.session.execute(
+                insert(UserWallet)
+                .values(user_id=user_id, wallet_id=claimed[0], wallet_address=claimed[1])
+                .on_conflict_do_nothing(index_elements=[UserWallet.user_id])
+                .returning(UserWallet.wallet_id)
+            ).scalar()
+            if inserted is None:
+                # Lost the race for this user; keep the pooled wallet for someone else
+                db.session.rollback()
+                existing = UserWallet.query.filter_by(user_id=user_id).first()
+                WALLET_POOL_CLAIMS.labels(result="raced").inc()
+                return (existing.wallet_id, existing.wallet_address), False
+            db.session.delete(pooled)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to claim pooled wallet for user_id {user_id}: {str(e)}")
+            WALLET_POOL_CLAIMS.labels(result="error").inc()
+            return None
+
+        WALLET_POOL_CLAIM_SECONDS.observe(time.perf_counter() - start)
+        WALLET_POOL_CLAIMS.labels(result="hit").inc()
+        WALLET_POOL_DEPTH.dec()
+        if self.depth() < self.low_watermark:
+            self._wakeup.set()
+        return claimed, True
+
+    def assign(self, user_id, create):
+        """The user's wallet, claimed from the pool or made with `create` when there is none to claim.
+
+        `create` returns (wallet_id, address) for a new cdp wallet. Returns ((wallet_id, address),
+        is_new) and requires an app context. Concurrent calls for one user end with one wallet: the
+        losers get the winner's, and a wallet one of them created goes back to the pool.
+        """
+        existing = UserWallet.query.filter_by(user_id=user_id).first()
+        if existing:
+            return (existing.wallet_id, existing.wallet_address), False
+
+        claimed = self.claim(user_id) if self.enabled else None
+        if claimed:
+            return claimed
+
+        wallet_id, wallet_address = create()
+        saved = save_wallet(user_id, wallet_id, wallet_address)
+        if saved[0] != wallet_id:
+            # Another worker assigned a wallet first; recycle ours rather than orphan it
+            if self.enabled:
+                self.release(wallet_id, wallet_address)
+            else:
+                logger.warning(f"Discarding duplicate wallet {wallet_id} created for user_id: {user_id}")
+            return saved, False
+        return saved, True
+
+    def release(self, wallet_id, wallet_address):
+        """Return an unassigned wallet to the pool. Requires an app context."""
+        try:
+            db.session.add(PooledWallet(wallet_id=wallet_id, wallet_address=wallet_address))
+            db.session.commit()
+            WALLET_POOL_DEPTH.inc()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to return wallet {wallet_id} to the pool: {str(e)}")
+
+    def _create_wallet(self):
+        result = self.api.create_wallet()
+        wallet = self.api.get_wallet(result["walletId"])
+        return result["walletId"], wallet["wallet"]["addresses"][0]["id"]
+
+    def refill(self):
+        """Top the pool up to the high watermark if it is below the low watermark.
+
+        The session lock sits on an AUTOCOMMIT connection, so holding it through the slow cdp
+        calls never leaves a transaction open.
+        """
+        with self.app.app_context(), db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+            if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": REFILL_LOCK_KEY}).scalar():
+                return
+            try:
+                depth = self.depth()
+                if depth >= self.low_watermark:
+                    return
+                logger.info(f"Wallet pool at {depth}, refilling to {self.high_watermark}")
+                for _ in range(self.high_watermark - depth):
+                    wallet_id, wallet_address = self._create_wallet()
+                    db.session.add(PooledWallet(wallet_id=wallet_id, wallet_address=wallet_address))
+                    db.session.commit()
+                    WALLET_POOL_CREATED.inc()
+                    WALLET_POOL_DEPTH.inc()
+            finally:
+                lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": REFILL_LOCK_KEY})
+
+    def _refill_loop(self):
+        while True:
+            try:
+                self.refill()
+            except Exception as e:
+                logger.error(f"Wallet pool refill failed: {str(e)}")
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()